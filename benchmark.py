@@ -0,0 +1,351 @@
+# benchmark.py
+"""End-to-end throughput benchmark of AnnTool against a local mock of the OpenAI API.
+
+Generates a synthetic VisDrone-like dataset (images, color and noncolor info files,
+plus the few-shot example images the prompts refer to, which are loaded but not
+processed), starts ``mock_openai.py`` and
+runs each flow in its own process:
+
+    color     AnnTool.color_run
+    noncolor  AnnTool.noncolor_run
+    route     main.process_images_with_checkcolor (caption + checkcolor, then routing)
+
+For every flow it reports images/second, p50/p95/p99 latency of each stage, bytes
+uploaded per image, CPU time per request and peak RSS, and appends one JSON record per
+run to ``BENCH_OUTPUT`` so results of different versions can be compared. The last
+record with the same configuration is used as the baseline of the printed comparison.
+
+Configuration (environment): BENCH_IMAGES, BENCH_SEED, BENCH_FLOWS, BENCH_MOCK_PORT,
+BENCH_WORK_DIR, BENCH_OUTPUT and MAX_IN_FLIGHT; MOCK_* variables are passed to the mock.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import requests
+from PIL import Image
+from dotenv import load_dotenv
+load_dotenv()
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+
+FLOWS = ('color', 'noncolor', 'route')
+CLASS_NAMES = ['pedestrian', 'people', 'bicycle', 'car', 'van', 'truck', 'tricycle', 'awning-tricycle', 'bus', 'motor']
+COLORS = ['black', 'blue', 'green', 'red', 'white', 'yellow']
+COLOR_RGB = {'black': (20, 20, 20), 'blue': (40, 60, 200), 'green': (40, 160, 60), 'red': (200, 40, 40),
+             'white': (235, 235, 235), 'yellow': (220, 200, 40)}
+IMAGE_SIZE = (1360, 765)
+EXAMPLE_NAME_PATTERN = re.compile(r"\d{7}_\d{5}_d_\d{7}")
+# Stats of the mock that are compared before and after each flow
+MOCK_COUNTERS = ('requests', 'request_bytes', 'ok', '429', '5xx', 'rate_limited', 'prompt_tokens', 'completion_tokens')
+
+
+def make_image(path, objects, rng):
+    """Write a road-scene-like JPEG: a noisy gray background with colored boxes at the object centers."""
+    width, height = IMAGE_SIZE
+    base = rng.integers(70, 140)
+    pixels = rng.normal(base, 18, size=(height, width, 3)).clip(0, 255).astype(np.uint8)
+    for _, color, (x, y) in objects:
+        w, h = rng.integers(12, 48), rng.integers(12, 48)
+        x0, y0 = int(x * width - w / 2), int(y * height - h / 2)
+        pixels[max(0, y0):y0 + h, max(0, x0):x0 + w] = COLOR_RGB[color]
+    Image.fromarray(pixels).save(path, quality=90)
+
+
+def make_dataset(root, num_images, seed=0, prompt_root=None):
+    """Generate a synthetic VisDrone-like dataset under ``root``.
+
+    Info files use the formats written by color_classification/get_color.py
+    ("class, color: [x, y]" and "class: [x, y]"). All images, including the few-shot
+    example images named in the prompt directories, are generated in ``all_image_dir``,
+    where the tools load them from; ``image_dir`` links only the ``num_images`` images
+    to process, so the example images are neither processed nor counted.
+
+    Returns:
+        (image_dir, all_image_dir, color_info_dir, noncolor_info_dir)
+    """
+    rng = np.random.default_rng(seed)
+    image_dir = os.path.join(root, 'images')
+    all_image_dir = os.path.join(root, 'all_images')
+    color_info_dir = os.path.join(root, 'color_info')
+    noncolor_info_dir = os.path.join(root, 'noncolor_info')
+    for dir_path in (image_dir, all_image_dir, color_info_dir, noncolor_info_dir):
+        os.makedirs(dir_path, exist_ok=True)
+
+    image_names = [f"{9000000 + i:07d}_00000_d_{i:07d}.jpg" for i in range(num_images)]
+    prompt_root = prompt_root or os.path.join(project_root, 'prompts')
+    example_names = set()
+    for prompt_dir in os.listdir(prompt_root):
+        for prompt_name in os.listdir(os.path.join(prompt_root, prompt_dir)):
+            match = EXAMPLE_NAME_PATTERN.match(prompt_name)
+            if match:
+                example_names.add(match.group(0) + '.jpg')
+
+    for image_name in image_names + sorted(example_names - set(image_names)):
+        objects = []
+        for _ in range(rng.integers(5, 60)):
+            center = (round(float(rng.uniform(0.02, 0.98)), 3), round(float(rng.uniform(0.02, 0.98)), 3))
+            objects.append((CLASS_NAMES[rng.integers(len(CLASS_NAMES))], COLORS[rng.integers(len(COLORS))], center))
+        make_image(os.path.join(all_image_dir, image_name), objects, rng)
+        info_name = image_name.replace('.jpg', '.txt')
+        with open(os.path.join(color_info_dir, info_name), 'w') as f_color, \
+                open(os.path.join(noncolor_info_dir, info_name), 'w') as f_noncolor:
+            for class_name, color, (x, y) in objects:
+                f_color.write(f"{class_name}, {color}: [{x}, {y}]\n")
+                f_noncolor.write(f"{class_name}: [{x}, {y}]\n")
+    for image_name in image_names:
+        path = os.path.join(image_dir, image_name)
+        if not os.path.exists(path):
+            try:
+                os.link(os.path.join(all_image_dir, image_name), path)
+            except OSError:
+                shutil.copyfile(os.path.join(all_image_dir, image_name), path)
+    return image_dir, all_image_dir, color_info_dir, noncolor_info_dir
+
+
+def start_mock(port, log_path):
+    """Start mock_openai.py on ``port`` and wait until it answers."""
+    env = dict(os.environ, MOCK_PORT=str(port))
+    log_file = open(log_path, 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(project_root, 'mock_openai.py')],
+                               env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/mock/stats", timeout=1)
+            return process
+        except requests.RequestException:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Mock server did not start, see {log_path}")
+
+
+def get_mock_stats(port):
+    return requests.get(f"http://127.0.0.1:{port}/mock/stats", timeout=10).json()
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of ``values`` (q in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(np.ceil(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process; ru_maxrss is in KB on Linux and bytes on macOS."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_flow(flow, dirs, env, log_path, result_queue):
+    """Run one flow in this (child) process and put its raw measurements on ``result_queue``."""
+    os.environ.update(env)
+    sys.stdout = open(log_path, 'w', buffering=1)
+    sys.path.insert(0, project_root)
+    from get_annotation.rdannotator import AnnTool
+
+    # Time every stage request at the single point all flows go through
+    durations, failures = {}, {}
+    arun_stage_image = AnnTool.arun_stage_image
+
+    async def timed_arun_stage_image(self, stage, img_name):
+        start = time.perf_counter()
+        try:
+            return await arun_stage_image(self, stage, img_name)
+        except Exception:
+            failures[stage] = failures.get(stage, 0) + 1
+            raise
+        finally:
+            durations.setdefault(stage, []).append(time.perf_counter() - start)
+    AnnTool.arun_stage_image = timed_arun_stage_image
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    if flow == 'route':
+        from get_annotation.main import process_images_with_checkcolor
+        process_images_with_checkcolor()
+    else:
+        anntool = AnnTool(image_dir=env['IMAGE_DIR'], all_image_dir=env['ALL_IMAGE_DIR'],
+                          color_info_dir=env['COLOR_INFO_DIR'],
+                          **{name.lower(): env[name] for name in dirs})
+        if flow == 'color':
+            anntool.color_run(env['IMAGE_DIR'])
+        else:
+            anntool.noncolor_run(env['IMAGE_DIR'])
+    result_queue.put({'wall_s': time.perf_counter() - wall_start, 'cpu_s': time.process_time() - cpu_start,
+                      'peak_rss_mb': peak_rss_mb(), 'durations': durations, 'failures': failures})
+
+
+def benchmark_flow(flow, dataset, work_dir, port):
+    """Run ``flow`` in a fresh process with empty output directories and return its metrics."""
+    image_dir, all_image_dir, color_info_dir, noncolor_info_dir = dataset
+    save_root = os.path.join(work_dir, 'output', flow)
+    dirs = ['CAPTION_SAVE_DIR', 'COLOR_CHECK_SAVE_DIR', 'COLOR_ANNOTATOR_SAVE_DIR', 'NONCOLOR_ANNOTATOR_SAVE_DIR',
+            'COLOR_CHECK_ANNOTATION_SAVE_DIR', 'NONCOLOR_CHECK_ANNOTATION_SAVE_DIR',
+            'COLOR_REGENERATE_ANNOTATOR_SAVE_DIR', 'NONCOLOR_REGENERATE_ANNOTATOR_SAVE_DIR']
+    env = {name: os.path.join(save_root, name.lower().replace('_save_dir', '')) for name in dirs}
+    env.update({
+        'IMAGE_DIR': image_dir,
+        'ALL_IMAGE_DIR': all_image_dir,
+        'COLOR_INFO_DIR': color_info_dir,
+        'NONCOLOR_INFO_DIR': noncolor_info_dir,
+        'PROMPT_ROOT': os.path.join(project_root, 'prompts'),
+        'OPENAI_API_URL': f"http://127.0.0.1:{port}/v1/chat/completions",
+        'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY') or 'benchmark',
+        # measure the requests, not the caches of earlier runs
+        'CACHE_DIR': os.path.join(work_dir, 'cache', flow),
+        'RESPONSE_CACHE': '0',
+        'TOKEN_LEDGER': os.path.join(work_dir, 'token_ledger', f'{flow}.sqlite'),
+        'RUN_MANIFEST': os.path.join(work_dir, 'run_manifest', f'{flow}.sqlite'),
+        'LOG_DIR': os.path.join(work_dir, 'logs'),
+    })
+    num_images = len([f for f in os.listdir(image_dir) if f.endswith('.jpg')])
+
+    before = get_mock_stats(port)
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=run_flow, args=(flow, dirs, env, os.path.join(work_dir, f'{flow}.log'),
+                                                     result_queue))
+    process.start()
+    while True:
+        try:
+            raw = result_queue.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"{flow} exited with code {process.exitcode}, see {work_dir}")
+    process.join()
+    after = get_mock_stats(port)
+    served = {name: after.get(name, 0) - before.get(name, 0) for name in MOCK_COUNTERS}
+
+    stages = {}
+    for stage, values in raw['durations'].items():
+        stages[stage] = {
+            'count': len(values),
+            'failed': raw['failures'].get(stage, 0),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+        }
+    return {
+        'flow': flow,
+        'images': num_images,
+        'wall_s': raw['wall_s'],
+        'images_per_s': num_images / raw['wall_s'],
+        'requests': served['requests'],
+        'retried_errors': served['429'] + served['5xx'] + served['rate_limited'],
+        'bytes_uploaded_per_image': served['request_bytes'] / num_images,
+        'prompt_tokens': served['prompt_tokens'],
+        'completion_tokens': served['completion_tokens'],
+        'cpu_s': raw['cpu_s'],
+        'cpu_ms_per_request': raw['cpu_s'] * 1000 / served['requests'] if served['requests'] else None,
+        'peak_rss_mb': raw['peak_rss_mb'],
+        'stages': stages,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=project_root,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baseline(output_path, config):
+    """Last stored record with the same configuration, or None."""
+    if not os.path.exists(output_path):
+        return None
+    baseline = None
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('config') == config:
+                baseline = record
+    return baseline
+
+
+def print_report(record, baseline=None):
+    baseline_flows = {flow['flow']: flow for flow in (baseline or {}).get('flows', [])}
+    for result in record['flows']:
+        previous = baseline_flows.get(result['flow'])
+        change = ""
+        if previous:
+            change = (f" ({result['images_per_s'] / previous['images_per_s'] - 1:+.1%} vs "
+                      f"{baseline['git_commit'] or baseline['timestamp']})")
+        print(f"\n[{result['flow']}] {result['images']} images in {result['wall_s']:.1f} s: "
+              f"{result['images_per_s']:.2f} images/s{change}")
+        print(f"  requests {result['requests']} (retried errors {result['retried_errors']}), "
+              f"{result['bytes_uploaded_per_image'] / 1024:.1f} KB uploaded/image, "
+              f"{result['cpu_ms_per_request']:.1f} ms CPU/request, peak RSS {result['peak_rss_mb']:.0f} MB")
+        for stage, stats in result['stages'].items():
+            print(f"  {stage:32s} n={stats['count']:<5d} failed={stats['failed']:<3d} "
+                  f"p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms")
+
+
+def main():
+    num_images = int(os.getenv('BENCH_IMAGES', '50'))
+    seed = int(os.getenv('BENCH_SEED', '0'))
+    flows = [flow.strip() for flow in os.getenv('BENCH_FLOWS', ','.join(FLOWS)).split(',') if flow.strip()]
+    for flow in flows:
+        if flow not in FLOWS:
+            raise ValueError(f"Unknown flow: {flow} (expected one of {', '.join(FLOWS)})")
+    port = int(os.getenv('BENCH_MOCK_PORT', '8011'))
+    output_path = os.getenv('BENCH_OUTPUT', os.path.join(project_root, 'benchmark_results.jsonl'))
+    work_dir = os.getenv('BENCH_WORK_DIR')
+    remove_work_dir = not work_dir
+    work_dir = work_dir or tempfile.mkdtemp(prefix='rdannotator_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    config = {
+        'images': num_images,
+        'seed': seed,
+        'max_in_flight': int(os.getenv('MAX_IN_FLIGHT', '32')),
+        'mock': {name: value for name, value in sorted(os.environ.items()) if name.startswith('MOCK_')},
+    }
+    print(f"Generating {num_images} synthetic images in {work_dir}")
+    dataset = make_dataset(os.path.join(work_dir, 'data'), num_images, seed=seed)
+    mock = start_mock(port, os.path.join(work_dir, 'mock.log'))
+    try:
+        results = []
+        for flow in flows:
+            print(f"Running {flow} (log: {os.path.join(work_dir, flow + '.log')})")
+            results.append(benchmark_flow(flow, dataset, work_dir, port))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'flows': results,
+    }
+    print_report(record, load_baseline(output_path, config))
+    with open(output_path, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"\nResults appended to {output_path}")
+    if remove_work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
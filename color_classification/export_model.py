@@ -0,0 +1,114 @@
+"""Export the color classifier to TorchScript and ONNX and check the exports against the eager model.
+
+The TorchScript model is frozen and optimized for inference, which folds every
+batch norm into the preceding convolution. The ONNX model is exported with constant
+folding, and ONNX Runtime fuses it further when the session is created. Each export
+is run on a held-out crop set from the VCoR test split and compared with the eager
+model; the export fails if their predictions agree on too few crops.
+
+Configuration (environment): COLOR_MODEL_FILE, COLOR_EXPORT_FORMATS, VCOR_TEST_DIR,
+COLOR_CHECK_SAMPLES, COLOR_EXPORT_MIN_AGREEMENT, COLOR_NUM_THREADS, COLOR_BATCH_SIZE.
+"""
+import os
+import random
+import time
+
+import torch
+from vocr_dataset import VCoR
+from get_color import backend_path, load_color_model, script_dir
+
+
+def export_torchscript(model, path):
+    """Script, freeze and optimize the eager model for CPU inference."""
+    scripted = torch.jit.optimize_for_inference(torch.jit.script(model.eval()))
+    torch.jit.save(scripted, path)
+
+
+def export_onnx(model, path):
+    """Export the eager model to ONNX with a dynamic batch dimension."""
+    dummy = torch.randn(1, 3, 32, 32)
+    torch.onnx.export(model.eval(), dummy, path, input_names=['crops'], output_names=['logits'],
+                      dynamic_axes={'crops': {0: 'batch'}, 'logits': {0: 'batch'}},
+                      opset_version=17, do_constant_folding=True)
+
+
+EXPORTERS = {
+    'torchscript': export_torchscript,
+    'onnx': export_onnx,
+}
+
+
+def load_check_set(root, num_samples, seed=0):
+    """Random crops of the VCoR split at ``root`` with their color indices.
+
+    Returns:
+        (N x 3 x 32 x 32 crops, N labels)
+    """
+    dataset = VCoR(root)
+    indices = random.Random(seed).sample(range(len(dataset)), min(num_samples, len(dataset)))
+    crops, labels = [], []
+    for index in indices:
+        crop, label, _ = dataset[index]
+        crops.append(crop)
+        labels.append(int(label.argmax()))
+    return torch.stack(crops), torch.tensor(labels)
+
+
+def predict(model, crops, batch_size):
+    """Logits of all crops and the seconds the model took."""
+    outputs = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in range(0, len(crops), batch_size):
+            outputs.append(model(crops[i:i + batch_size]))
+    return torch.cat(outputs), time.perf_counter() - start
+
+
+def compare(name, logits, seconds, reference_logits, labels):
+    """Print how a backend's predictions compare with the eager model; returns the agreement."""
+    predictions = logits.argmax(dim=1)
+    agreement = (predictions == reference_logits.argmax(dim=1)).float().mean().item()
+    accuracy = (predictions == labels).float().mean().item()
+    max_diff = (logits - reference_logits).abs().max().item()
+    print(f"  {name:<12} accuracy {accuracy*100:6.2f}%  agreement with eager {agreement*100:6.2f}%  "
+          f"max |logit diff| {max_diff:.2e}  {seconds / len(logits) * 1000:.3f} ms/crop")
+    return agreement
+
+
+if __name__ == '__main__':
+    model_file = os.getenv('COLOR_MODEL_FILE') or os.path.join(script_dir, 'wide_resnet_color_model_99_89.80.pth')
+    formats = [name.strip() for name in os.getenv('COLOR_EXPORT_FORMATS', 'torchscript,onnx').split(',') if name.strip()]
+    check_dir = os.getenv('VCOR_TEST_DIR', '/data/sunzc/VCoR/test_v2')
+    num_samples = int(os.getenv('COLOR_CHECK_SAMPLES', '1024'))
+    min_agreement = float(os.getenv('COLOR_EXPORT_MIN_AGREEMENT', '0.99'))
+    num_threads = int(os.getenv('COLOR_NUM_THREADS') or 0) or None
+    batch_size = int(os.getenv('COLOR_BATCH_SIZE', '256'))
+
+    for name in formats:
+        if name not in EXPORTERS:
+            raise ValueError(f"Unknown export format: {name}")
+    if num_samples and not os.path.exists(check_dir):
+        raise ValueError(f"VCoR test directory does not exist: {check_dir}")
+
+    model = load_color_model(model_file, num_threads=num_threads)
+    for name in formats:
+        path = backend_path(model_file, name)
+        EXPORTERS[name](model, path)
+        print(f"Exported {name} model to {path}")
+
+    if not num_samples:
+        print("COLOR_CHECK_SAMPLES=0: exported models were not checked")
+    else:
+        crops, labels = load_check_set(check_dir, num_samples)
+        print(f"Checking on {len(crops)} crops of {check_dir}")
+        reference_logits, seconds = predict(model, crops, batch_size)
+        compare('eager', reference_logits, seconds, reference_logits, labels)
+        failed = []
+        for name in formats:
+            backend_model = load_color_model(model_file, backend=name, num_threads=num_threads)
+            logits, seconds = predict(backend_model, crops, batch_size)
+            if compare(name, logits, seconds, reference_logits, labels) < min_agreement:
+                failed.append(name)
+        if failed:
+            raise RuntimeError(f"Predictions of {', '.join(failed)} agree with the eager model on fewer "
+                               f"than {min_agreement*100:.2f}% of the crops")
@@ -5,9 +5,16 @@ import torch.nn as nn
 import torchvision.models as models
 from vocr_dataset import VCoR
 from torchvision import transforms
+from torchvision.io import ImageReadMode, read_image
+from torchvision.ops import roi_align
 from PIL import Image
 from dotenv import load_dotenv
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 # Add project root to Python path
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(script_dir)
@@ -31,6 +38,306 @@ class CustomWideResNet101(nn.Module):
     def forward(self, x):
         return self.wide_resnet(x)
 
+
+# Backends the classifier can run with; the exported ones are written next to the
+# state dict by export_model.py, the INT8 one by quantize_model.py
+BACKENDS = ('eager', 'torchscript', 'onnx', 'int8')
+
+
+def backend_path(model_file, backend):
+    """Path of the model file of ``backend`` for the state dict ``model_file``."""
+    if backend == 'eager':
+        return model_file
+    if backend == 'torchscript':
+        return os.path.splitext(model_file)[0] + '.torchscript.pt'
+    if backend == 'onnx':
+        return os.path.splitext(model_file)[0] + '.onnx'
+    if backend == 'int8':
+        return os.path.splitext(model_file)[0] + '.int8.pt'
+    raise ValueError(f"Unknown color model backend: {backend}")
+
+
+class OnnxColorModel():
+    """Color classifier run by ONNX Runtime on CPU, called like the PyTorch model."""
+
+    def __init__(self, path, num_threads=None):
+        """Initialize the session.
+
+        Args:
+            path: Exported ONNX model
+            num_threads: Intra-op threads (default: ONNX Runtime's choice)
+        """
+        if ort is None:
+            raise ValueError("The onnx color model backend requires onnxruntime")
+        options = ort.SessionOptions()
+        # Constant folding and conv-bn fusion, among others
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        return torch.from_numpy(self.session.run(None, {self.input_name: x.cpu().numpy()})[0])
+
+
+def load_color_model(model_file, backend='eager', device='cpu', num_threads=None):
+    """Load the color classifier for inference.
+
+    Args:
+        model_file: State dict of CustomWideResNet101
+        backend: "eager" loads the state dict; "torchscript" and "onnx" load the
+            artifacts written by export_model.py next to it, "int8" the quantized
+            model written by quantize_model.py, and run on CPU
+        device: Device of the eager model
+        num_threads: Intra-op CPU threads (default: the library's choice)
+
+    Returns:
+        Callable mapping an N x 3 x 32 x 32 batch to N x 6 logits
+    """
+    path = backend_path(model_file, backend)
+    if not os.path.exists(path):
+        raise ValueError(f"Model file does not exist: {path}")
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if backend == 'onnx':
+        return OnnxColorModel(path, num_threads=num_threads)
+    if backend in ('torchscript', 'int8'):
+        return torch.jit.load(path, map_location='cpu')
+    model = CustomWideResNet101()
+    model.load_state_dict(torch.load(path, map_location='cpu'))
+    model.eval()
+    return model.to(device)
+
+
+COLOR_MAPPING = {
+    0: 'black', 1: 'blue', 2: 'green', 3: 'red', 4: 'white', 5: 'yellow'
+}
+
+CLASS_NAME_LIST = ['ignored regions', 'pedestrian', 'people', 'bicycle', 'car', 'van', 'truck', 'tricycle', 'awning-tricycle', 'bus', 'motor', 'others']
+
+NORMALIZE_MEAN = [0.48145466, 0.4578275, 0.40821073]
+NORMALIZE_STD = [0.26862954, 0.26130258, 0.27577711]
+
+transform = transforms.Compose([
+    transforms.Resize(size=(32, 32), interpolation=Image.BICUBIC),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD)
+])
+
+
+def crop_and_resize(image, bboxes):
+    """Crop every box of a decoded image to 32x32 at once and normalize the crops.
+
+    ROI align averages an adaptive number of bilinear samples per output pixel, so
+    large boxes are smoothed much like the bicubic resize of the PIL path.
+
+    Args:
+        image: 3 x H x W uint8 image tensor
+        bboxes: [x1, y1, x2, y2] pixel boxes
+
+    Returns:
+        N x 3 x 32 x 32 tensor
+    """
+    boxes = torch.tensor(bboxes, dtype=torch.float32)
+    crops = roi_align(image.unsqueeze(0).float().div_(255), [boxes], output_size=(32, 32),
+                      sampling_ratio=-1, aligned=True)
+    return transforms.functional.normalize(crops, NORMALIZE_MEAN, NORMALIZE_STD)
+
+
+def parse_annotation(ann_path, image_size):
+    """Read the objects to classify from a VisDrone annotation file.
+
+    Small objects, ignored regions and "others" are skipped, as are invalid lines.
+
+    Args:
+        ann_path: Path of the annotation file
+        image_size: (width, height) of the image
+
+    Returns:
+        List of (bbox, class_name, normal_center_point)
+    """
+    objects = []
+    with open(ann_path, "r") as f:
+        for line in f.readlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            line_parts = line.split(',')
+            if len(line_parts) < 6:
+                continue
+
+            try:
+                x1, y1, w, h = map(int, line_parts[:4])
+                class_num = int(line_parts[5])
+
+                # Skip small objects
+                if w * h <= 128:
+                    continue
+
+                # Skip ignored regions and others
+                if class_num == 0 or class_num == 11:
+                    continue
+
+                # Calculate bounding box with padding
+                bbox = [max(0, x1-4), max(0, y1-4),
+                       min(image_size[0], x1 + w - 4),
+                       min(image_size[1], y1 + h - 4)]
+
+                # Skip invalid bboxes
+                if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+                    continue
+
+                # Calculate normalized center point
+                center_point = [(x1 + 0.5 * w), (y1 + 0.5 * h)]
+                normal_center_point = [
+                    round(center_point[0] / image_size[0], 3),
+                    round(center_point[1] / image_size[1], 3)
+                ]
+
+                objects.append((bbox, CLASS_NAME_LIST[class_num], normal_center_point))
+
+            except (ValueError, IndexError) as e:
+                # Skip invalid annotation lines
+                continue
+    return objects
+
+
+class ObjectCropDataset(torch.utils.data.Dataset):
+    """The annotated objects of each image, decoded, cropped and transformed.
+
+    One item per image, so a DataLoader's workers decode and crop images in parallel
+    while the model classifies the crops of earlier ones.
+    """
+
+    def __init__(self, image_paths, ann_paths, crop='pil'):
+        """Initialize the dataset.
+
+        Args:
+            image_paths: Paths of the images
+            ann_paths: Paths of their VisDrone annotation files
+            crop: "pil" to crop and resize the boxes one by one with PIL as the
+                classifier was trained, or "roi_align" to decode each image into a
+                tensor and crop all its boxes in one batched (bilinear) operation
+        """
+        if crop not in ('roi_align', 'pil'):
+            raise ValueError(f"Unknown crop mode: {crop}")
+        self.image_paths = image_paths
+        self.ann_paths = ann_paths
+        self.crop = crop
+
+    def __getitem__(self, index):
+        """Return (objects, crops, error) of an image.
+
+        ``crops`` is an N x 3 x 32 x 32 tensor with one crop per object. Errors are
+        returned instead of raised, so one unreadable image does not stop the loader.
+        """
+        try:
+            if self.crop == 'roi_align':
+                image = read_image(self.image_paths[index], ImageReadMode.RGB)
+                image_size = (image.shape[2], image.shape[1])
+            else:
+                image = Image.open(self.image_paths[index]).convert('RGB')
+                image_size = image.size
+            objects = parse_annotation(self.ann_paths[index], image_size)
+            if not objects:
+                return objects, torch.empty(0, 3, 32, 32), None
+            if self.crop == 'roi_align':
+                return objects, crop_and_resize(image, [bbox for bbox, _, _ in objects]), None
+            return objects, torch.stack([transform(image.crop(bbox)) for bbox, _, _ in objects]), None
+        except Exception as e:
+            return [], torch.empty(0, 3, 32, 32), str(e)
+
+    def __len__(self):
+        return len(self.image_paths)
+
+
+def write_color_info(save_color_ann_path, save_noncolor_ann_path, objects, predictions):
+    """Write the color and noncolor info files of one image."""
+    with open(save_color_ann_path, "w") as f_color_out, open(save_noncolor_ann_path, "w") as f_noncolor_out:
+        for (bbox, class_name, normal_center_point), predicted in zip(objects, predictions):
+            # Write color result: "class_name, color: [x, y]"
+            color_str = f"{class_name}, {COLOR_MAPPING[predicted]}: [{normal_center_point[0]}, {normal_center_point[1]}]"
+            f_color_out.write(color_str + "\n")
+
+            # Write noncolor result: "class_name: [x, y]"
+            noncolor_str = f"{class_name}: [{normal_center_point[0]}, {normal_center_point[1]}]"
+            f_noncolor_out.write(noncolor_str + "\n")
+
+
+class CropBatcher():
+    """Classify the crops of consecutive images in fixed-size batches.
+
+    Crops are queued across images and the model runs whenever ``batch_size`` of them
+    are waiting; an image's info files are written as soon as all its crops are
+    classified.
+    """
+
+    def __init__(self, model, device, batch_size):
+        """Initialize the batcher.
+
+        Args:
+            model: Color classifier in eval mode
+            device: Device the model is on
+            batch_size: Number of crops per forward pass
+        """
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+        self.pending = []
+        self.crops = []
+        self.num_crops = 0
+        self.predictions = []
+        self.processed = 0
+        self.errors = 0
+
+    def add(self, image_name, save_color_ann_path, save_noncolor_ann_path, objects, crops):
+        """Queue the crops (N x 3 x 32 x 32) of one image."""
+        self.pending.append((image_name, save_color_ann_path, save_noncolor_ann_path, objects))
+        self.crops.append(crops)
+        self.num_crops += len(crops)
+        while self.num_crops >= self.batch_size:
+            self.run(self.batch_size)
+        self.write_done()
+
+    def flush(self):
+        """Classify the remaining crops and write every pending image."""
+        if self.num_crops:
+            self.run(self.num_crops)
+        self.write_done()
+
+    def run(self, size):
+        crops = torch.cat(self.crops)
+        self.crops = [crops[size:]]
+        self.num_crops -= size
+        try:
+            with torch.no_grad():
+                outputs = self.model(crops[:size].to(self.device))
+            self.predictions.extend(outputs.argmax(dim=1).tolist())
+        except Exception as e:
+            # The failed batch may hold crops of every pending image
+            for image_name, *_ in self.pending:
+                print(f"Error processing {image_name}: {e}")
+            self.errors += len(self.pending)
+            self.pending = []
+            self.crops = []
+            self.num_crops = 0
+            self.predictions = []
+
+    def write_done(self):
+        while self.pending and len(self.predictions) >= len(self.pending[0][3]):
+            image_name, save_color_ann_path, save_noncolor_ann_path, objects = self.pending.pop(0)
+            predictions = self.predictions[:len(objects)]
+            self.predictions = self.predictions[len(objects):]
+            try:
+                write_color_info(save_color_ann_path, save_noncolor_ann_path, objects, predictions)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Error processing {image_name}: {e}")
+
+
 if __name__ == '__main__':
     # Load paths from environment variables
     image_root = os.getenv('IMAGE_DIR', '/mnt/public/usr/sunzhichao/VisDrone2019/all_image')
@@ -40,13 +347,15 @@ if __name__ == '__main__':
     os.makedirs(color_info_dir, exist_ok=True)
     os.makedirs(noncolor_info_dir, exist_ok=True)
     # Model file path (relative to script directory)
-    model_file = os.path.join(script_dir, 'wide_resnet_color_model_99_89.80.pth')
+    model_file = os.getenv('COLOR_MODEL_FILE') or os.path.join(script_dir, 'wide_resnet_color_model_99_89.80.pth')
+    backend = os.getenv('COLOR_BACKEND', 'eager')
+    num_threads = int(os.getenv('COLOR_NUM_THREADS') or 0) or None
     
     print(f"Using image_root: {image_root}")
     print(f"Using ann_root: {ann_root}")
     print(f"Using color_info_dir: {color_info_dir}")
     print(f"Using noncolor_info_dir: {noncolor_info_dir}")
-    print(f"Using model_file: {model_file}")
+    print(f"Using model_file: {model_file} ({backend} backend)")
     
     # Validate required directories
     if not os.path.exists(image_root):
@@ -55,37 +364,27 @@ if __name__ == '__main__':
     if not os.path.exists(ann_root):
         raise ValueError(f"Annotation directory does not exist: {ann_root}")
     
-    if not os.path.exists(model_file):
-        raise ValueError(f"Model file does not exist: {model_file}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown color model backend: {backend}")
     
     # Create output directory if it doesn't exist
     if not os.path.exists(color_info_dir):
         os.makedirs(color_info_dir, exist_ok=True)
         print(f"Created color_info_dir: {color_info_dir}")
     
-    # Initialize model
-    model = CustomWideResNet101()
-    
-    # Load checkpoint
-    checkpoint = torch.load(model_file, map_location='cpu')
-    model.load_state_dict(checkpoint)
-    model.eval()
-    
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model.to(device)
+    # The exported backends run on CPU
+    device = torch.device('cuda' if torch.cuda.is_available() and backend == 'eager' else 'cpu')
+    model = load_color_model(model_file, backend=backend, device=device, num_threads=num_threads)
     print(f"Using device: {device}")
+
+    # Crops of consecutive images are classified together, batch_size crops per forward pass
+    batch_size = int(os.getenv('COLOR_BATCH_SIZE', '256'))
+    print(f"Using batch size: {batch_size}")
     
-    color_mapping = {
-        0: 'black', 1: 'blue', 2: 'green', 3: 'red', 4: 'white', 5: 'yellow'
-    }
-    
-    transform = transforms.Compose([
-        transforms.Resize(size=(32, 32), interpolation=Image.BICUBIC),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.48145466, 0.4578275, 0.40821073], std=[0.26862954, 0.26130258, 0.27577711])
-    ])
-    
-    class_name_list = ['ignored regions', 'pedestrian', 'people', 'bicycle', 'car', 'van', 'truck', 'tricycle', 'awning-tricycle', 'bus', 'motor', 'others']
+    # Images are decoded and cropped by DataLoader workers while the model runs
+    num_workers = int(os.getenv('COLOR_NUM_WORKERS') or min(8, os.cpu_count() or 1))
+    crop = os.getenv('COLOR_CROP') or 'pil'
+    print(f"Using {num_workers} data loader workers, {crop} crops")
     
     # Supported image extensions
     image_extensions = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
@@ -97,110 +396,47 @@ if __name__ == '__main__':
     print(f"Found {total_images} images to process")
     print("="*60)
     
-    processed_count = 0
     error_count = 0
+    todo = []
     
     for idx, image_name in enumerate(image_names, 1):
-        try:
-            # Get file extension
-            file_ext = os.path.splitext(image_name)[1]
-            image_path = os.path.join(image_root, image_name)
-            ann_name = os.path.splitext(image_name)[0] + '.txt'
-            ann_path = os.path.join(ann_root, ann_name)
-            
-            # Skip if annotation file doesn't exist
-            if not os.path.exists(ann_path):
-                print(f"[{idx}/{total_images}] Skipping {image_name}: annotation file not found")
-                continue
-            
-            # Skip if output files already exist
-            save_color_ann_path = os.path.join(color_info_dir, ann_name)
-            save_noncolor_ann_path = os.path.join(noncolor_info_dir, ann_name)
-            if os.path.exists(save_color_ann_path) and os.path.exists(save_noncolor_ann_path):
-                print(f"[{idx}/{total_images}] Skipping {image_name}: output files already exist")
-                continue
-            
-            image = Image.open(image_path).convert('RGB')
-            image_size = image.size
-            
-            print(f"[{idx}/{total_images}] Processing {image_name}...")
-            
-            # Paths for color and noncolor output files
-            save_color_ann_path = os.path.join(color_info_dir, ann_name)
-            save_noncolor_ann_path = os.path.join(noncolor_info_dir, ann_name)
-            
-            with open(save_color_ann_path, "w") as f_color_out, open(save_noncolor_ann_path, "w") as f_noncolor_out:
-                with open(ann_path, "r") as f:
-                    for line in f.readlines():
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        line_parts = line.split(',')
-                        if len(line_parts) < 6:
-                            continue
-                        
-                        try:
-                            x1, y1, w, h = map(int, line_parts[:4])
-                            class_num = int(line_parts[5])
-                            
-                            # Skip small objects
-                            if w * h <= 128:
-                                continue
-                            
-                            # Skip ignored regions and others
-                            if class_num == 0 or class_num == 11:
-                                continue
-                            
-                            # Calculate bounding box with padding
-                            bbox = [max(0, x1-4), max(0, y1-4), 
-                                   min(image_size[0], x1 + w - 4), 
-                                   min(image_size[1], y1 + h - 4)]
-                            
-                            # Skip invalid bboxes
-                            if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
-                                continue
-                            
-                            # Calculate normalized center point
-                            center_point = [(x1 + 0.5 * w), (y1 + 0.5 * h)]
-                            normal_center_point = [
-                                round(center_point[0] / image_size[0], 3), 
-                                round(center_point[1] / image_size[1], 3)
-                            ]
-                            
-                            class_name = class_name_list[class_num]
-                            
-                            # Crop object region
-                            object_region = image.crop(bbox)
-                            
-                            # Transform and predict
-                            object_region_tensor = transform(object_region)
-                            object_region_tensor = object_region_tensor.unsqueeze(0).to(device)
-                            
-                            with torch.no_grad():
-                                outputs = model(object_region_tensor)
-                                _, predicted = torch.max(outputs.data, 1)
-                            
-                            # Write color result: "class_name, color: [x, y]"
-                            color_str = f"{class_name}, {color_mapping[predicted.item()]}: [{normal_center_point[0]}, {normal_center_point[1]}]"
-                            f_color_out.write(color_str + "\n")
-                            
-                            # Write noncolor result: "class_name: [x, y]"
-                            noncolor_str = f"{class_name}: [{normal_center_point[0]}, {normal_center_point[1]}]"
-                            f_noncolor_out.write(noncolor_str + "\n")
-                            
-                        except (ValueError, IndexError) as e:
-                            # Skip invalid annotation lines
-                            continue
-            
-            processed_count += 1
-            if idx % 100 == 0:
-                print(f"Progress: {idx}/{total_images} images processed")
-                
-        except Exception as e:
+        ann_name = os.path.splitext(image_name)[0] + '.txt'
+        ann_path = os.path.join(ann_root, ann_name)
+        
+        # Skip if annotation file doesn't exist
+        if not os.path.exists(ann_path):
+            print(f"[{idx}/{total_images}] Skipping {image_name}: annotation file not found")
+            continue
+        
+        # Skip if output files already exist
+        save_color_ann_path = os.path.join(color_info_dir, ann_name)
+        save_noncolor_ann_path = os.path.join(noncolor_info_dir, ann_name)
+        if os.path.exists(save_color_ann_path) and os.path.exists(save_noncolor_ann_path):
+            print(f"[{idx}/{total_images}] Skipping {image_name}: output files already exist")
+            continue
+        
+        todo.append((image_name, os.path.join(image_root, image_name), ann_path, save_color_ann_path, save_noncolor_ann_path))
+    
+    dataset = ObjectCropDataset([item[1] for item in todo], [item[2] for item in todo], crop=crop)
+    # batch_size=None: each item is the crops of one image, batched across images by CropBatcher
+    loader = torch.utils.data.DataLoader(dataset, batch_size=None, num_workers=num_workers)
+    batcher = CropBatcher(model, device, batch_size)
+    
+    for idx, ((image_name, _, _, save_color_ann_path, save_noncolor_ann_path), (objects, crops, error)) in enumerate(zip(todo, loader), 1):
+        if error is not None:
             error_count += 1
-            print(f"Error processing {image_name}: {e}")
+            print(f"Error processing {image_name}: {error}")
             continue
+        
+        print(f"[{idx}/{len(todo)}] Processing {image_name}...")
+        batcher.add(image_name, save_color_ann_path, save_noncolor_ann_path, objects, crops)
+        
+        if idx % 100 == 0:
+            print(f"Progress: {idx}/{len(todo)} images processed")
+    
+    batcher.flush()
+    processed_count = batcher.processed
+    error_count += batcher.errors
     
     print("="*60)
     print(f"Processing completed!")
@@ -0,0 +1,123 @@
+"""Static INT8 post-training quantization of the color classifier.
+
+The eager FP32 model is quantized in FX graph mode: convolutions, batch norms and
+ReLUs are fused, observers are calibrated on random crops of the VCoR train split,
+and the model is converted to INT8 kernels of the current quantized engine. The
+quantized and FP32 models are then evaluated on the whole VCoR test split. The
+quantized model is saved for ``COLOR_BACKEND=int8`` only if its accuracy is within
+``COLOR_QUANT_MAX_ACCURACY_DROP`` of the FP32 model; the report is written next to it
+either way.
+
+Configuration (environment): COLOR_MODEL_FILE, VCOR_TRAIN_DIR, VCOR_TEST_DIR,
+COLOR_CALIBRATION_SAMPLES, COLOR_QUANT_MAX_ACCURACY_DROP, COLOR_NUM_THREADS,
+COLOR_NUM_WORKERS, COLOR_BATCH_SIZE.
+"""
+import json
+import os
+import random
+import time
+
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from vocr_dataset import VCoR
+from get_color import COLOR_MAPPING, backend_path, load_color_model, script_dir
+
+
+def quantize(model, calibration_loader):
+    """Return the INT8 version of ``model``, calibrated on the crops of ``calibration_loader``."""
+    engine = torch.backends.quantized.engine
+    example_inputs = (torch.randn(1, 3, 32, 32),)
+    prepared = prepare_fx(model.eval(), get_default_qconfig_mapping(engine), example_inputs)
+    with torch.no_grad():
+        for crops, _, _ in calibration_loader:
+            prepared(crops)
+    return convert_fx(prepared)
+
+
+def evaluate(models, loader):
+    """Accuracy, per-color accuracy and ms/crop of each model, and how often their predictions agree.
+
+    Args:
+        models: Model by name; the first one is the reference for the agreement
+        loader: DataLoader of VCoR (crops, one-hot labels, names)
+    """
+    names = list(models)
+    correct = {name: torch.zeros(len(COLOR_MAPPING)) for name in names}
+    agree = {name: 0 for name in names}
+    seconds = {name: 0.0 for name in names}
+    totals = torch.zeros(len(COLOR_MAPPING))
+    with torch.no_grad():
+        for crops, labels, _ in loader:
+            labels = labels.argmax(dim=1)
+            totals += torch.bincount(labels, minlength=len(COLOR_MAPPING))
+            reference = None
+            for name in names:
+                start = time.perf_counter()
+                predictions = models[name](crops).argmax(dim=1)
+                seconds[name] += time.perf_counter() - start
+                correct[name] += torch.bincount(labels[predictions == labels], minlength=len(COLOR_MAPPING))
+                if reference is None:
+                    reference = predictions
+                agree[name] += (predictions == reference).sum().item()
+    num_crops = int(totals.sum().item())
+    return {
+        name: {
+            'accuracy': correct[name].sum().item() / num_crops,
+            'color_accuracy': {COLOR_MAPPING[i]: (correct[name][i] / totals[i]).item() if totals[i] else None
+                               for i in range(len(COLOR_MAPPING))},
+            'agreement': agree[name] / num_crops,
+            'ms_per_crop': seconds[name] / num_crops * 1000,
+            'crops': num_crops,
+        } for name in names
+    }
+
+
+if __name__ == '__main__':
+    model_file = os.getenv('COLOR_MODEL_FILE') or os.path.join(script_dir, 'wide_resnet_color_model_99_89.80.pth')
+    train_dir = os.getenv('VCOR_TRAIN_DIR', '/data/sunzc/VCoR/train_4_25')
+    test_dir = os.getenv('VCOR_TEST_DIR', '/data/sunzc/VCoR/test_v2')
+    num_samples = int(os.getenv('COLOR_CALIBRATION_SAMPLES', '2048'))
+    max_accuracy_drop = float(os.getenv('COLOR_QUANT_MAX_ACCURACY_DROP', '0.01'))
+    num_threads = int(os.getenv('COLOR_NUM_THREADS') or 0) or None
+    num_workers = int(os.getenv('COLOR_NUM_WORKERS') or min(8, os.cpu_count() or 1))
+    batch_size = int(os.getenv('COLOR_BATCH_SIZE', '256'))
+
+    for path in (train_dir, test_dir):
+        if not os.path.exists(path):
+            raise ValueError(f"VCoR directory does not exist: {path}")
+
+    model = load_color_model(model_file, num_threads=num_threads)
+
+    train_dataset = VCoR(train_dir)
+    indices = random.Random(0).sample(range(len(train_dataset)), min(num_samples, len(train_dataset)))
+    calibration_loader = torch.utils.data.DataLoader(torch.utils.data.Subset(train_dataset, indices),
+                                                     batch_size=batch_size, num_workers=num_workers)
+    print(f"Calibrating on {len(indices)} crops of {train_dir} ({torch.backends.quantized.engine} engine)")
+    quantized = torch.jit.trace(quantize(model, calibration_loader), torch.randn(1, 3, 32, 32))
+
+    test_loader = torch.utils.data.DataLoader(VCoR(test_dir), batch_size=batch_size, num_workers=num_workers)
+    print(f"Evaluating on {len(test_loader.dataset)} crops of {test_dir}")
+    results = evaluate({'fp32': model, 'int8': quantized}, test_loader)
+    for name, result in results.items():
+        colors = "  ".join(f"{color} {accuracy*100:.1f}%" for color, accuracy in result['color_accuracy'].items()
+                           if accuracy is not None)
+        print(f"  {name:<5} accuracy {result['accuracy']*100:6.2f}%  agreement with fp32 {result['agreement']*100:6.2f}%  "
+              f"{result['ms_per_crop']:.3f} ms/crop")
+        print(f"        {colors}")
+
+    accuracy_drop = results['fp32']['accuracy'] - results['int8']['accuracy']
+    path = backend_path(model_file, 'int8')
+    report = {'model_file': model_file, 'engine': torch.backends.quantized.engine, 'calibration_dir': train_dir,
+              'calibration_crops': len(indices), 'test_dir': test_dir, 'accuracy_drop': accuracy_drop,
+              'max_accuracy_drop': max_accuracy_drop, 'saved': accuracy_drop <= max_accuracy_drop, 'results': results}
+    report_path = os.path.splitext(path)[0] + '.report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+
+    if accuracy_drop > max_accuracy_drop:
+        raise RuntimeError(f"INT8 accuracy is {accuracy_drop*100:.2f} points below FP32 "
+                           f"(allowed: {max_accuracy_drop*100:.2f}); the quantized model was not saved")
+    torch.jit.save(quantized, path)
+    print(f"Saved INT8 model to {path}; run get_color.py with COLOR_BACKEND=int8 to use it")
@@ -30,6 +30,7 @@ class VCoR(torch.utils.data.Dataset):
         self.image_names = {}
         self.load_data_list()
         self.load_label_list()
+        self.image_keys = list(self.image_labels.keys())
 
 
     def load_data_list(self):
@@ -101,7 +102,7 @@ class VCoR(torch.utils.data.Dataset):
 
 
     def __getitem__(self, index):
-        image_name = list(self.image_labels.keys())[index]
+        image_name = self.image_keys[index]
         img = Image.open(image_name).convert('RGB')
 
         label = self.image_labels[image_name]
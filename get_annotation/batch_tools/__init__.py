@@ -0,0 +1,5 @@
+from .ingest import IngestStats, ingest_file, ingest_remote
+from .planner import BatchLimits, BatchPlanner, get_batch_limits
+from .resubmit import resubmit_failed
+from .tracker import BatchTracker, get_batch_tracker
+from .writer import BatchWriter
@@ -0,0 +1,225 @@
+"""Stream batch output and error files into per-image result files."""
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple, Union
+
+from ..request_tools.response_cache import get_response_cache
+from ..request_tools.run_manifest import get_run_manifest
+from ..request_tools.token_ledger import TokenLedger, get_token_ledger
+
+# Stages whose saved choices are joined into single lines
+SINGLE_LINE_STAGES = ("caption",)
+
+
+class IngestStats(NamedTuple):
+    saved: int
+    failed: int
+    invalid: int
+
+
+def format_response(body: Dict, stage: str) -> str:
+    """Text saved for a response body, in the format the online tools write."""
+    contents = [choice["message"]["content"] for choice in body["choices"]]
+    if stage in SINGLE_LINE_STAGES:
+        contents = [content.replace("\n", "") for content in contents]
+    return "".join(content + "\n\n" for content in contents)
+
+
+def write_text(path: str, text: str):
+    """Write a file atomically, so an interrupted ingest never leaves a partial result."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def parse_record(line: Union[str, bytes]) -> Tuple[Optional[str], Optional[Dict], Optional[str]]:
+    """Validate one line of a batch output or error file.
+
+    Returns:
+        (custom_id, body, error): ``body`` is set for a usable response and ``error``
+        describes why the request failed; custom_id is None if the line is not a record
+    """
+    try:
+        obj = json.loads(line)
+    except ValueError:
+        return None, None, "invalid JSON"
+    if not isinstance(obj, dict) or not isinstance(obj.get("custom_id"), str):
+        return None, None, "missing custom_id"
+    response = obj.get("response") or {}
+    body = response.get("body") or {}
+    choices = body.get("choices")
+    if response.get("status_code") == 200 and choices and all(
+            isinstance((choice.get("message") or {}).get("content"), str) for choice in choices):
+        return obj["custom_id"], body, None
+    error = obj.get("error") or body.get("error") or f"status {response.get('status_code')}"
+    return obj["custom_id"], None, json.dumps(error)
+
+
+class ResultWriter():
+    """Write results on a background thread as records are parsed.
+
+    Records go through a bounded queue, so parsing (and the download feeding it) keeps
+    running while files are written, and at most ``max_pending`` parsed records are held
+    in memory. Record states are passed to the tracker, the usage of saved results to
+    the token ledger and the saved results to the run manifest, in chunks.
+
+    If storing them fails, the thread keeps draining the queue without writing, so
+    the parser is never blocked, and the error is raised by the next ``put`` or by
+    ``close``; the batch then stays un-ingested and is ingested again later.
+    """
+
+    def __init__(self, save_dir: str, stage: str, batch_id: Optional[str] = None, tracker=None,
+                 max_pending: int = 256, chunk_size: int = 500):
+        """Initialize the writer.
+
+        Args:
+            save_dir: Directory the result files are written to
+            stage: Stage of the results, which selects their format
+            batch_id: Batch the records belong to, used to find their fingerprints in
+                the response cache and to record their state
+            tracker: BatchTracker that stores the record states, or None
+            max_pending: Maximum number of records waiting to be written
+            chunk_size: Number of record states stored at once
+        """
+        self.save_dir = save_dir
+        self.stage = stage
+        self.batch_id = batch_id
+        self.tracker = tracker
+        self.chunk_size = chunk_size
+        self.response_cache = get_response_cache() if batch_id is not None else None
+        self.token_ledger = get_token_ledger()
+        self.image_tokens = tracker.get_image_tokens(batch_id) if tracker is not None and batch_id is not None else {}
+        self.usage_rows = []
+        self.run_manifest = get_run_manifest()
+        self.manifest_rows = []
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.records = []
+        self.saved = 0
+        self.failed = 0
+        self.error: Optional[BaseException] = None
+        os.makedirs(save_dir, exist_ok=True)
+        if self.run_manifest is not None:
+            self.run_manifest.import_dir(stage, save_dir)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, custom_id: str, body: Optional[Dict], error: Optional[str]):
+        self.raise_error()
+        self.queue.put((custom_id, body, error))
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Error storing results of {self.stage} in {self.save_dir}: {self.error}") from self.error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            custom_id, body, error = item
+            try:
+                if body is not None:
+                    save_name = custom_id.replace(".jpg", ".txt")
+                    text = format_response(body, self.stage)
+                    write_text(os.path.join(self.save_dir, save_name), text)
+                    if self.response_cache is not None:
+                        self.response_cache.put_batch_response(self.batch_id, custom_id, body)
+                    self.records.append((custom_id, "done", None))
+                    key = f"batch-{self.batch_id}-{custom_id}" if self.batch_id is not None else None
+                    self.usage_rows.append(TokenLedger.make_row(body, self.stage, custom_id, "batch",
+                                                                self.image_tokens.get(custom_id), key=key))
+                    self.manifest_rows.append((save_name, custom_id, "done", text, None))
+                    self.saved += 1
+                else:
+                    self.records.append((custom_id, "failed", error))
+                    self.failed += 1
+            except Exception as e:
+                logging.error(f"Error saving result of {custom_id}: {e}")
+                self.records.append((custom_id, "failed", json.dumps(str(e))))
+                self.failed += 1
+            if len(self.records) >= self.chunk_size:
+                self.flush_records()
+        if self.error is None:
+            self.flush_records()
+
+    def flush_records(self):
+        try:
+            self.store_records()
+        except Exception as e:
+            logging.error(f"Error storing results of {self.stage} in {self.save_dir}: {e}")
+            self.error = e
+
+    def store_records(self):
+        if self.tracker is not None and self.batch_id is not None and self.records:
+            self.tracker.set_records(self.batch_id, self.records)
+        if self.token_ledger is not None and self.usage_rows:
+            self.token_ledger.record_rows(self.usage_rows)
+        if self.run_manifest is not None and self.manifest_rows:
+            self.run_manifest.record_many(self.stage, self.save_dir, self.manifest_rows)
+        self.records = []
+        self.usage_rows = []
+        self.manifest_rows = []
+
+    def close(self):
+        """Wait until every queued record is written; raises if storing them failed."""
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+
+def ingest_lines(lines: Iterable[Union[str, bytes]], writer: ResultWriter,
+                 only: Optional[Callable[[str], bool]] = None) -> int:
+    """Parse output or error file lines into ``writer`` as they arrive; returns the number of invalid lines.
+
+    With ``only``, records whose custom id it rejects are skipped.
+    """
+    invalid = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        custom_id, body, error = parse_record(line)
+        if custom_id is None:
+            logging.error(f"Skipping batch file line ({error}): {line[:200]!r}")
+            invalid += 1
+            continue
+        if only is not None and not only(custom_id):
+            continue
+        writer.put(custom_id, body, error)
+    return invalid
+
+
+def ingest_file(path: str, save_dir: str, stage: str, batch_id: Optional[str] = None, tracker=None,
+                only: Optional[Callable[[str], bool]] = None) -> IngestStats:
+    """Save the results of a downloaded batch output (or error) file, reading it line by line.
+
+    With ``only``, only the records whose custom id it accepts are saved.
+    """
+    writer = ResultWriter(save_dir, stage, batch_id=batch_id, tracker=tracker)
+    try:
+        with open(path, "r") as f:
+            invalid = ingest_lines(f, writer, only)
+    finally:
+        writer.close()
+    return IngestStats(writer.saved, writer.failed, invalid)
+
+
+def ingest_remote(client, file_ids: Iterable[Optional[str]], save_dir: str, stage: str,
+                  batch_id: Optional[str] = None, tracker=None) -> IngestStats:
+    """Stream batch output and error files from the API and save their results while downloading."""
+    writer = ResultWriter(save_dir, stage, batch_id=batch_id, tracker=tracker)
+    invalid = 0
+    try:
+        for file_id in file_ids:
+            if not file_id:
+                continue
+            with client.files.with_streaming_response.content(file_id) as response:
+                invalid += ingest_lines(response.iter_lines(), writer)
+    finally:
+        writer.close()
+    return IngestStats(writer.saved, writer.failed, invalid)
@@ -0,0 +1,83 @@
+"""Pack batch request lines into shards that stay within the batch API limits."""
+import os
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Limits of one batch input file in the batch API
+API_MAX_REQUESTS = 50000
+API_MAX_BYTES = 200 * 1024 * 1024
+
+
+class BatchLimits(NamedTuple):
+    """Upper bounds of one batch; a None bound is not checked."""
+    max_requests: Optional[int] = API_MAX_REQUESTS
+    max_bytes: Optional[int] = API_MAX_BYTES
+    max_tokens: Optional[int] = None
+
+
+def get_batch_limits() -> BatchLimits:
+    """Read the batch limits from the environment.
+
+    ``BATCH_MAX_REQUESTS`` (default 50000) and ``BATCH_MAX_MB`` (default 190, under the
+    200 MB file limit) bound the request lines and input file size of a batch.
+    ``BATCH_MAX_TOKENS`` bounds its estimated input tokens, which should stay under the
+    enqueued-token limit of the organization; leave it empty to not check tokens.
+    """
+    max_requests = os.getenv('BATCH_MAX_REQUESTS')
+    max_mb = os.getenv('BATCH_MAX_MB')
+    max_tokens = os.getenv('BATCH_MAX_TOKENS')
+    return BatchLimits(
+        max_requests=int(max_requests) if max_requests else API_MAX_REQUESTS,
+        max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else 190 * 1024 * 1024,
+        max_tokens=int(max_tokens) if max_tokens else None,
+    )
+
+
+class BatchPlanner():
+    """Track the size of the shard being filled and decide where to cut the next one.
+
+    Request lines arrive one at a time and are streamed to the input file, so shards
+    are packed greedily in order: a line goes into the current shard unless it would
+    push the request count, byte size or token estimate over a limit, in which case the
+    shard is submitted and a new one started. Every shard except the last is therefore
+    filled up to whichever limit it reaches first.
+    """
+
+    def __init__(self, limits: BatchLimits):
+        """Initialize the planner.
+
+        Args:
+            limits: Bounds of one batch
+        """
+        self.limits = limits
+        self.reset()
+
+    def reset(self):
+        """Start a new, empty shard."""
+        self.requests = 0
+        self.bytes = 0
+        self.tokens = 0
+
+    @staticmethod
+    def within(value: int, limit: Optional[int]) -> bool:
+        return limit is None or value <= limit
+
+    def fits(self, size: int, tokens: int) -> bool:
+        """Whether a line of ``size`` bytes and ``tokens`` input tokens fits in the current shard."""
+        return (self.within(self.requests + 1, self.limits.max_requests)
+                and self.within(self.bytes + size, self.limits.max_bytes)
+                and self.within(self.tokens + tokens, self.limits.max_tokens))
+
+    def oversized(self, size: int, tokens: int) -> bool:
+        """Whether a line exceeds the limits even on its own."""
+        return not (self.within(size, self.limits.max_bytes) and self.within(tokens, self.limits.max_tokens))
+
+    def add(self, size: int, tokens: int):
+        self.requests += 1
+        self.bytes += size
+        self.tokens += tokens
+
+    def is_empty(self) -> bool:
+        return self.requests == 0
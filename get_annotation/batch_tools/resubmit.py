@@ -0,0 +1,73 @@
+"""Submit the failed and expired requests of a stage again."""
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from .tracker import get_batch_tracker
+from .writer import BatchWriter
+
+
+def resubmit_failed(client, stage: str, create_json: Callable[[str], Optional[List[Dict]]], save_dir: str,
+                    max_attempts: Optional[int] = None) -> List[str]:
+    """Rebuild the failed and expired requests of ``stage`` in ``save_dir`` and pack them into new batches.
+
+    The batches of the stage and save_dir are synced first, so results that finished in the meantime
+    are ingested and their errors recorded. Each request to retry is rebuilt with
+    ``create_json`` of the stage's tool and the request parameters of its original
+    batch, then written to a new batch for the same save_dir. Only the requests of
+    ``save_dir`` are retried, since ``create_json`` builds the requests of the tool's
+    own images; other runs of the stage resubmit theirs themselves.
+
+    Args:
+        client: OpenAI client
+        stage: Stage name the batches were submitted under
+        create_json: The tool's ``create_json``, returning the messages of an image
+            (or None to skip it)
+        save_dir: The tool's save_dir the batches were submitted for
+        max_attempts: Batches a request may fail in before it is given up on
+            (default ``BATCH_MAX_ATTEMPTS`` or 3)
+
+    Returns:
+        Ids of the submitted batches
+    """
+    if max_attempts is None:
+        max_attempts = int(os.getenv('BATCH_MAX_ATTEMPTS', '3'))
+    tracker = get_batch_tracker()
+    tracked = [batch["batch_id"] for batch in tracker.get_batches(stage) if batch["save_dir"] == save_dir]
+    tracker.sync(client, stage=stage, batch_ids=tracked)
+    records = tracker.get_retry_records(stage, save_dir, max_attempts)
+    if not records:
+        return []
+
+    groups = {}
+    for record in records:
+        groups.setdefault(record["params"], []).append(record)
+
+    batch_ids = []
+    for params, group in groups.items():
+        if params is None:
+            logging.error(f"No request parameters recorded for {len(group)} failed requests of {stage} in {save_dir}, "
+                          f"run the batch script again to resubmit them")
+            continue
+        params = json.loads(params)
+        resubmitted, skipped = [], []
+        with BatchWriter(client, stage=stage, save_dir=save_dir) as writer:
+            for record in group:
+                messages = create_json(record["custom_id"])
+                if messages is None:
+                    skipped.append(record)
+                    continue
+                writer.add(record["custom_id"], dict(params, messages=messages))
+                if record["custom_id"] not in writer.skipped:
+                    resubmitted.append(record)
+        # requests the writer did not queue keep their state and are retried next time
+        tracker.mark_records(resubmitted, "resubmitted")
+        tracker.mark_records(skipped, "skipped")
+        batch_ids.extend(writer.batch_ids)
+        print(f"resubmitted {len(resubmitted)} failed requests of {stage} to {save_dir}, "
+              f"{len(skipped)} no longer built, {len(group) - len(resubmitted) - len(skipped)} not queued")
+    return batch_ids
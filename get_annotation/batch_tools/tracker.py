@@ -0,0 +1,264 @@
+"""Persistent record of submitted batches: status polling, result download and ingest."""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from .ingest import ingest_remote
+
+# Batch statuses after which the batch no longer changes
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchTracker():
+    """SQLite record of every submitted batch and the request lines it contains.
+
+    ``BatchWriter`` adds each batch with its stage, save_dir, request parameters and
+    custom ids when it is submitted. ``poll`` retrieves only the batches that have not reached a terminal
+    status, and ``ingest`` streams the output and error files of finished batches in
+    parallel and writes each result to ``save_dir``. Records are marked as they are
+    written and batches once fully ingested, so ingest can be re-run at any time.
+    """
+
+    def __init__(self, path: str, max_workers: int = 8):
+        """Initialize the tracker.
+
+        Args:
+            path: SQLite database file
+            max_workers: Number of batches polled or downloaded concurrently
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS batches ("
+                          "batch_id TEXT PRIMARY KEY, stage TEXT NOT NULL, save_dir TEXT NOT NULL, "
+                          "status TEXT NOT NULL, output_file_id TEXT, error_file_id TEXT, "
+                          "created REAL NOT NULL, updated REAL NOT NULL, ingested INTEGER NOT NULL DEFAULT 0, "
+                          "params TEXT)")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(batches)")]
+        if "params" not in columns:
+            self.conn.execute("ALTER TABLE batches ADD COLUMN params TEXT")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS batch_records ("
+                          "batch_id TEXT NOT NULL, custom_id TEXT NOT NULL, state TEXT NOT NULL, error TEXT, "
+                          "image_tokens INTEGER, PRIMARY KEY (batch_id, custom_id))")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(batch_records)")]
+        if "image_tokens" not in columns:
+            self.conn.execute("ALTER TABLE batch_records ADD COLUMN image_tokens INTEGER")
+        self.conn.commit()
+
+    def add_batch(self, batch_id: str, stage: str, save_dir: str, custom_ids: Iterable[str] = (),
+                  params: Optional[Dict] = None, image_tokens: Optional[List[int]] = None):
+        """Record a submitted batch, its request lines and the request parameters shared by them.
+
+        ``image_tokens`` holds the estimated image tokens of each request line, in the
+        order of ``custom_ids``, for the token ledger.
+        """
+        custom_ids = list(custom_ids)
+        image_tokens = image_tokens or [None] * len(custom_ids)
+        now = time.time()
+        params = json.dumps(params) if params is not None else None
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO batches (batch_id, stage, save_dir, status, created, updated, "
+                              "params) VALUES (?, ?, ?, 'validating', ?, ?, ?)",
+                              (batch_id, stage, save_dir, now, now, params))
+            self.conn.executemany("INSERT OR IGNORE INTO batch_records VALUES (?, ?, 'pending', NULL, ?)",
+                                  [(batch_id, custom_id, tokens) for custom_id, tokens in zip(custom_ids, image_tokens)])
+            self.conn.commit()
+
+    def track(self, batch_ids: Iterable[str], stage: str, save_dir: str):
+        """Record batches submitted without the tracker, e.g. from an old batch id file.
+
+        Batches already known keep their stage and save_dir.
+        """
+        for batch_id in batch_ids:
+            if batch_id:
+                self.add_batch(batch_id, stage, save_dir)
+
+    def get_batches(self, stage: Optional[str] = None, where: str = "1",
+                    batch_ids: Optional[Iterable[str]] = None) -> List[sqlite3.Row]:
+        query = f"SELECT * FROM batches WHERE ({where})"
+        params = []
+        if stage is not None:
+            query += " AND stage = ?"
+            params.append(stage)
+        if batch_ids is not None:
+            batch_ids = [batch_id for batch_id in batch_ids if batch_id]
+            query += f" AND batch_id IN ({', '.join('?' * len(batch_ids))})"
+            params.extend(batch_ids)
+        with self.lock:
+            return self.conn.execute(query + " ORDER BY created", params).fetchall()
+
+    def update_batch(self, batch_id: str, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.conn.execute(f"UPDATE batches SET {assignments} WHERE batch_id = ?", [*fields.values(), batch_id])
+            self.conn.commit()
+
+    def set_records(self, batch_id: str, records: List[tuple]):
+        """Store (custom_id, state, error) of request lines of a batch."""
+        with self.lock:
+            self.conn.executemany("INSERT INTO batch_records (batch_id, custom_id, state, error) VALUES (?, ?, ?, ?) "
+                                  "ON CONFLICT (batch_id, custom_id) DO UPDATE SET state = excluded.state, "
+                                  "error = excluded.error",
+                                  [(batch_id, *record) for record in records])
+            self.conn.commit()
+
+    def get_image_tokens(self, batch_id: str) -> Dict[str, int]:
+        """Estimated image tokens of the request lines of a batch, by custom id."""
+        with self.lock:
+            rows = self.conn.execute("SELECT custom_id, image_tokens FROM batch_records "
+                                     "WHERE batch_id = ? AND image_tokens IS NOT NULL", (batch_id,)).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def poll(self, client, stage: Optional[str] = None,
+             batch_ids: Optional[Iterable[str]] = None) -> List[sqlite3.Row]:
+        """Refresh the status of the unfinished batches and return all batches of ``stage``.
+
+        With ``batch_ids``, only those batches are polled and returned.
+        """
+        if batch_ids is not None:
+            batch_ids = list(batch_ids)
+        statuses = ", ".join(f"'{status}'" for status in TERMINAL_STATUSES)
+        unfinished = [batch["batch_id"] for batch in self.get_batches(stage, f"status NOT IN ({statuses})", batch_ids)]
+
+        def retrieve(batch_id):
+            try:
+                batch = client.batches.retrieve(batch_id)
+            except Exception as e:
+                logging.error(f"Error retrieving batch {batch_id}: {e}")
+                return
+            self.update_batch(batch_id, status=batch.status, output_file_id=batch.output_file_id,
+                              error_file_id=batch.error_file_id)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(retrieve, unfinished))
+        return self.get_batches(stage, batch_ids=batch_ids)
+
+    def ingest_batch(self, client, batch: sqlite3.Row) -> int:
+        """Stream the output and error files of a finished batch and save its results; returns the number saved."""
+        stats = ingest_remote(client, [batch["output_file_id"], batch["error_file_id"]], batch["save_dir"],
+                              batch["stage"], batch_id=batch["batch_id"], tracker=self)
+        self.update_batch(batch["batch_id"], ingested=1)
+        print(f"batch {batch['batch_id']} ({batch['stage']}): saved {stats.saved} results to {batch['save_dir']}, "
+              f"{stats.failed} failed, {stats.invalid} invalid lines")
+        return stats.saved
+
+    def ingest(self, client, stage: Optional[str] = None, batch_ids: Optional[Iterable[str]] = None) -> int:
+        """Save the results of every finished, not yet ingested batch (of ``batch_ids``); returns the number saved."""
+        batches = []
+        for batch in self.get_batches(stage, where="ingested = 0", batch_ids=batch_ids):
+            if batch["status"] not in TERMINAL_STATUSES:
+                continue
+            if batch["output_file_id"] or batch["error_file_id"]:
+                batches.append(batch)
+            else:
+                # failed validation or expired before any request ran: all its records stay pending
+                self.update_batch(batch["batch_id"], ingested=1)
+
+        def ingest_one(batch):
+            try:
+                return self.ingest_batch(client, batch)
+            except Exception as e:
+                logging.error(f"Error ingesting batch {batch['batch_id']}: {e}")
+                return 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return sum(executor.map(ingest_one, batches))
+
+    def in_flight(self, stage: str, save_dir: str) -> Set[str]:
+        """Custom ids of requests in batches of ``stage`` and ``save_dir`` that are not ingested yet."""
+        with self.lock:
+            rows = self.conn.execute("SELECT r.custom_id FROM batch_records r JOIN batches b USING (batch_id) "
+                                     "WHERE b.stage = ? AND b.save_dir = ? AND b.ingested = 0",
+                                     (stage, save_dir)).fetchall()
+        return {row[0] for row in rows}
+
+    def get_retry_records(self, stage: str, save_dir: str, max_attempts: int) -> List[sqlite3.Row]:
+        """Failed and expired requests of ``stage`` and ``save_dir`` to submit again.
+
+        A request is retried if its latest record in an ingested batch is failed, or
+        still pending because the batch expired, was cancelled or failed validation. It
+        is not retried once it succeeded, while it is in a batch that is not ingested
+        yet, or after ``max_attempts`` unsuccessful batches.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT r.batch_id, r.custom_id, r.state, b.save_dir, b.params, b.ingested FROM batch_records r "
+                "JOIN batches b USING (batch_id) WHERE b.stage = ? AND b.save_dir = ? ORDER BY b.created",
+                (stage, save_dir)).fetchall()
+        done, waiting, attempts, latest = set(), set(), {}, {}
+        for row in rows:
+            key = row["custom_id"]
+            if row["state"] == "done":
+                done.add(key)
+            elif not row["ingested"]:
+                waiting.add(key)
+            else:
+                attempts[key] = attempts.get(key, 0) + 1
+                latest[key] = row
+        return [row for key, row in latest.items()
+                if key not in done and key not in waiting and row["state"] in ("failed", "pending")
+                and attempts[key] < max_attempts]
+
+    def mark_records(self, records: Iterable[sqlite3.Row], state: str):
+        """Set the state of retry records: "resubmitted" once their requests are in a new
+        batch, "skipped" if the tool no longer builds a request for them."""
+        with self.lock:
+            self.conn.executemany("UPDATE batch_records SET state = ? WHERE batch_id = ? AND custom_id = ?",
+                                  [(state, record["batch_id"], record["custom_id"]) for record in records])
+            self.conn.commit()
+
+    def summary(self, stage: Optional[str] = None, batch_ids: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """Number of batches per status."""
+        counts = {}
+        for batch in self.get_batches(stage, batch_ids=batch_ids):
+            counts[batch["status"]] = counts.get(batch["status"], 0) + 1
+        return counts
+
+    def sync(self, client, stage: Optional[str] = None, batch_ids: Optional[Iterable[str]] = None) -> int:
+        """Poll the unfinished batches, then ingest the finished ones; returns the number of results saved.
+
+        With ``batch_ids`` (e.g. the ids of a batch id file), only those batches are
+        synced instead of every batch of ``stage``.
+        """
+        if batch_ids is not None:
+            batch_ids = list(batch_ids)
+        self.poll(client, stage, batch_ids)
+        saved = self.ingest(client, stage, batch_ids)
+        print(f"batches: {self.summary(stage, batch_ids)}, saved {saved} results")
+        return saved
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_batch_tracker() -> BatchTracker:
+    """Return the batch tracker shared by this process.
+
+    The state database is ``BATCH_DB`` (default ``./batches.sqlite``) and
+    ``BATCH_DOWNLOAD_WORKERS`` batches are polled or downloaded at once (default 8).
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = BatchTracker(os.getenv('BATCH_DB', './batches.sqlite'),
+                                        max_workers=int(os.getenv('BATCH_DOWNLOAD_WORKERS', '8')))
+    return _tracker
@@ -0,0 +1,181 @@
+"""Stream batch API request lines to a spooled file and submit them as batches."""
+import logging
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from ..request_tools.rate_limiter import estimate_message_image_tokens, estimate_message_tokens
+from ..request_tools.response_cache import RequestFingerprint, canonical_json, get_response_cache
+from .planner import BatchLimits, BatchPlanner, get_batch_limits
+from .tracker import get_batch_tracker
+
+# Encodings and token estimates of recently written messages kept for reuse, keyed by object identity
+MESSAGE_MEMO_SIZE = 256
+
+
+class BatchWriter():
+    """Write batch request lines one at a time and upload them in size-limited batches.
+
+    Each line is serialized and appended to a ``SpooledTemporaryFile`` as soon as it is
+    added, which stays in memory up to ``spool_bytes`` and moves to disk beyond that,
+    so memory use does not grow with the number of images. Only the custom ids and
+    fingerprints of the pending lines are kept. The few-shot messages that every line
+    repeats are the same objects from line to line, so their encoding is reused.
+
+    A new batch is cut whenever the next line would take the current one over a limit
+    on request count, file size or estimated input tokens (see ``BatchPlanner``).
+    """
+
+    def __init__(self, client, stage: Optional[str] = None, save_dir: Optional[str] = None,
+                 limits: Optional[BatchLimits] = None, endpoint: str = "/v1/chat/completions",
+                 completion_window: str = "24h", spool_bytes: int = 64 * 1024 * 1024):
+        """Initialize the writer.
+
+        Args:
+            client: OpenAI client used to upload the input file and create the batch
+            stage: Stage name the batches are recorded under in the batch tracker, or None
+                to not record them
+            save_dir: Directory the results of the batches are ingested into
+            limits: Bounds of one batch, by default read by ``get_batch_limits``
+            endpoint: API endpoint of every request line
+            completion_window: Completion window of the created batches
+            spool_bytes: Size of the input file kept in memory before it spills to disk
+        """
+        self.client = client
+        self.stage = stage
+        self.save_dir = save_dir
+        self.planner = BatchPlanner(limits or get_batch_limits())
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+        self.spool_bytes = spool_bytes
+        self.response_cache = get_response_cache()
+        self.memo = OrderedDict()
+        self.spool = None
+        self.fingerprints = []
+        self.image_tokens = []
+        self.params = None
+        self.in_flight = None
+        self.batch_ids: List[str] = []
+        # Custom ids that add() did not queue: still in flight or over the batch limits
+        self.skipped: Set[str] = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.close()
+
+    def encode_message(self, message: Dict) -> Tuple[bytes, int, int]:
+        """Canonical JSON encoding, estimated tokens and estimated image tokens of one message."""
+        key = id(message)
+        entry = self.memo.get(key)
+        if entry is not None and entry[0] is message:
+            self.memo.move_to_end(key)
+            return entry[1:]
+        encoded = canonical_json(message)
+        tokens = estimate_message_tokens([message])
+        image_tokens = estimate_message_image_tokens([message])
+        self.memo[key] = (message, encoded, tokens, image_tokens)
+        if len(self.memo) > MESSAGE_MEMO_SIZE:
+            self.memo.popitem(last=False)
+        return encoded, tokens, image_tokens
+
+    def encode_line(self, custom_id: str, body: Dict) -> Tuple[bytes, int, int, str]:
+        """Return the request line for ``body``, its estimated input and image tokens and the request fingerprint."""
+        params = {key: value for key, value in body.items() if key != "messages"}
+        encoded_messages = []
+        tokens = 0
+        image_tokens = 0
+        for message in body.get("messages") or []:
+            encoded_message, message_tokens, message_image_tokens = self.encode_message(message)
+            encoded_messages.append(encoded_message)
+            tokens += message_tokens
+            image_tokens += message_image_tokens
+        fingerprint = RequestFingerprint(params)
+        for encoded_message in encoded_messages:
+            fingerprint.add_message(encoded_message)
+        head = canonical_json({"custom_id": custom_id, "method": "POST", "url": self.endpoint})[:-1]
+        encoded_params = canonical_json(params)[:-1]
+        line = b"".join([head, b',"body":', encoded_params, b',"messages":[' if params else b'"messages":[',
+                         b",".join(encoded_messages), b"]}}\n"])
+        return line, tokens, image_tokens, fingerprint.hexdigest()
+
+    def add(self, custom_id: str, body: Dict) -> Optional[str]:
+        """Append one request line, first submitting the current batch if the line does not fit in it.
+
+        With a stage set, requests still waiting in an earlier batch of the stage and
+        save_dir are skipped, so re-running a batch script does not submit them twice.
+        Skipped requests, and requests over the batch limits, are added to ``skipped``.
+
+        Args:
+            custom_id: Id that identifies the request in the batch output (the image name)
+            body: Chat completion request body with its "messages"
+
+        Returns:
+            The id of the batch submitted by this call, or None
+        """
+        if self.stage is not None:
+            if self.in_flight is None:
+                self.in_flight = get_batch_tracker().in_flight(self.stage, self.save_dir)
+            if custom_id in self.in_flight:
+                self.skipped.add(custom_id)
+                return None
+        line, tokens, image_tokens, fingerprint = self.encode_line(custom_id, body)
+        if self.planner.oversized(len(line), tokens):
+            logging.error(f"Request {custom_id} ({len(line)} bytes, ~{tokens} tokens) exceeds the batch limits, skipped")
+            self.skipped.add(custom_id)
+            return None
+        batch_id = None
+        if not self.planner.fits(len(line), tokens):
+            batch_id = self.flush()
+        if self.spool is None:
+            self.spool = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes, mode="w+b")
+        self.spool.write(line)
+        self.fingerprints.append((custom_id, fingerprint))
+        self.image_tokens.append(image_tokens)
+        self.planner.add(len(line), tokens)
+        if self.params is None:
+            self.params = {key: value for key, value in body.items() if key != "messages"}
+        return batch_id
+
+    def flush(self) -> Optional[str]:
+        """Submit the pending request lines as one batch and return its id (None if empty)."""
+        if not self.fingerprints:
+            return None
+        self.spool.seek(0)
+        batch_input_file = self.client.files.create(file=("batch_input.jsonl", self.spool), purpose="batch")
+        batch_job = self.client.batches.create(
+            input_file_id=batch_input_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window)
+        batch_id = batch_job.id
+        if self.response_cache is not None:
+            self.response_cache.put_batch_fingerprints(batch_id, self.fingerprints)
+        if self.stage is not None:
+            get_batch_tracker().add_batch(batch_id, self.stage, self.save_dir,
+                                          [custom_id for custom_id, _ in self.fingerprints], params=self.params,
+                                          image_tokens=self.image_tokens)
+        print(f"submitted batch {batch_id} with {self.planner.requests} requests, "
+              f"{self.planner.bytes / 1024 / 1024:.1f} MB, ~{self.planner.tokens} input tokens")
+        self.batch_ids.append(batch_id)
+        self.close()
+        return batch_id
+
+    def close(self):
+        """Discard the pending request lines."""
+        if self.spool is not None:
+            self.spool.close()
+        self.spool = None
+        self.fingerprints = []
+        self.image_tokens = []
+        self.params = None
+        self.planner.reset()
+
+    def write_ids(self, path: str):
+        """Write the ids of the submitted batches, one per line."""
+        with open(path, "w") as f:
+            for batch_id in self.batch_ids:
+                f.write(batch_id + "\n")
@@ -9,6 +9,9 @@ from PIL import Image
 from .color_annotation_v3 import ColorAnnotatorV3
 
 from io import BytesIO
+from ..batch_tools.writer import BatchWriter
+from ..batch_tools.resubmit import resubmit_failed
+from ..request_tools.run_manifest import completed_outputs
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -30,8 +33,6 @@ class BatchColorAnnotatorV3(ColorAnnotatorV3):
 
 if __name__ == "__main__":
     from openai import OpenAI
-    import json
-    import io
     import time
 
     api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
@@ -64,20 +65,15 @@ if __name__ == "__main__":
 
     image_names = os.listdir(image_dir)
 
-    tasks = []
-    batch_input_ids = []
-    i = 0
+    resubmit_failed(client, stage="color_annotator", create_json=batchcolorannotator.create_json,
+                    save_dir=batchcolorannotator.save_dir)
+    writer = BatchWriter(client, stage="color_annotator", save_dir=batchcolorannotator.save_dir)
+    # outputs already saved, listed once instead of checking a file per image
+    completed = completed_outputs("color_annotator", save_dir_org, save_dir_new)
     for image_name in image_names:
-        if os.path.exists(os.path.join(save_dir_org, image_name.replace(".jpg", ".txt"))) or os.path.exists(os.path.join(save_dir_new, image_name.replace(".jpg", ".txt"))):
+        if image_name.replace(".jpg", ".txt") in completed:
             continue
 
-        i += 1
-        json_file = {
-            "custom_id": "",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {}
-         }
         body_content = {
             "model": "gpt-4o",
             "temperature": 0.2,
@@ -87,66 +83,17 @@ if __name__ == "__main__":
             "messages": ""
          }
         
-        json_file["custom_id"] = image_name
         cap_json = batchcolorannotator.create_json(image_name)
         body_content["messages"] = cap_json
-        json_file["body"] = body_content
-        tasks.append(json_file)
-
-        if i == 60:
-            json_str = ""
-            for obj in tasks:
-                json_str = json_str + (json.dumps(obj) + "\n")
-            json_bytes = io.BytesIO(json_str.encode('utf-8'))
-            batch_input_file = client.files.create(
-                file=json_bytes,
-                purpose="batch"
-                )
-            batch_input_file_id = batch_input_file.id
-
-            batch_job = client.batches.create(
-                input_file_id=batch_input_file_id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h")
-
-            batch_id = batch_job.id
-            print(batch_id)
-            batch_input_ids.append(batch_id)
-
-            i = 0
-            tasks = []
+        if writer.add(image_name, body_content) is not None:
             time.sleep(10)
 
     # print("\n\n")
     # print(tasks)
     # exit()
-    json_str = ""
-    for obj in tasks:
-        json_str = json_str + (json.dumps(obj) + "\n")
-    # json_str = (json.dumps(obj) + "\n") for obj in tasks
-    json_bytes = io.BytesIO(json_str.encode('utf-8'))
-
-    batch_input_file = client.files.create(
-    file=json_bytes,
-    purpose="batch"
-    )
-
-    batch_input_file_id = batch_input_file.id
-
-
-
-    batch_job = client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h")
-
-    batch_id = batch_job.id
-    print(batch_id)
-    batch_input_ids.append(batch_id)
+    writer.flush()
 
     # 把所有的batch_input_file_id保存到文件中
-    with open("batch_caption_input_file_ids_train.txt", "w") as f:
-        for batch_input_id in batch_input_ids:
-            f.write(batch_input_id + "\n")
+    writer.write_ids("batch_caption_input_file_ids_train.txt")
 
 
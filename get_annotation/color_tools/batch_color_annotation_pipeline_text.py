@@ -1,6 +1,5 @@
 
 import base64
-import requests
 import random
 import os
 from concurrent.futures import ThreadPoolExecutor
@@ -13,6 +12,13 @@ import json
 from collections import defaultdict
 import pycocotools.coco as coco
 
+from ..request_tools.http_client import get_http_client
+from ..request_tools.image_prep import get_image_preparer
+from ..request_tools.prompt_cache import get_prompt_cache
+from ..request_tools.rate_limiter import estimate_request_tokens
+from ..batch_tools.writer import BatchWriter
+from ..batch_tools.resubmit import resubmit_failed
+from ..request_tools.run_manifest import completed_outputs
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -36,6 +42,8 @@ def get_questions(questions_path):
 
 
 class TestColorAnnotatorV3():
+    stage = 'color_annotator'
+
     def __init__(self, prompt_dir, info_dir, image_dir, save_dir, all_image_dir, caption_dir, questions_path, n=1):
 
 
@@ -59,6 +67,8 @@ class TestColorAnnotatorV3():
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"}
+        self.client = get_http_client()
+        self.image_preparer = get_image_preparer(self.stage)
 
         self.payload = {
         "model": "gpt-4o",
@@ -83,6 +93,11 @@ Your task is to answer questions using the provided object coordinates, based on
 
 
     def get_prompt(self, prompt_dir):
+        """Few-shot messages for prompt_dir, shared through the process-wide prompt cache."""
+        return get_prompt_cache().get(self.build_prompt.__qualname__, prompt_dir, self.all_image_dir,
+                                      lambda: self.build_prompt(prompt_dir))
+
+    def build_prompt(self, prompt_dir):
         prompt_files = os.listdir(prompt_dir)
         prompts = []
         for prompt_file in prompt_files:
@@ -140,7 +155,7 @@ Your task is to answer questions using the provided object coordinates, based on
         info = "Captions:\n"+ caption_info + "\n" + "Objects:\n" + bbox_info + "\n\n" + "Questions:\n" + "\n\n".join(question_info)
 
         image_path = os.path.join(self.all_image_dir, image_name)
-        base64_image = self.encode_image(image_path)
+        base64_image = self.image_preparer.encode(image_path)
         query_message = {
         "role": "user",
         "content": [
@@ -152,7 +167,7 @@ Your task is to answer questions using the provided object coordinates, based on
                 "type": "image_url",
                 "image_url": {
                     "url": f"data:image/jpeg;base64,{base64_image}",
-                    "detail": "high"
+                    "detail": self.image_preparer.detail
                 }
             }
             ]}
@@ -168,8 +183,8 @@ Your task is to answer questions using the provided object coordinates, based on
         message.append(query_message)
         self.payload["messages"] = message
 
-        response = requests.post(self.url, headers=self.headers, json=self.payload)
-        res = response.json()
+        res = self.client.chat_completion(self.url, headers=self.headers, json=self.payload,
+                                          token_cost=estimate_request_tokens(self.payload))
         save_annotation_path = os.path.join(self.save_dir, image_name.replace(".jpg", ".txt"))
         save_respones = None
         if self.n == 1:
@@ -213,8 +228,6 @@ class BatchColorAnnotatorV3(TestColorAnnotatorV3):
 
 if __name__ == "__main__":
     from openai import OpenAI
-    import json
-    import io
     import time
 
 
@@ -253,22 +266,18 @@ if __name__ == "__main__":
 
 
 
-    tasks = []
-    batch_input_ids = []
-    i = 0
+    resubmit_failed(client, stage="color_annotator", create_json=batchcolorannotator.create_json,
+                    save_dir=batchcolorannotator.save_dir)
+    writer = BatchWriter(client, stage="color_annotator", save_dir=batchcolorannotator.save_dir)
+    # outputs already saved, listed once instead of checking a file per image
+    completed = completed_outputs("color_annotator", save_dir_org, save_dir_new)
+    color_info_names = set(os.listdir(color_info_dir))
     for image_name, _ in question_data.items():
-        if image_name.replace(".jpg", ".txt") not in os.listdir(color_info_dir):
+        if image_name.replace(".jpg", ".txt") not in color_info_names:
             continue
-        if os.path.exists(os.path.join(save_dir_org, image_name.replace(".jpg", ".txt"))) or os.path.exists(os.path.join(save_dir_new, image_name.replace(".jpg", ".txt"))):
+        if image_name.replace(".jpg", ".txt") in completed:
             continue
 
-        i += 1
-        json_file = {
-            "custom_id": "",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {}
-         }
         body_content = {
             "model": "gpt-4o",
             "temperature": 0.2,
@@ -278,62 +287,15 @@ if __name__ == "__main__":
             "messages": ""
          }
         
-        json_file["custom_id"] = image_name
         cap_json = batchcolorannotator.create_json(image_name)
 
 
         body_content["messages"] = cap_json
-        json_file["body"] = body_content
-        tasks.append(json_file)
-        if i == 60:
-            json_str = ""
-            for obj in tasks:
-                json_str = json_str + (json.dumps(obj) + "\n")
-            json_bytes = io.BytesIO(json_str.encode('utf-8'))
-            batch_input_file = client.files.create(
-                file=json_bytes,
-                purpose="batch"
-                )
-            batch_input_file_id = batch_input_file.id
-
-            batch_job = client.batches.create(
-                input_file_id=batch_input_file_id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h")
-
-            batch_id = batch_job.id
-            batch_input_ids.append(batch_id)
-
-            i = 0
-            tasks = []
+        if writer.add(image_name, body_content) is not None:
             time.sleep(10)
 
+    writer.flush()
 
-    json_str = ""
-    for obj in tasks:
-        json_str = json_str + (json.dumps(obj) + "\n")
-    json_bytes = io.BytesIO(json_str.encode('utf-8'))
-
-    batch_input_file = client.files.create(
-    file=json_bytes,
-    purpose="batch"
-    )
-
-    batch_input_file_id = batch_input_file.id
-
-
-
-    batch_job = client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h")
-
-    batch_id = batch_job.id
-    print(batch_id)
-    batch_input_ids.append(batch_id)
-
-    with open("batch_pipeline_test.txt", "w") as f:
-        for batch_input_id in batch_input_ids:
-            f.write(batch_input_id + "\n")
+    writer.write_ids("batch_pipeline_test.txt")
 
 
@@ -9,6 +9,9 @@ from PIL import Image
 from .regenerate_annotation_color import RegenerateAnnotatorColorV3
 
 from io import BytesIO
+from ..batch_tools.writer import BatchWriter
+from ..batch_tools.resubmit import resubmit_failed
+from ..request_tools.run_manifest import completed_outputs
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -39,8 +42,6 @@ Your task is to replace the objects with the reasons given for the discrepancies
 
 if __name__ == "__main__":
     from openai import OpenAI
-    import json
-    import io
     import time
 
     api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
@@ -70,21 +71,17 @@ if __name__ == "__main__":
 
     image_names = os.listdir(ann_dir)
 
-    tasks = []
-    batch_input_ids = []
-    i = 0
+    resubmit_failed(client, stage="regenerate_annotation_color", create_json=batch_regenerate_annotation_color.create_json,
+                    save_dir=batch_regenerate_annotation_color.save_dir)
+    writer = BatchWriter(client, stage="regenerate_annotation_color", save_dir=batch_regenerate_annotation_color.save_dir)
+    # outputs already saved, listed once instead of checking a file per image
+    completed = completed_outputs("regenerate_annotation_color", save_dir_org, save_dir_new)
     for image_name in image_names:
         image_name = image_name.replace(".txt", ".jpg")
 
-        if os.path.exists(os.path.join(save_dir_org, image_name.replace(".jpg", ".txt"))) or os.path.exists(os.path.join(save_dir_new, image_name.replace(".jpg", ".txt"))):
+        if image_name.replace(".jpg", ".txt") in completed:
             continue
 
-        json_file = {
-            "custom_id": "",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {}
-         }
         body_content = {
             "model": "gpt-4o",
             "temperature": 0.2,
@@ -93,66 +90,17 @@ if __name__ == "__main__":
             "n": 1,
             "messages": ""
          }
-        json_file["custom_id"] = image_name
         cap_json = batch_regenerate_annotation_color.create_json(image_name)
         
         if cap_json is None:
             continue
-        i += 1
         body_content["messages"] = cap_json
-        json_file["body"] = body_content
-        tasks.append(json_file)
-
-
-        if i == 60:
-            json_str = ""
-            for obj in tasks:
-                json_str = json_str + (json.dumps(obj) + "\n")
-            json_bytes = io.BytesIO(json_str.encode('utf-8'))
-            batch_input_file = client.files.create(
-                file=json_bytes,
-                purpose="batch"
-                )
-            batch_input_file_id = batch_input_file.id
-
-            batch_job = client.batches.create(
-                input_file_id=batch_input_file_id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h")
-
-            batch_id = batch_job.id
-            print(batch_id)
-            batch_input_ids.append(batch_id)
-
-            i = 0
-            tasks = []
+        if writer.add(image_name, body_content) is not None:
             time.sleep(10)
 
-    json_str = ""
-    for obj in tasks:
-        json_str = json_str + (json.dumps(obj) + "\n")
-    json_bytes = io.BytesIO(json_str.encode('utf-8'))
-
-    batch_input_file = client.files.create(
-    file=json_bytes,
-    purpose="batch"
-    )
-
-    batch_input_file_id = batch_input_file.id
-
-
-
-    batch_job = client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h")
-
-    batch_id = batch_job.id
-    batch_input_ids.append(batch_id)
+    writer.flush()
 
 
-    with open("batch_regenerate_input_file_ids.txt", "w") as f:
-        for batch_input_id in batch_input_ids:
-            f.write(batch_input_id + "\n")
+    writer.write_ids("batch_regenerate_input_file_ids.txt")
 
 
@@ -1,16 +1,22 @@
 """Tool for verifying annotations using GPT-4 vision API."""
 import base64
 import os
-import requests
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
+from ..request_tools.chat_tool import ChatTool
+from ..request_tools.http_client import get_http_client
+from ..request_tools.image_prep import get_image_preparer
+from ..request_tools.prompt_cache import get_prompt_cache
+from ..request_tools.payload import get_payload_template
 from dotenv import load_dotenv
 load_dotenv()
 
 
 
-class CheckAnnotationColor():
+class CheckAnnotationColor(ChatTool):
     """Tool for verifying annotation correctness using GPT-4 vision API."""
+
+    stage = 'check_annotation_color'
     
     def __init__(self, image_dir: str, info_dir: str, prompt_dir: str, 
                 save_dir: str, all_image_dir: str, caption_dir: str,
@@ -45,6 +51,8 @@ class CheckAnnotationColor():
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"}
+        self.client = get_http_client()
+        self.image_preparer = get_image_preparer(self.stage)
 
         self.payload = {
         # "model": "gpt-4-turbo-2024-04-09",
@@ -73,6 +81,11 @@ Your task is to confirm whether the description exclusively relates to the descr
 
 
     def get_prompt(self, prompt_dir):
+        """Few-shot messages for prompt_dir, shared through the process-wide prompt cache."""
+        return get_prompt_cache().get(self.build_prompt.__qualname__, prompt_dir, self.all_image_dir,
+                                      lambda: self.build_prompt(prompt_dir))
+
+    def build_prompt(self, prompt_dir):
         prompt_files = os.listdir(prompt_dir)
         prompts = []
     
@@ -131,7 +144,7 @@ Your task is to confirm whether the description exclusively relates to the descr
         info = "Captions:\n"+ caption_info + "\n" + "Objects:\n" + bbox_info + "\n\n" + "Descriptions:\n" + annotation_info
 
         image_path = os.path.join(self.all_image_dir, image_name)
-        base64_image = self.encode_image(image_path)
+        base64_image = self.image_preparer.encode(image_path)
         query_message = {
         "role": "user",
         "content": [
@@ -143,26 +156,19 @@ Your task is to confirm whether the description exclusively relates to the descr
                 "type": "image_url",
                 "image_url": {
                     "url": f"data:image/jpeg;base64,{base64_image}",
-                    "detail": "high"
+                    "detail": self.image_preparer.detail
                 }
             }
             ]}
         return query_message
 
     
-    def get_response(self, image_name):
-        system_message = self.system_message
-        prompt_message = self.prompt_message
+    def get_payload(self, image_name):
+        """Request body for one image: the pre-serialized prefix with the query message spliced in."""
         query_message = self.get_query_message(image_name)
-        message = [system_message]
-        message.extend(prompt_message)
-        message.append(query_message)
-
+        return get_payload_template(self).render([query_message])
 
-        self.payload["messages"] = message
-
-        response = requests.post(self.url, headers=self.headers, json=self.payload)
-        res = response.json()
+    def save_response(self, image_name, res):
         save_annotation_path = os.path.join(self.save_dir, image_name.replace(".jpg", ".txt"))
         save_respones = None
         if self.n == 1:
@@ -174,7 +180,7 @@ Your task is to confirm whether the description exclusively relates to the descr
             print(f" save caption to {save_annotation_path}")
 
         else:
-
+            save_respones = ""
             for i in range(self.n):
                 res_content = res['choices'][i]['message']['content']
                 save_respones = save_respones + res_content + "\n\n"
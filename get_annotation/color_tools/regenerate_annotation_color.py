@@ -1,16 +1,18 @@
 """Tool for regenerating color annotations using GPT-4 vision API."""
 import base64
 import os
-import requests
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 
 from .color_annotation_v3 import ColorAnnotatorV3
+from ..request_tools.payload import get_payload_template
 from dotenv import load_dotenv
 load_dotenv()
 
 class RegenerateAnnotatorColorV3(ColorAnnotatorV3):
     """Tool for regenerating color annotations based on verification feedback."""
+
+    stage = 'regenerate_annotation_color'
     
     def __init__(self, prompt_dir: str, info_dir: str, image_dir: str, 
                 save_dir: str, all_image_dir: str, caption_dir: str,
@@ -84,7 +86,7 @@ Your task is to revise both the description and the corresponding objects to cor
             info += "\n\n" + new_failed_content + "\n"
 
         image_path = os.path.join(self.all_image_dir, image_name)
-        base64_image = self.encode_image(image_path)
+        base64_image = self.image_preparer.encode(image_path)
         query_message = {
         "role": "user",
         "content": [
@@ -96,27 +98,21 @@ Your task is to revise both the description and the corresponding objects to cor
                 "type": "image_url",
                 "image_url": {
                     "url": f"data:image/jpeg;base64,{base64_image}",
-                    "detail": "high"
+                    "detail": self.image_preparer.detail
                 }
             }
             ]}
         return query_message
 
  
-    def get_response(self, image_name):
-        system_message = self.system_message
-        prompt_message = self.prompt_message
+    def get_payload(self, image_name):
+        """Request body for one image: the pre-serialized prefix with the query message spliced in."""
         query_message = self.get_query_message(image_name)
         if query_message is None:
             return None
-            
-        message = [system_message]
-        message.extend(prompt_message)
-        message.append(query_message)
-        self.payload["messages"] = message
+        return get_payload_template(self).render([query_message])
 
-        response = requests.post(self.url, headers=self.headers, json=self.payload)
-        res = response.json()
+    def save_response(self, image_name, res):
         save_annotation_path = os.path.join(self.save_dir, image_name.replace(".jpg", ".txt"))
         save_respones = None
         if self.n == 1:
@@ -129,7 +125,7 @@ Your task is to revise both the description and the corresponding objects to cor
             print(f" save caption to {save_annotation_path}")
 
         else:
-
+            save_respones = ""
             for i in range(self.n):
                 res_content = res['choices'][i]['message']['content']
                 save_respones = save_respones + res_content + "\n\n"
@@ -0,0 +1,60 @@
+"""Asyncio execution engine that runs one AnnTool stage over many images."""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from .request_tools.http_client import get_http_client
+
+
+class AsyncStageEngine():
+    """Run an async per-image stage function with a bounded number of in-flight requests."""
+
+    def __init__(self, max_in_flight: Optional[int] = None):
+        """Initialize the engine.
+
+        Args:
+            max_in_flight: Maximum number of images whose request is in flight at once
+                (default: MAX_IN_FLIGHT environment variable, or 32)
+        """
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv('MAX_IN_FLIGHT', '32'))
+        self.max_in_flight = max_in_flight
+
+    async def arun(self, stage_fn: Callable[[str], Awaitable[bool]], image_names: List[str],
+                   stage_name: str = "") -> Tuple[List[str], List[str]]:
+        """Run ``stage_fn`` over ``image_names`` and return (succeeded, failed) image names.
+
+        ``stage_fn`` returns False or raises for images that failed; failures are logged
+        and never cancel the rest of the stage.
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        total = len(image_names)
+        done = 0
+
+        async def run_one(image_name):
+            nonlocal done
+            async with semaphore:
+                try:
+                    ok = await stage_fn(image_name)
+                except Exception as e:
+                    logging.error(f"{stage_name} error in {image_name}: {e}")
+                    ok = False
+            done += 1
+            print(f"[{stage_name}] [{done}/{total}] {image_name} {'✓' if ok is not False else '✗'}")
+            return ok is not False
+
+        results = await asyncio.gather(*[run_one(image_name) for image_name in image_names])
+        succeeded = [name for name, ok in zip(image_names, results) if ok]
+        failed = [name for name, ok in zip(image_names, results) if not ok]
+        return succeeded, failed
+
+    def run(self, stage_fn: Callable[[str], Awaitable[bool]], image_names: List[str],
+            stage_name: str = "") -> Tuple[List[str], List[str]]:
+        """Blocking wrapper around :meth:`arun` for synchronous callers."""
+        async def main():
+            try:
+                return await self.arun(stage_fn, image_names, stage_name)
+            finally:
+                await get_http_client().aclose()
+        return asyncio.run(main())
@@ -1,6 +1,5 @@
 
 import base64
-import requests
 import random
 import os
 from concurrent.futures import ThreadPoolExecutor
@@ -8,10 +7,19 @@ import re
 from PIL import Image
 
 from io import BytesIO
+from ..request_tools.http_client import get_http_client
+from ..request_tools.image_prep import get_image_preparer
+from ..request_tools.prompt_cache import get_prompt_cache
+from ..request_tools.rate_limiter import estimate_request_tokens
+from ..batch_tools.writer import BatchWriter
+from ..batch_tools.resubmit import resubmit_failed
+from ..request_tools.run_manifest import completed_outputs
 from dotenv import load_dotenv
 load_dotenv()
 
 class Captioner():
+    stage = 'caption'
+
 
     def __init__(self, image_dir, prompt_dir, save_dir, all_image_dir, n=3):
 
@@ -29,6 +37,8 @@ class Captioner():
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"}
+        self.client = get_http_client()
+        self.image_preparer = get_image_preparer(self.stage)
 
         self.payload = {
 
@@ -76,6 +86,11 @@ class Captioner():
 
 
     def get_prompt(self, prompt_dir):
+        """Few-shot messages for prompt_dir, shared through the process-wide prompt cache."""
+        return get_prompt_cache().get(self.build_prompt.__qualname__, prompt_dir, self.all_image_dir,
+                                      lambda: self.build_prompt(prompt_dir), extra=self.prompt_contents)
+
+    def build_prompt(self, prompt_dir):
         prompt_files = os.listdir(prompt_dir)
         prompts = []
 
@@ -85,7 +100,8 @@ class Captioner():
             with open(prompt_path, "r") as f:
                 prompt_info = f.read()
                 prompt["info"] = prompt_info
-            prompt["text"] = random.choice(self.prompt_contents)
+            # seeded per file so the cached messages are reproducible
+            prompt["text"] = random.Random(prompt_file).choice(self.prompt_contents)
             name = prompt_file.replace(".txt", ".jpg")
             prompts_image = self.encode_image(os.path.join(self.all_image_dir, name))
             prompt["image"] = prompts_image
@@ -111,14 +127,14 @@ class Captioner():
 
     def get_query_message(self, image_name):
         image_path = os.path.join(self.image_dir, image_name)
-        base64_image = self.encode_image(image_path)
+        base64_image = self.image_preparer.encode(image_path)
         prompt = random.choice(self.prompt_contents)
 
         query_message = {
             "role": "user",
             "content": [
                 {"type": "text", "text": str(prompt)},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "low"}}
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": self.image_preparer.detail}}
             ]
         }
 
@@ -134,9 +150,8 @@ class Captioner():
         message.append(query_message)
         self.payload["messages"] = message
 
-        response = requests.post(self.url, headers=self.headers, json=self.payload)
-
-        res = response.json()
+        res = self.client.chat_completion(self.url, headers=self.headers, json=self.payload,
+                                          token_cost=estimate_request_tokens(self.payload))
         print(res)
         save_annotation_path = os.path.join(self.save_dir, image_name.replace(".jpg", ".txt"))
         save_respones = ""
@@ -172,8 +187,6 @@ class Captioner():
 
 if __name__ == "__main__":
     from openai import OpenAI
-    import json
-    import io
     import time
 
     api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
@@ -189,19 +202,14 @@ if __name__ == "__main__":
     image_names = os.listdir(image_dir)
 
 
-    tasks = []
-    batch_input_ids = []
-    i = 0
+    resubmit_failed(client, stage="caption", create_json=captioner.create_json,
+                    save_dir=captioner.save_dir)
+    writer = BatchWriter(client, stage="caption", save_dir=captioner.save_dir)
+    # outputs already saved, listed once instead of checking a file per image
+    completed = completed_outputs("caption", caption_save_dir)
     for image_name in image_names:
-        if os.path.exists(os.path.join(caption_save_dir, image_name.replace(".jpg", ".txt"))):
+        if image_name.replace(".jpg", ".txt") in completed:
             continue
-        i += 1
-        json_file = {
-            "custom_id": "",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {}
-         }
         body_content = {
             "model": "gpt-4o",
             "temperature": 0.7,
@@ -211,60 +219,13 @@ if __name__ == "__main__":
             "messages": ""
          }
         
-        json_file["custom_id"] = image_name
         cap_json = captioner.create_json(image_name)
         body_content["messages"] = cap_json
-        json_file["body"] = body_content
-        tasks.append(json_file)
-
-        if i == 100:
-            json_str = ""
-            for obj in tasks:
-                json_str = json_str + (json.dumps(obj) + "\n")
-            json_bytes = io.BytesIO(json_str.encode('utf-8'))
-            batch_input_file = client.files.create(
-                file=json_bytes,
-                purpose="batch"
-                )
-            batch_input_file_id = batch_input_file.id
-
-            batch_job = client.batches.create(
-                input_file_id=batch_input_file_id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h")
-
-            batch_id = batch_job.id
-            print(batch_id)
-            batch_input_ids.append(batch_id)
-
-            i = 0
-            tasks = []
-
-    json_str = ""
-    for obj in tasks:
-        json_str = json_str + (json.dumps(obj) + "\n")
-    json_bytes = io.BytesIO(json_str.encode('utf-8'))
-
-    batch_input_file = client.files.create(
-    file=json_bytes,
-    purpose="batch"
-    )
-
-    batch_input_file_id = batch_input_file.id
-
-
-    batch_job = client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h")
-
-    batch_id = batch_job.id
-    print(batch_id)
-    batch_input_ids.append(batch_id)
-
-
-    with open("batch_caption_input_file_ids_test.txt", "w") as f:
-        for batch_input_id in batch_input_ids:
-            f.write(batch_input_id + "\n")
+        writer.add(image_name, body_content)
+
+    writer.flush()
+
+
+    writer.write_ids("batch_caption_input_file_ids_test.txt")
 
 
@@ -1,16 +1,23 @@
 
+import asyncio
 import base64
-import requests
 import random
 import os
 from concurrent.futures import ThreadPoolExecutor
 import re
 from PIL import Image
 from io import BytesIO
+from ..request_tools.chat_tool import ChatTool
+from ..request_tools.http_client import get_http_client
+from ..request_tools.image_prep import get_image_preparer
+from ..request_tools.prompt_cache import get_prompt_cache
+from ..request_tools.payload import get_payload_template
 from dotenv import load_dotenv
 load_dotenv()
 
-class Captioner():
+class Captioner(ChatTool):
+    stage = 'caption'
+
     def __init__(self, image_dir, prompt_dir, save_dir, all_image_dir, n=3):
         # OpenAI API Key and URL from environment variables
         self.api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
@@ -28,6 +35,8 @@ class Captioner():
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"}
+        self.client = get_http_client()
+        self.image_preparer = get_image_preparer(self.stage)
 
         self.payload = {
         "model": "gpt-4o",
@@ -74,6 +83,11 @@ class Captioner():
 
 
     def get_prompt(self, prompt_dir):
+        """Few-shot messages for prompt_dir, shared through the process-wide prompt cache."""
+        return get_prompt_cache().get(self.build_prompt.__qualname__, prompt_dir, self.all_image_dir,
+                                      lambda: self.build_prompt(prompt_dir), extra=self.prompt_contents)
+
+    def build_prompt(self, prompt_dir):
         prompt_files = os.listdir(prompt_dir)
         prompts = []
 
@@ -83,7 +97,8 @@ class Captioner():
             with open(prompt_path, "r") as f:
                 prompt_info = f.read()
                 prompt["info"] = prompt_info
-            prompt["text"] = random.choice(self.prompt_contents)
+            # seeded per file so the cached messages are reproducible
+            prompt["text"] = random.Random(prompt_file).choice(self.prompt_contents)
             name = prompt_file.replace(".txt", ".jpg")
             prompts_image = self.encode_image(os.path.join(self.all_image_dir, name))
             prompt["image"] = prompts_image
@@ -109,37 +124,42 @@ class Captioner():
 
     def get_query_message(self, image_name):
         image_path = os.path.join(self.image_dir, image_name)
-        base64_image = self.encode_image(image_path)
-        prompt = random.choice(self.prompt_contents)
+        base64_image = self.image_preparer.encode(image_path)
+        # chosen per image so the request, and its response cache fingerprint, are reproducible
+        prompt = random.Random(image_name).choice(self.prompt_contents)
 
         query_message = {
             "role": "user",
             "content": [
                 {"type": "text", "text": str(prompt)},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "low"}}
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": self.image_preparer.detail}}
             ]
         }
 
         return query_message
 
-    def get_response(self, image_name):
-        system_message = self.system_message
-        prompt_message = self.prompt_message
+    def get_payload(self, image_name):
+        """Request body for one image: the pre-serialized prefix with the query message spliced in."""
         query_message = self.get_query_message(image_name)
+        return get_payload_template(self).render([query_message])
+
+    def get_response(self, image_name):
+        payload = self.get_payload(image_name)
+        # Call API n times and collect results
+        results = [self.request(image_name, payload, salt=i) for i in range(self.n)]
+        return self.save_response(image_name, results)
 
-        message = [system_message]
-        message.extend(prompt_message)
-        message.append(query_message)
-        self.payload["messages"] = message
+    async def aget_response(self, image_name):
+        """Async version of get_response; the n calls for one image are sent concurrently."""
+        payload = await asyncio.to_thread(self.get_payload, image_name)
+        results = await asyncio.gather(*[self.arequest(image_name, payload, salt=i) for i in range(self.n)])
+        return self.save_response(image_name, list(results))
 
+    def save_response(self, image_name, results):
         save_annotation_path = os.path.join(self.save_dir, image_name.replace(".jpg", ".txt"))
         save_respones = ""
-        
-        # Call API n times and collect results
-        for i in range(self.n):
-            response = requests.post(self.url, headers=self.headers, json=self.payload)
-            res = response.json()
-            
+
+        for i, res in enumerate(results):
             if i == 0:
                 print(res)  # Only print the first response to avoid clutter
             
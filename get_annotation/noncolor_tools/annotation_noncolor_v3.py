@@ -10,6 +10,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class AnnotatorNonColorV3(ColorAnnotatorV3):
+    stage = 'noncolor_annotator'
+
     def __init__(self, prompt_dir, info_dir, image_dir, save_dir, all_image_dir, caption_dir, n=1):
         super().__init__(prompt_dir, info_dir, image_dir, save_dir, all_image_dir, caption_dir, n)
 
@@ -9,6 +9,9 @@ from PIL import Image
 from .check_annotation_chatgpt_noncolor import CheckAnnotationNoncolor
 
 from io import BytesIO
+from ..batch_tools.writer import BatchWriter
+from ..batch_tools.resubmit import resubmit_failed
+from ..request_tools.run_manifest import completed_outputs
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -30,8 +33,6 @@ class BatchCheckAnnotationNoncolor(CheckAnnotationNoncolor):
 
 if __name__ == "__main__":
     from openai import OpenAI
-    import json
-    import io
     import time
 
     api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
@@ -62,20 +63,15 @@ if __name__ == "__main__":
 
     image_names = os.listdir(image_dir)
 
-    tasks = []
-    batch_input_ids = []
-    i = 0
+    resubmit_failed(client, stage="check_annotation_noncolor", create_json=batch_check_annotation_noncolor.create_json,
+                    save_dir=batch_check_annotation_noncolor.save_dir)
+    writer = BatchWriter(client, stage="check_annotation_noncolor", save_dir=batch_check_annotation_noncolor.save_dir)
+    # outputs already saved, listed once instead of checking a file per image
+    completed = completed_outputs("check_annotation_noncolor", save_dir_org)
     for image_name in image_names:
-        if os.path.exists(os.path.join(save_dir_org, image_name.replace(".jpg", ".txt"))):
+        if image_name.replace(".jpg", ".txt") in completed:
             continue
 
-        i += 1
-        json_file = {
-            "custom_id": "",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {}
-         }
         body_content = {
             "model": "gpt-4o",
             "temperature": 0.3,
@@ -84,61 +80,13 @@ if __name__ == "__main__":
             "messages": ""
          }
         
-        json_file["custom_id"] = image_name
         cap_json = batch_check_annotation_noncolor.create_json(image_name)
         body_content["messages"] = cap_json
-        json_file["body"] = body_content
-        tasks.append(json_file)
-
-        if i == 60:
-            json_str = ""
-            for obj in tasks:
-                json_str = json_str + (json.dumps(obj) + "\n")
-            json_bytes = io.BytesIO(json_str.encode('utf-8'))
-            batch_input_file = client.files.create(
-                file=json_bytes,
-                purpose="batch"
-                )
-            batch_input_file_id = batch_input_file.id
-
-            batch_job = client.batches.create(
-                input_file_id=batch_input_file_id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h")
-
-            batch_id = batch_job.id
-            print(batch_id)
-            batch_input_ids.append(batch_id)
-            i = 0
-            tasks = []
-            time.sleep(100)
-
-
-    json_str = ""
-    for obj in tasks:
-        json_str = json_str + (json.dumps(obj) + "\n")
-    json_bytes = io.BytesIO(json_str.encode('utf-8'))
-
-    batch_input_file = client.files.create(
-    file=json_bytes,
-    purpose="batch"
-    )
-
-    batch_input_file_id = batch_input_file.id
-
-
-
-    batch_job = client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h")
-
-    batch_id = batch_job.id
-    print(batch_id)
-    batch_input_ids.append(batch_id)
-
-    with open("batch_noncolor_check_input_file_ids.txt", "w") as f:
-        for batch_input_id in batch_input_ids:
-            f.write(batch_input_id + "\n")
+        if writer.add(image_name, body_content) is not None:
+            time.sleep(10)
+
+    writer.flush()
+
+    writer.write_ids("batch_noncolor_check_input_file_ids.txt")
 
 
@@ -11,6 +11,9 @@ from PIL import Image
 from io import BytesIO
 
 from ..color_tools.regenerate_annotation_color import RegenerateAnnotatorColorV3
+from ..batch_tools.writer import BatchWriter
+from ..batch_tools.resubmit import resubmit_failed
+from ..request_tools.run_manifest import completed_outputs
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -35,8 +38,6 @@ Your task is to revise both the description and the corresponding objects to cor
 
 if __name__ == "__main__":
     from openai import OpenAI
-    import json
-    import io
     import time
 
     api_key = os.getenv('OPENAI_API_KEY', 'your-api-key-here')
@@ -67,19 +68,15 @@ if __name__ == "__main__":
 
     image_names = os.listdir(image_dir)
 
-    tasks = []
-    batch_input_ids = []
-    i = 0
+    resubmit_failed(client, stage="regenerate_annotation_noncolor", create_json=batch_regenerate_annotation_noncolor.create_json,
+                    save_dir=batch_regenerate_annotation_noncolor.save_dir)
+    writer = BatchWriter(client, stage="regenerate_annotation_noncolor", save_dir=batch_regenerate_annotation_noncolor.save_dir)
+    # outputs already saved, listed once instead of checking a file per image
+    completed = completed_outputs("regenerate_annotation_noncolor", save_dir_org, save_dir_new)
     for image_name in image_names:
-        if os.path.exists(os.path.join(save_dir_org, image_name.replace(".jpg", ".txt"))) or os.path.exists(os.path.join(save_dir_new, image_name.replace(".jpg", ".txt"))):
+        if image_name.replace(".jpg", ".txt") in completed:
             continue
 
-        json_file = {
-            "custom_id": "",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {}
-         }
         body_content = {
             "model": "gpt-4o",
             "temperature": 0.2,
@@ -88,67 +85,16 @@ if __name__ == "__main__":
             "n": 1,
             "messages": ""
          }
-        json_file["custom_id"] = image_name
         cap_json = batch_regenerate_annotation_noncolor.create_json(image_name)
         
         if cap_json is None:
             continue
-        i += 1
         body_content["messages"] = cap_json
-        json_file["body"] = body_content
-        tasks.append(json_file)
-
-
-        if i == 60:
-            json_str = ""
-            for obj in tasks:
-                json_str = json_str + (json.dumps(obj) + "\n")
-            json_bytes = io.BytesIO(json_str.encode('utf-8'))
-            batch_input_file = client.files.create(
-                file=json_bytes,
-                purpose="batch"
-                )
-            batch_input_file_id = batch_input_file.id
-
-            batch_job = client.batches.create(
-                input_file_id=batch_input_file_id,
-                endpoint="/v1/chat/completions",
-                completion_window="24h")
-
-            batch_id = batch_job.id
-            print(batch_id)
-
-            batch_input_ids.append(batch_id)
-
-            i = 0
-            tasks = []
+        if writer.add(image_name, body_content) is not None:
             time.sleep(10)
 
-    json_str = ""
-    for obj in tasks:
-        json_str = json_str + (json.dumps(obj) + "\n")
-    json_bytes = io.BytesIO(json_str.encode('utf-8'))
-
-    batch_input_file = client.files.create(
-    file=json_bytes,
-    purpose="batch"
-    )
-
-    batch_input_file_id = batch_input_file.id
-
-
-
-    batch_job = client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h")
-
-    batch_id = batch_job.id
-    print(batch_id)
-    batch_input_ids.append(batch_id)
+    writer.flush()
 
-    with open("batch_noncolor_regenerate_input_file_ids.txt", "w") as f:
-        for batch_input_id in batch_input_ids:
-            f.write(batch_input_id + "\n")
+    writer.write_ids("batch_noncolor_regenerate_input_file_ids.txt")
 
 
@@ -10,6 +10,8 @@ load_dotenv()
 from ..color_tools.regenerate_annotation_color import RegenerateAnnotatorColorV3
 
 class RegenerateAnnotatorNonColorV3(RegenerateAnnotatorColorV3):
+    stage = 'regenerate_annotation_noncolor'
+
     def __init__(self, prompt_dir, info_dir, image_dir, save_dir, all_image_dir, caption_dir, annotation_dir, n=1):
         super().__init__(prompt_dir, info_dir, image_dir, save_dir, all_image_dir, caption_dir, annotation_dir, n)
 
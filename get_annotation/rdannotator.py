@@ -1,9 +1,11 @@
+import asyncio
 import os
 import logging
-import time
 from datetime import datetime
 from typing import List, Optional
 
+from .engine import AsyncStageEngine
+from .scheduler import PipelineScheduler
 from .color_tools.color_annotation_v3 import ColorAnnotatorV3
 from .color_tools.check_color import CheckColor
 from .color_tools.check_annotation_chatgpt import CheckAnnotationColor
@@ -14,6 +16,8 @@ from .noncolor_tools.check_annotation_chatgpt_noncolor import CheckAnnotationNon
 from .noncolor_tools.regenerate_annotation_noncolor import RegenerateAnnotatorNonColorV3
 
 from .image_caption.captioner import Captioner
+from .request_tools.metrics import get_metrics
+from .request_tools.run_manifest import get_run_manifest, text_hash
 
 # Configure logging to use project-relative paths
 log_dir = os.getenv('LOG_DIR', './logs')
@@ -28,13 +32,27 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+# Stage -> stages whose outputs its requests are built from; their output hashes make up
+# the input hash recorded in the run manifest
+STAGE_INPUTS = {
+    'caption': [],
+    'checkcolor': [],
+    'color_annotator': ['caption'],
+    'check_annotation_color': ['caption', 'color_annotator'],
+    'regenerate_annotation_color': ['caption', 'check_annotation_color'],
+    'noncolor_annotator': ['caption'],
+    'check_annotation_noncolor': ['caption', 'noncolor_annotator'],
+    'regenerate_annotation_noncolor': ['caption', 'check_annotation_noncolor'],
+}
+
 class AnnTool():
 
     def __init__(self, image_dir: str, caption_save_dir: str, 
                 color_check_save_dir: str, color_annotator_save_dir: str, 
                 noncolor_annotator_save_dir: str, color_check_annotation_save_dir: str,
                 noncolor_check_annotation_save_dir: str, color_regenerate_annotator_save_dir: str,
-                noncolor_regenerate_annotator_save_dir: str, color_info_dir: Optional[str] = None):
+                noncolor_regenerate_annotator_save_dir: str, color_info_dir: Optional[str] = None,
+                all_image_dir: Optional[str] = None):
         """Initialize the annotation tool with configurable paths.
         
         Args:
@@ -48,15 +66,24 @@ class AnnTool():
             color_regenerate_annotator_save_dir: Directory to save regenerated color annotations
             noncolor_regenerate_annotator_save_dir: Directory to save regenerated noncolor annotations
             color_info_dir: Directory containing color annotation info (optional, required for color processing)
+            all_image_dir: Directory the query and few-shot example images are loaded from
+                (optional, defaults to image_dir, which then only selects the images to process)
         """
         # Base directories configuration
         self.data_root = os.getenv('VISDRONE_DATA_ROOT', './data')
         self.prompt_root = os.getenv('PROMPT_ROOT', './prompts')
+        # With SKIP_EXISTING_OUTPUTS=0 every image is re-run; requests whose inputs did not
+        # change are answered from the response cache instead of the API
+        self.skip_existing = os.getenv('SKIP_EXISTING_OUTPUTS', '1') not in ('0', 'false', 'False')
+        self.metrics = get_metrics()
+        # Skip decisions are looked up in the run manifest (RUN_MANIFEST) instead of
+        # checking every output file
+        self.run_manifest = get_run_manifest()
         
         # Initialize paths
         self.image_dir = image_dir
         self.color_info_dir = color_info_dir
-        self.all_image_dir = image_dir
+        self.all_image_dir = all_image_dir or image_dir
 
         # Create all save directories
         self.caption_save_dir = caption_save_dir
@@ -94,6 +121,18 @@ class AnnTool():
         self.color_annotation_names = []
         self.noncolor_annotation_names = []
         self.others_annotation_names = []
+        self.load_run_manifest()
+
+    def load_run_manifest(self):
+        """Import the outputs already in the save directories, listing each directory once in its lifetime."""
+        if self.run_manifest is None:
+            return
+        for stage in STAGE_INPUTS:
+            try:
+                save_dir = self.get_stage(stage)[1]
+            except ValueError:
+                continue
+            self.run_manifest.import_dir(stage, save_dir)
 
     def init_captioner(self):
         self.caption_prompt_dir = os.path.join(self.prompt_root, 'caption')
@@ -233,6 +272,112 @@ class AnnTool():
         
         self.noncolor_regenerate_annotator = RegenerateAnnotatorNonColorV3(prompt_dir=self.noncolor_regenerate_annotator_prompt_dir, info_dir=self.noncolor_regenerate_annotator_info_dir, image_dir=self.image_dir, save_dir=self.noncolor_regenerate_annotator_save_dir, all_image_dir=self.all_image_dir, caption_dir=self.noncolor_regenerate_annotator_caption_dir, annotation_dir=self.noncolor_regenerate_annotator_annotation_dir, n=1)
     
+    def get_stage(self, stage):
+        """Return (tool, save_dir, image_extensions) for a stage name.
+
+        Resolved on every call so tools re-initialized by callers (e.g. main.py) are picked up.
+        """
+        image_extensions = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
+        stages = {
+            'caption': (self.captioner, self.caption_save_dir, image_extensions),
+            'checkcolor': (self.checkcolor, self.color_check_save_dir, image_extensions),
+            'color_annotator': (self.color_annotator, self.color_annotator_save_dir, image_extensions),
+            'check_annotation_color': (self.color_check_annotation, self.color_check_annotation_save_dir, image_extensions),
+            'regenerate_annotation_color': (self.color_regenerate_annotator, self.color_regenerate_annotator_save_dir, image_extensions),
+            'noncolor_annotator': (self.noncolor_annotator, self.noncolor_annotator_save_dir, ['.jpg']),
+            'check_annotation_noncolor': (self.noncolor_check_annotation, self.noncolor_check_annotation_save_dir, ['.jpg']),
+            'regenerate_annotation_noncolor': (self.noncolor_regenerate_annotator, self.noncolor_regenerate_annotator_save_dir, ['.jpg']),
+        }
+        if stage not in stages:
+            raise ValueError(f"Unknown stage: {stage}")
+        tool, save_dir, image_extensions = stages[stage]
+        if tool is None:
+            raise ValueError(f"{stage} is not initialized. color_info_dir is required for color processing.")
+        return tool, save_dir, image_extensions
+
+    def get_stage_image_names(self, stage):
+        """Default image list for a stage when none is given."""
+        if stage in ('caption', 'checkcolor'):
+            return os.listdir(self.image_dir)
+        if stage.endswith('_noncolor') or stage == 'noncolor_annotator':
+            return self.noncolor_annotation_names
+        return self.color_annotation_names
+
+    def stage_input_hash(self, stage, img_name):
+        """Hash of the outputs the stage's request for an image is built from, or None if it reads none."""
+        if not STAGE_INPUTS[stage]:
+            return None
+        output_name = self.output_name(img_name)
+        output_hashes = []
+        for input_stage in STAGE_INPUTS[stage]:
+            entry = self.run_manifest.get(input_stage, self.get_stage(input_stage)[1], output_name)
+            output_hashes.append(entry.output_hash if entry is not None and entry.output_hash else "")
+        return text_hash("\n".join([stage] + output_hashes))
+
+    @staticmethod
+    def output_name(img_name):
+        file_ext = os.path.splitext(img_name)[1]
+        return img_name.replace(file_ext, ".txt")
+
+    def is_stage_done(self, stage, img_name):
+        """Whether the stage's output of an image exists and was built from the current inputs.
+
+        Looked up in the run manifest, or checked on disk when the manifest is disabled.
+        """
+        save_dir = self.get_stage(stage)[1]
+        if self.run_manifest is None:
+            return os.path.exists(os.path.join(save_dir, self.output_name(img_name)))
+        return self.run_manifest.is_done(stage, save_dir, self.output_name(img_name),
+                                         self.stage_input_hash(stage, img_name))
+
+    def record_stage(self, stage, img_name, text=None, status="done"):
+        """Record the outcome of a stage for an image in the run manifest."""
+        if self.run_manifest is None:
+            return
+        input_hash = self.stage_input_hash(stage, img_name)
+        self.run_manifest.record(stage, self.get_stage(stage)[1], self.output_name(img_name), image=img_name,
+                                 status=status, text=text, input_hash=input_hash)
+
+    async def arun_stage_image(self, stage, img_name):
+        """Run one stage for one image through the tool's async get_response.
+
+        Skips unsupported files and images whose output is done according to the run
+        manifest. Transient API errors are retried with backoff by the shared HTTP client.
+        """
+        tool, save_dir, image_extensions = self.get_stage(stage)
+        if not any(img_name.endswith(ext) for ext in image_extensions):
+            return True
+
+        if self.skip_existing and self.is_stage_done(stage, img_name):
+            return True
+
+        try:
+            with self.metrics.track_stage(stage, img_name):
+                text = await tool.aget_response(img_name)
+        except Exception as e:
+            logging.error(f"{stage} error in {img_name}: {e}")
+            await asyncio.to_thread(self.record_stage, stage, img_name, status="failed")
+            raise
+        await asyncio.to_thread(self.record_stage, stage, img_name, text)
+        return True
+
+    def run_stage(self, stage, image_names=None, max_in_flight=None):
+        """Run one stage over a list of images with up to max_in_flight concurrent requests.
+
+        Args:
+            stage: Stage name, one of the keys handled by get_stage
+            image_names: Images to process (default: the stage's default image list)
+            max_in_flight: Concurrent request limit (default: MAX_IN_FLIGHT env, or 32)
+
+        Returns:
+            (succeeded, failed) lists of image names
+        """
+        if image_names is None:
+            image_names = self.get_stage_image_names(stage)
+        self.get_stage(stage)
+        engine = AsyncStageEngine(max_in_flight=max_in_flight)
+        return engine.run(lambda img_name: self.arun_stage_image(stage, img_name), image_names, stage_name=stage)
+
     def get_caption(self, image_name=None):
         """Get caption for a single image or all images.
         
@@ -252,17 +397,17 @@ class AnnTool():
             if not any(img_name.endswith(ext) for ext in image_extensions):
                 continue
             
-            # Get file extension and replace accordingly
-            file_ext = os.path.splitext(img_name)[1]
-            caption_path = os.path.join(self.caption_save_dir, img_name.replace(file_ext, ".txt"))
-            if os.path.exists(caption_path):
+            if self.skip_existing and self.is_stage_done('caption', img_name):
                 continue
 
             try:
-                self.captioner.get_response(img_name)
+                with self.metrics.track_stage('caption', img_name):
+                    text = self.captioner.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_caption error in {img_name}: {e}")
+                self.record_stage('caption', img_name, status="failed")
                 raise
+            self.record_stage('caption', img_name, text)
 
     def get_checkcolor(self, image_name=None):
         """Check color for a single image or all images.
@@ -286,31 +431,44 @@ class AnnTool():
             if not any(img_name.endswith(ext) for ext in image_extensions):
                 continue
             
-            # Get file extension and replace accordingly
-            file_ext = os.path.splitext(img_name)[1]
-            check_file = os.path.join(self.color_check_save_dir, img_name.replace(file_ext, ".txt"))
-            if os.path.exists(check_file):
+            if self.skip_existing and self.is_stage_done('checkcolor', img_name):
                 continue
             try:
-                self.checkcolor.get_response(img_name)
+                with self.metrics.track_stage('checkcolor', img_name):
+                    text = self.checkcolor.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_checkcolor error in {img_name}: {e}")
-                time.sleep(60)
-                try:
-                    self.checkcolor.get_response(img_name)
-                except Exception as e2:
-                    logging.error(f"get_checkcolor retry error in {img_name}: {e2}")
-                    raise
+                self.record_stage('checkcolor', img_name, status="failed")
+                raise
+            self.record_stage('checkcolor', img_name, text)
+
+    def is_color_image(self, image_name):
+        """Whether the checkcolor result of an image says its colors are usable."""
+        if self.run_manifest is not None:
+            entry = self.run_manifest.get('checkcolor', self.color_check_save_dir, self.output_name(image_name))
+            return entry is not None and entry.status == "done" and "Yes" in (entry.result or "")
+        check_file = os.path.join(self.color_check_save_dir, self.output_name(image_name))
+        if not os.path.exists(check_file):
+            return False
+        with open(check_file, "r") as f:
+            return "Yes" in f.read()
+
+    def get_color_check_results(self):
+        """Checkcolor result of every checked image by result file name."""
+        if self.run_manifest is not None:
+            return {name: entry.result or "" for name, entry in
+                    self.run_manifest.outputs('checkcolor', self.color_check_save_dir).items()}
+        results = {}
+        for color_check_file in os.listdir(self.color_check_save_dir):
+            with open(os.path.join(self.color_check_save_dir, color_check_file), "r") as f:
+                results[color_check_file] = f.read()
+        return results
 
     def split_color_noncolor(self):
         color_annotation_names = []
         noncolor_annotation_names = []
         others_annotation_names = []
-        color_check_files = os.listdir(self.color_check_save_dir)
-        for color_check_file in color_check_files:
-            with open(os.path.join(self.color_check_save_dir, color_check_file), "r") as f:
-                color_annotation = f.read()
-
+        for color_check_file, color_annotation in self.get_color_check_results().items():
             print('color_annotation: ', color_annotation)
             if "Yes" in color_annotation:
                 color_annotation_names.append(color_check_file.replace(".txt", ".jpg"))
@@ -343,21 +501,16 @@ class AnnTool():
             if not any(img_name.endswith(ext) for ext in image_extensions):
                 continue
             
-            # Get file extension and replace accordingly
-            file_ext = os.path.splitext(img_name)[1]
-            image_path = os.path.join(self.color_annotator_save_dir, img_name.replace(file_ext, ".txt"))
-            if os.path.exists(image_path):
+            if self.skip_existing and self.is_stage_done('color_annotator', img_name):
                 continue
             try:
-                self.color_annotator.get_response(img_name)
+                with self.metrics.track_stage('color_annotator', img_name):
+                    text = self.color_annotator.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_color_annotator error in {img_name}: {e}")
-                time.sleep(60)
-                try:
-                    self.color_annotator.get_response(img_name)
-                except Exception as e2:
-                    logging.error(f"get_color_annotator retry error in {img_name}: {e2}")
-                    raise
+                self.record_stage('color_annotator', img_name, status="failed")
+                raise
+            self.record_stage('color_annotator', img_name, text)
 
     def get_noncolor_annotator(self, image_name=None):
         """Get noncolor annotation for a single image or all noncolor images.
@@ -373,14 +526,16 @@ class AnnTool():
         for img_name in image_names:
             if not img_name.endswith('.jpg'):
                 continue
-            annotation_path = os.path.join(self.noncolor_annotator_save_dir, img_name.replace(".jpg", ".txt"))
-            if os.path.exists(annotation_path):
+            if self.skip_existing and self.is_stage_done('noncolor_annotator', img_name):
                 continue
             try:
-                self.noncolor_annotator.get_response(img_name)
+                with self.metrics.track_stage('noncolor_annotator', img_name):
+                    text = self.noncolor_annotator.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_noncolor_annotator error in {img_name}: {e}")
+                self.record_stage('noncolor_annotator', img_name, status="failed")
                 raise
+            self.record_stage('noncolor_annotator', img_name, text)
 
     def get_check_annotation_color(self, image_name=None):
         """Check color annotation for a single image or all color images.
@@ -404,22 +559,17 @@ class AnnTool():
             if not any(img_name.endswith(ext) for ext in image_extensions):
                 continue
             
-            # Get file extension and replace accordingly
-            file_ext = os.path.splitext(img_name)[1]
-            check_path = os.path.join(self.color_check_annotation_save_dir, img_name.replace(file_ext, ".txt"))
-            if os.path.exists(check_path):
+            if self.skip_existing and self.is_stage_done('check_annotation_color', img_name):
                 continue
             
             try:
-                self.color_check_annotation.get_response(img_name)
+                with self.metrics.track_stage('check_annotation_color', img_name):
+                    text = self.color_check_annotation.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_check_annotation_color error in {img_name}: {e}")
-                time.sleep(60)
-                try:
-                    self.color_check_annotation.get_response(img_name)
-                except Exception as e2:
-                    logging.error(f"get_check_annotation_color retry error in {img_name}: {e2}")
-                    raise
+                self.record_stage('check_annotation_color', img_name, status="failed")
+                raise
+            self.record_stage('check_annotation_color', img_name, text)
 
     def get_check_annotation_noncolor(self, image_name=None):
         """Check noncolor annotation for a single image or all noncolor images.
@@ -435,14 +585,16 @@ class AnnTool():
         for img_name in image_names:
             if not img_name.endswith('.jpg'):
                 continue
-            check_path = os.path.join(self.noncolor_check_annotation_save_dir, img_name.replace(".jpg", ".txt"))
-            if os.path.exists(check_path):
+            if self.skip_existing and self.is_stage_done('check_annotation_noncolor', img_name):
                 continue
             try:
-                self.noncolor_check_annotation.get_response(img_name)
+                with self.metrics.track_stage('check_annotation_noncolor', img_name):
+                    text = self.noncolor_check_annotation.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_check_annotation_noncolor error in {img_name}: {e}")
+                self.record_stage('check_annotation_noncolor', img_name, status="failed")
                 raise
+            self.record_stage('check_annotation_noncolor', img_name, text)
 
     def get_regenerate_annotation_color(self, image_name=None):
         """Regenerate color annotation for a single image or all color images.
@@ -466,22 +618,17 @@ class AnnTool():
             if not any(img_name.endswith(ext) for ext in image_extensions):
                 continue
             
-            # Get file extension and replace accordingly
-            file_ext = os.path.splitext(img_name)[1]
-            regenerate_path = os.path.join(self.color_regenerate_annotator_save_dir, img_name.replace(file_ext, ".txt"))
-            if os.path.exists(regenerate_path):
+            if self.skip_existing and self.is_stage_done('regenerate_annotation_color', img_name):
                 continue
 
             try:
-                self.color_regenerate_annotator.get_response(img_name)
+                with self.metrics.track_stage('regenerate_annotation_color', img_name):
+                    text = self.color_regenerate_annotator.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_regenerate_annotation_color error in {img_name}: {e}")
-                time.sleep(60)
-                try:
-                    self.color_regenerate_annotator.get_response(img_name)
-                except Exception as e2:
-                    logging.error(f"get_regenerate_annotation_color retry error in {img_name}: {e2}")
-                    raise
+                self.record_stage('regenerate_annotation_color', img_name, status="failed")
+                raise
+            self.record_stage('regenerate_annotation_color', img_name, text)
 
     def get_regenerate_annotation_noncolor(self, image_name=None):
         """Regenerate noncolor annotation for a single image or all noncolor images.
@@ -497,14 +644,16 @@ class AnnTool():
         for img_name in image_names:
             if not img_name.endswith('.jpg'):
                 continue
-            regenerate_path = os.path.join(self.noncolor_regenerate_annotator_save_dir, img_name.replace(".jpg", ".txt"))
-            if os.path.exists(regenerate_path):
+            if self.skip_existing and self.is_stage_done('regenerate_annotation_noncolor', img_name):
                 continue
             try:
-                self.noncolor_regenerate_annotator.get_response(img_name)
+                with self.metrics.track_stage('regenerate_annotation_noncolor', img_name):
+                    text = self.noncolor_regenerate_annotator.get_response(img_name)
             except Exception as e:
                 logging.error(f"get_regenerate_annotation_noncolor error in {img_name}: {e}")
+                self.record_stage('regenerate_annotation_noncolor', img_name, status="failed")
                 raise
+            self.record_stage('regenerate_annotation_noncolor', img_name, text)
     
     def process_single_noncolor_image(self, image_name):
         """Process a single noncolor image through the complete pipeline.
@@ -545,8 +694,8 @@ class AnnTool():
             print(f"[{image_name}] ✗ Error: {e}")
             return False
     
-    def noncolor_run(self, non_color_path):
-        """Process all noncolor images one by one through the complete pipeline."""
+    def noncolor_run(self, non_color_path, max_in_flight=None):
+        """Process all noncolor images through the complete pipeline with the per-image scheduler."""
         print("="*60)
         print("Starting Noncolor Annotation Pipeline")
         print("="*60)
@@ -558,15 +707,11 @@ class AnnTool():
         print(f"Total images to process: {total_images}")
         print("="*60)
         
-        success_count = 0
-        fail_count = 0
-        
-        for idx, image_name in enumerate(self.noncolor_annotation_names, 1):
-            print(f"\n[{idx}/{total_images}] Processing: {image_name}")
-            if self.process_single_noncolor_image(image_name):
-                success_count += 1
-            else:
-                fail_count += 1
+        # Images flow through caption -> annotate -> check -> regenerate concurrently
+        results = PipelineScheduler(self, mode='noncolor', max_in_flight=max_in_flight).run(self.noncolor_annotation_names)
+        summary = PipelineScheduler.summarize(results)
+        success_count = summary['total'] - summary['failed']
+        fail_count = summary['failed']
         
         print("\n" + "="*60)
         print("Noncolor Annotation Pipeline Completed!")
@@ -595,14 +740,7 @@ class AnnTool():
             print(f"[{image_name}] ✓ Color checked")
             
             # Step 3: Determine if it's a color image
-            # Get file extension and replace accordingly
-            file_ext = os.path.splitext(image_name)[1]
-            check_file = os.path.join(self.color_check_save_dir, image_name.replace(file_ext, ".txt"))
-            is_color = False
-            if os.path.exists(check_file):
-                with open(check_file, "r") as f:
-                    check_result = f.read()
-                    is_color = "Yes" in check_result
+            is_color = self.is_color_image(image_name)
             
             if not is_color:
                 print(f"[{image_name}] ⚠ Not a color image, skipping color-specific steps")
@@ -640,8 +778,8 @@ class AnnTool():
             print(f"[{image_name}] ✗ Error: {e}")
             return False
     
-    def color_run(self, color_path):
-        """Process all color images one by one through the complete pipeline."""
+    def color_run(self, color_path, max_in_flight=None):
+        """Process all color images through the complete pipeline with the per-image scheduler."""
         print("="*60)
         print("Starting Color Annotation Pipeline")
         print("="*60)
@@ -654,40 +792,37 @@ class AnnTool():
         print(f"Total images to process: {total_images}")
         print("="*60)
         
-        success_count = 0
-        fail_count = 0
-        
-        for idx, image_name in enumerate(all_image_names, 1):
-            print(f"\n[{idx}/{total_images}] Processing: {image_name}")
-            if self.process_single_color_image(image_name):
-                success_count += 1
-            else:
-                fail_count += 1
+        # Images flow through caption/checkcolor -> annotate -> check -> regenerate concurrently;
+        # images not checked as color stop after checkcolor
+        results = PipelineScheduler(self, mode='color', max_in_flight=max_in_flight).run(all_image_names)
+        summary = PipelineScheduler.summarize(results)
+        success_count = summary['total'] - summary['failed']
+        fail_count = summary['failed']
         
         print("\n" + "="*60)
         print("Color Annotation Pipeline Completed!")
         print(f"Total: {total_images}, Success: {success_count}, Failed: {fail_count}")
         print("="*60)
 
-    def run(self):
+    def run(self, max_in_flight=None):
         # step 1: caption generation
-        self.get_caption()
+        self.run_stage('caption', max_in_flight=max_in_flight)
         # step 2: check color
         self.color_annotation_names, self.noncolor_annotation_names, self.others_annotation_names = self.split_color_noncolor()
 
         # step 4: color annotation
-        self.get_color_annotator()
+        self.run_stage('color_annotator', max_in_flight=max_in_flight)
         # step 5: check color annotation
-        self.get_check_annotation_color()
+        self.run_stage('check_annotation_color', max_in_flight=max_in_flight)
         # step 6: regenerate color annotation
-        self.get_regenerate_annotation_color()
+        self.run_stage('regenerate_annotation_color', max_in_flight=max_in_flight)
 
         # step 7: noncolor annotation
-        self.get_noncolor_annotator()
+        self.run_stage('noncolor_annotator', max_in_flight=max_in_flight)
         # step 8: check noncolor annotation
-        self.get_check_annotation_noncolor()
+        self.run_stage('check_annotation_noncolor', max_in_flight=max_in_flight)
         # step 9: regenerate noncolor annotation
-        self.get_regenerate_annotation_noncolor()
+        self.run_stage('regenerate_annotation_noncolor', max_in_flight=max_in_flight)
 
 
 
@@ -0,0 +1,12 @@
+from .chat_tool import ChatTool
+from .http_client import HTTPClient, get_http_client
+from .image_cache import ImageCache, get_image_cache
+from .image_prep import ImagePreparer, get_image_preparer
+from .metrics import Metrics, get_metrics
+from .payload import PayloadTemplate, RenderedPayload, get_payload_template
+from .prompt_cache import PromptCache, get_prompt_cache
+from .response_cache import ResponseCache, fingerprint_payload, get_response_cache
+from .rate_limiter import RateLimiter, estimate_request_tokens, get_rate_limiter
+from .retry import APIError, FatalAPIError, RetryableAPIError, RetryPolicy, get_retry_policy
+from .token_ledger import TokenLedger, get_token_ledger
+from .run_manifest import RunManifest, completed_outputs, get_run_manifest
@@ -0,0 +1,50 @@
+"""Shared request path of the online annotation tools."""
+import asyncio
+from typing import Dict, Optional
+
+from .payload import RenderedPayload
+from .response_cache import salted_fingerprint
+
+
+class ChatTool():
+    """Send the chat completion request of one image and save its response.
+
+    Subclasses set ``stage`` and ``client``, ``url`` and ``headers``, and implement
+    ``get_payload(image_name)`` (returning a ``RenderedPayload``, or None to skip the
+    image) and ``save_response(image_name, res)``.
+
+    ``stage`` names the tool: it selects the query image preparation settings
+    (``get_image_preparer``) and keys the tool's requests in the metrics, the token
+    ledger and the run manifest. The batch scripts of a tool reuse the same name for
+    the batch tracker.
+    """
+
+    stage: Optional[str] = None
+
+    def request(self, image_name: str, payload: RenderedPayload, salt=None) -> Dict:
+        """Send a rendered payload; ``salt`` tells repeated samples of it apart in the response cache."""
+        return self.client.chat_completion(self.url, headers=self.headers, content=payload.body,
+                                           token_cost=payload.token_cost,
+                                           fingerprint=salted_fingerprint(payload.fingerprint, salt),
+                                           stage=self.stage, image_name=image_name, image_tokens=payload.image_tokens)
+
+    async def arequest(self, image_name: str, payload: RenderedPayload, salt=None) -> Dict:
+        """Async version of :meth:`request`."""
+        return await self.client.achat_completion(self.url, headers=self.headers, content=payload.body,
+                                                  token_cost=payload.token_cost,
+                                                  fingerprint=salted_fingerprint(payload.fingerprint, salt),
+                                                  stage=self.stage, image_name=image_name,
+                                                  image_tokens=payload.image_tokens)
+
+    def get_response(self, image_name: str):
+        payload = self.get_payload(image_name)
+        if payload is None:
+            return None
+        return self.save_response(image_name, self.request(image_name, payload))
+
+    async def aget_response(self, image_name: str):
+        """Async version of get_response; file reads and encoding run in a worker thread."""
+        payload = await asyncio.to_thread(self.get_payload, image_name)
+        if payload is None:
+            return None
+        return self.save_response(image_name, await self.arequest(image_name, payload))
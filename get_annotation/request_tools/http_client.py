@@ -0,0 +1,193 @@
+"""Shared pooled HTTP client used by every GPT tool class."""
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from .metrics import get_metrics
+from .rate_limiter import get_rate_limiter
+from .response_cache import get_response_cache
+from .retry import check_response, get_retry_policy
+from .token_ledger import get_token_ledger
+load_dotenv()
+
+
+class HTTPClient():
+    """Keep-alive HTTP client shared by all tools in one process.
+
+    A single ``httpx.Client`` keeps TCP/TLS connections to the API host open
+    between requests, negotiates HTTP/2 when the server supports it and
+    enforces connect/read timeouts so one hung socket cannot stall a run.
+    """
+
+    def __init__(self, connect_timeout: float = 10.0, read_timeout: float = 120.0,
+                max_connections: int = 64, max_keepalive_connections: int = 32,
+                http2: bool = True):
+        """Initialize the shared client.
+
+        Args:
+            connect_timeout: Seconds allowed to establish a connection
+            read_timeout: Seconds allowed between bytes of the response
+            max_connections: Maximum number of open connections in the pool
+            max_keepalive_connections: Maximum number of idle connections kept alive
+            http2: Negotiate HTTP/2 when the server supports it
+        """
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, write=read_timeout, pool=None)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections)
+        self.http2 = http2
+        self.client = httpx.Client(timeout=self.timeout, limits=self.limits, http2=self.http2)
+        # httpx.AsyncClient is bound to the event loop it was created on
+        self.async_client = None
+        self.async_loop = None
+        self.rate_limiter = get_rate_limiter()
+        self.retry_policy = get_retry_policy()
+        self.response_cache = get_response_cache()
+        self.metrics = get_metrics()
+        self.token_ledger = get_token_ledger()
+
+    def post(self, url: str, headers: Optional[Dict[str, str]] = None, json=None,
+             content: Optional[bytes] = None, token_cost: int = 0) -> httpx.Response:
+        """Send a POST request through the pooled connections.
+
+        Args:
+            token_cost: Estimated tokens of the request, reserved from the shared
+                RPM/TPM budget before it is sent
+        """
+        self.rate_limiter.acquire(token_cost)
+        response = self.client.post(url, headers=headers, json=json, content=content)
+        self.rate_limiter.update_from_headers(response.headers)
+        return response
+
+    async def apost(self, url: str, headers: Optional[Dict[str, str]] = None, json=None,
+                    content: Optional[bytes] = None, token_cost: int = 0) -> httpx.Response:
+        """Send a POST request from a coroutine through the async connection pool."""
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_loop is not loop:
+            self.async_client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, http2=self.http2)
+            self.async_loop = loop
+        await self.rate_limiter.aacquire(token_cost)
+        response = await self.async_client.post(url, headers=headers, json=json, content=content)
+        self.rate_limiter.update_from_headers(response.headers)
+        return response
+
+    def chat_completion(self, url: str, headers: Optional[Dict[str, str]] = None, json=None,
+                        content: Optional[bytes] = None, token_cost: int = 0,
+                        fingerprint: Optional[str] = None, stage: Optional[str] = None,
+                        image_name: Optional[str] = None, image_tokens: Optional[int] = None) -> Dict:
+        """POST a chat completion request and return its JSON body, retrying transient failures.
+
+        Args:
+            fingerprint: Request fingerprint; when given, a cached response is returned
+                instead of calling the API and new responses are stored in the cache
+            stage: Stage the request belongs to, used to label its metrics
+            image_name: Image the request is for, recorded in the token ledger
+            image_tokens: Estimated prompt tokens of the request's images, recorded in the token ledger
+
+        Raises:
+            FatalAPIError: The request was rejected (e.g. 400, content filter)
+            RetryableAPIError: A transient failure persisted past the retry budget
+        """
+        stage = stage or "other"
+        if fingerprint is not None and self.response_cache is not None:
+            res = self.response_cache.get(fingerprint)
+            if res is not None:
+                self.metrics.record_response(stage, res, cached=True)
+                return res
+        attempt = 0
+
+        def send():
+            nonlocal attempt
+            attempt += 1
+            self.metrics.record_attempt(stage, attempt)
+            try:
+                response = self.post(url, headers=headers, json=json, content=content, token_cost=token_cost)
+                self.metrics.record_bytes(stage, len(response.request.content), len(response.content))
+                return check_response(response)
+            except Exception as e:
+                self.metrics.record_error(stage, e)
+                raise
+        start = time.monotonic()
+        with self.metrics.track_request(stage):
+            res = self.retry_policy.call(send)
+        self.metrics.record_response(stage, res)
+        if self.token_ledger is not None:
+            self.token_ledger.record(res, stage, image=image_name, image_tokens=image_tokens,
+                                     latency=time.monotonic() - start)
+        if fingerprint is not None and self.response_cache is not None:
+            self.response_cache.put(fingerprint, res)
+        return res
+
+    async def achat_completion(self, url: str, headers: Optional[Dict[str, str]] = None, json=None,
+                               content: Optional[bytes] = None, token_cost: int = 0,
+                               fingerprint: Optional[str] = None, stage: Optional[str] = None,
+                        image_name: Optional[str] = None, image_tokens: Optional[int] = None) -> Dict:
+        """Async version of :meth:`chat_completion`; cache reads and writes run in a worker thread."""
+        stage = stage or "other"
+        if fingerprint is not None and self.response_cache is not None:
+            res = await asyncio.to_thread(self.response_cache.get, fingerprint)
+            if res is not None:
+                self.metrics.record_response(stage, res, cached=True)
+                return res
+        attempt = 0
+
+        async def send():
+            nonlocal attempt
+            attempt += 1
+            self.metrics.record_attempt(stage, attempt)
+            try:
+                response = await self.apost(url, headers=headers, json=json, content=content, token_cost=token_cost)
+                self.metrics.record_bytes(stage, len(response.request.content), len(response.content))
+                return check_response(response)
+            except Exception as e:
+                self.metrics.record_error(stage, e)
+                raise
+        start = time.monotonic()
+        with self.metrics.track_request(stage):
+            res = await self.retry_policy.acall(send)
+        self.metrics.record_response(stage, res)
+        if self.token_ledger is not None:
+            await asyncio.to_thread(self.token_ledger.record, res, stage, image=image_name,
+                                    image_tokens=image_tokens, latency=time.monotonic() - start)
+        if fingerprint is not None and self.response_cache is not None:
+            await asyncio.to_thread(self.response_cache.put, fingerprint, res)
+        return res
+
+    async def aclose(self):
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+            self.async_loop = None
+
+    def close(self):
+        self.client.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HTTPClient:
+    """Return the process-wide HTTP client, creating it on first use.
+
+    Timeouts and pool size are read from the environment:
+    ``OPENAI_CONNECT_TIMEOUT``, ``OPENAI_READ_TIMEOUT``, ``OPENAI_MAX_CONNECTIONS``
+    and ``OPENAI_HTTP2``.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                max_connections = int(os.getenv('OPENAI_MAX_CONNECTIONS', '64'))
+                _client = HTTPClient(
+                    connect_timeout=float(os.getenv('OPENAI_CONNECT_TIMEOUT', '10')),
+                    read_timeout=float(os.getenv('OPENAI_READ_TIMEOUT', '120')),
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    http2=os.getenv('OPENAI_HTTP2', '1') not in ('0', 'false', 'False'),
+                )
+    return _client
@@ -0,0 +1,113 @@
+"""Bounded cache of prepared, base64-encoded query images shared by all stages."""
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+class ImageCache():
+    """LRU cache of base64 query images, with an optional on-disk spill.
+
+    Keys are content addresses built from the image path, mtime, size and encode
+    settings, so the color stages that send the same image share one entry. Entries
+    are evicted least-recently-used once ``max_bytes`` is exceeded. With ``spill_dir``
+    set, prepared JPEG bytes are also written to disk so later stages running in other
+    processes skip the decode, resize and encode work.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, spill_dir: Optional[str] = None):
+        """Initialize the cache.
+
+        Args:
+            max_bytes: Maximum total size of the in-memory base64 strings
+            spill_dir: Directory for prepared images on disk, or None for memory only
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(image_path: str, *settings) -> str:
+        st = os.stat(image_path)
+        key = repr((os.path.abspath(image_path), st.st_mtime_ns, st.st_size) + settings)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, prepare: Callable[[], bytes]) -> str:
+        """Return the base64 image for ``key``, calling ``prepare`` only on a miss."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        data = self.load(key)
+        if data is None:
+            data = prepare()
+            self.save(key, data)
+        encoded = base64.b64encode(data).decode('utf-8')
+
+        with self.lock:
+            if key not in self.entries and len(encoded) <= self.max_bytes:
+                self.entries[key] = encoded
+                self.size += len(encoded)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return encoded
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, key[:2], f"{key}.jpg")
+
+    def load(self, key: str) -> Optional[bytes]:
+        if not self.spill_dir:
+            return None
+        try:
+            with open(self.get_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save(self, key: str, data: bytes):
+        if not self.spill_dir:
+            return
+        path = self.get_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """Return the query image cache shared by every tool in this process.
+
+    ``IMAGE_CACHE_MB`` bounds the in-memory cache (default 256, 0 disables it) and
+    ``IMAGE_CACHE_DISK=1`` spills prepared images to ``$CACHE_DIR/query_images``.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache_dir = os.getenv('CACHE_DIR', './cache')
+                spill = os.getenv('IMAGE_CACHE_DISK', '0') not in ('0', 'false', 'False', '')
+                _cache = ImageCache(
+                    max_bytes=int(float(os.getenv('IMAGE_CACHE_MB', '256')) * 1024 * 1024),
+                    spill_dir=os.path.join(cache_dir, 'query_images') if spill and cache_dir else None,
+                )
+    return _cache
@@ -0,0 +1,106 @@
+"""Downscale and re-encode query images before they are uploaded."""
+import os
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image
+from dotenv import load_dotenv
+load_dotenv()
+
+from .image_cache import get_image_cache
+from .rate_limiter import HIGH_DETAIL_MAX_SIDE, HIGH_DETAIL_SHORT_SIDE
+
+# Side length of the single tile the API looks at for ``detail: low``
+LOW_DETAIL_MAX_SIDE = 512
+
+# Per-stage defaults; the stage's own environment variables override them, the global
+# ones do not (see get_image_preparer)
+STAGE_DEFAULTS = {
+    'caption': {'max_side': 512, 'quality': 75, 'detail': 'low'},
+}
+DEFAULT_SETTINGS = {'max_side': None, 'quality': 90, 'detail': 'high'}
+
+
+def fit_size(width: int, height: int, max_side: Optional[int], detail: str) -> Tuple[int, int]:
+    """Largest size not bigger than the image that the API would not downscale further.
+
+    With ``max_side`` None this is the size the API itself resizes to: for ``detail: high``
+    the image is fit in 2048x2048 and then its short side is reduced to 768; for
+    ``detail: low`` it is fit in 512x512. Sending more pixels than that only costs bytes.
+    """
+    if max_side is not None:
+        scale = min(1.0, max_side / max(width, height))
+    elif detail == 'low':
+        scale = min(1.0, LOW_DETAIL_MAX_SIDE / max(width, height))
+    else:
+        scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height), HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class ImagePreparer():
+    """Prepare query images for one stage: downscale, re-encode as JPEG and base64 encode.
+
+    JPEGs are decoded in draft mode, so libjpeg scales them by 1/2, 1/4 or 1/8 while
+    decoding instead of producing the full-resolution image first. JPEGs that already
+    fit are sent as-is without re-encoding.
+    """
+
+    def __init__(self, max_side: Optional[int] = None, quality: int = 90, detail: str = 'high'):
+        """Initialize the preparer.
+
+        Args:
+            max_side: Maximum width/height in pixels, or None for the size the API
+                would downscale to at this detail level
+            quality: JPEG quality used when the image is re-encoded
+            detail: Detail level sent with the image ('high', 'low' or 'auto')
+        """
+        self.max_side = max_side
+        self.quality = quality
+        self.detail = detail
+
+    def prepare(self, image_path: str) -> bytes:
+        """Return the JPEG bytes to upload for an image."""
+        with Image.open(image_path) as img:
+            size = fit_size(img.width, img.height, self.max_side, self.detail)
+            if size == img.size and img.format == 'JPEG':
+                with open(image_path, "rb") as f:
+                    return f.read()
+            if img.format == 'JPEG':
+                img.draft('RGB', size)
+            img = img.convert('RGB')
+            if img.size != size:
+                img = img.resize(size, Image.BICUBIC)
+            buffer = BytesIO()
+            img.save(buffer, format="JPEG", quality=self.quality)
+            return buffer.getvalue()
+
+    def encode(self, image_path: str) -> str:
+        """Return the prepared image as a base64 string for a ``data:image/jpeg`` URL.
+
+        Looked up in the shared query image cache first, so stages with the same
+        settings prepare each image only once.
+        """
+        key = get_image_cache().get_key(image_path, self.max_side, self.quality, self.detail)
+        return get_image_cache().get(key, lambda: self.prepare(image_path))
+
+
+def get_image_preparer(stage: str) -> ImagePreparer:
+    """Build the image preparer of a stage.
+
+    Each setting comes from ``IMAGE_MAX_SIDE_<STAGE>``, ``IMAGE_QUALITY_<STAGE>`` and
+    ``IMAGE_DETAIL_<STAGE>`` (e.g. ``IMAGE_MAX_SIDE_CHECKCOLOR``), then from the stage
+    defaults, then from ``IMAGE_MAX_SIDE``, ``IMAGE_QUALITY`` and ``IMAGE_DETAIL``. The
+    global variables only apply to settings a stage has no default for, so e.g. the
+    caption stage stays at low detail unless ``IMAGE_DETAIL_CAPTION`` is set.
+    """
+    stage_defaults = STAGE_DEFAULTS.get(stage, {})
+    settings = {}
+    for name, default in DEFAULT_SETTINGS.items():
+        value = os.getenv(f'IMAGE_{name.upper()}_{stage.upper()}')
+        if not value:
+            value = stage_defaults[name] if name in stage_defaults else os.getenv(f'IMAGE_{name.upper()}')
+        settings[name] = value or default
+    max_side = settings['max_side']
+    return ImagePreparer(max_side=int(max_side) if max_side else None,
+                         quality=int(settings['quality']),
+                         detail=settings['detail'])
@@ -0,0 +1,257 @@
+"""Per-stage request metrics in the Prometheus text format, with optional OpenTelemetry spans."""
+import atexit
+import contextlib
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric():
+    """A counter or gauge with one value per label combination."""
+
+    def __init__(self, name: str, kind: str, help: str, labels: Tuple[str, ...] = ("stage",)):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count of observations per label combination."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ("stage",), buckets=LATENCY_BUCKETS):
+        super().__init__(name, "histogram", help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    le_label = f'le="{le}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le_label)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(counts[-1])}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Metrics():
+    """Counters, latency histograms and in-flight gauges of the stages and their API requests.
+
+    Stage metrics cover one ``get_response`` call of a tool for one image, request
+    metrics one chat completion including its retries. Everything is labelled with
+    the stage, so the slowest or most throttled stage stands out under load. With
+    tracing enabled and OpenTelemetry installed, every stage call is a span, nested
+    under the span of its image when the pipeline scheduler runs the image.
+    """
+
+    def __init__(self, tracing: bool = False):
+        """Initialize the metrics.
+
+        Args:
+            tracing: Create OpenTelemetry spans (ignored if opentelemetry is not installed)
+        """
+        self.tracer = trace.get_tracer("rdannotator") if tracing and trace is not None else None
+        self.stage_calls = Metric("rdannotator_stage_calls_total", "counter",
+                                  "Stage calls (get_response of one image) by outcome", ("stage", "outcome"))
+        self.stage_duration = Histogram("rdannotator_stage_duration_seconds", "Duration of stage calls")
+        self.stage_in_flight = Metric("rdannotator_stage_in_flight", "gauge", "Stage calls in progress")
+        self.requests = Metric("rdannotator_requests_total", "counter",
+                               "Chat completion requests by outcome (ok, cached, failed)", ("stage", "outcome"))
+        self.request_duration = Histogram("rdannotator_request_duration_seconds",
+                                          "Duration of chat completion requests including retries")
+        self.requests_in_flight = Metric("rdannotator_requests_in_flight", "gauge", "Chat completion requests in progress")
+        self.request_errors = Metric("rdannotator_request_errors_total", "counter",
+                                     "Failed request attempts by status code or exception", ("stage", "error"))
+        self.retries = Metric("rdannotator_request_retries_total", "counter", "Request attempts after the first")
+        self.bytes_sent = Metric("rdannotator_request_bytes_sent_total", "counter", "Request body bytes sent")
+        self.bytes_received = Metric("rdannotator_response_bytes_received_total", "counter", "Response body bytes received")
+        self.prompt_tokens = Metric("rdannotator_prompt_tokens_total", "counter", "Prompt tokens from the usage field")
+        self.completion_tokens = Metric("rdannotator_completion_tokens_total", "counter",
+                                        "Completion tokens from the usage field")
+        self.all_metrics = [self.stage_calls, self.stage_duration, self.stage_in_flight, self.requests,
+                            self.request_duration, self.requests_in_flight, self.request_errors, self.retries,
+                            self.bytes_sent, self.bytes_received, self.prompt_tokens, self.completion_tokens]
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[None]:
+        """OpenTelemetry span made current for the block, or nothing without tracing."""
+        if self.tracer is None:
+            yield
+            return
+        with self.tracer.start_as_current_span(name, attributes=attributes):
+            yield
+
+    @contextlib.contextmanager
+    def track_stage(self, stage: str, image_name: Optional[str] = None) -> Iterator[None]:
+        """Count, time and trace one stage call; usable around ``await`` as well."""
+        self.stage_in_flight.inc(stage)
+        start = time.perf_counter()
+        outcome = "failed"
+        try:
+            with self.span(stage, image=image_name or ""):
+                yield
+            outcome = "ok"
+        finally:
+            self.stage_in_flight.dec(stage)
+            self.stage_duration.observe(time.perf_counter() - start, stage)
+            self.stage_calls.inc(stage, outcome)
+
+    @contextlib.contextmanager
+    def track_request(self, stage: str) -> Iterator[None]:
+        """Count and time one chat completion request, including its retries."""
+        self.requests_in_flight.inc(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.requests.inc(stage, "failed")
+            raise
+        finally:
+            self.requests_in_flight.dec(stage)
+            self.request_duration.observe(time.perf_counter() - start, stage)
+
+    def record_attempt(self, stage: str, attempt: int):
+        if attempt > 1:
+            self.retries.inc(stage)
+
+    def record_bytes(self, stage: str, sent: int, received: int):
+        self.bytes_sent.inc(stage, amount=sent)
+        self.bytes_received.inc(stage, amount=received)
+
+    def record_error(self, stage: str, error: Exception):
+        status_code = getattr(error, "status_code", None)
+        self.request_errors.inc(stage, str(status_code) if status_code else type(error).__name__)
+
+    def record_response(self, stage: str, res: Dict, cached: bool = False):
+        if cached:
+            self.requests.inc(stage, "cached")
+            return
+        self.requests.inc(stage, "ok")
+        usage = res.get("usage") or {}
+        self.prompt_tokens.inc(stage, amount=usage.get("prompt_tokens") or 0)
+        self.completion_tokens.inc(stage, amount=usage.get("completion_tokens") or 0)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.all_metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: str):
+        """Write the metrics atomically, e.g. for the node_exporter textfile collector."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_file_writer(self, path: str, interval: float):
+        """Rewrite ``path`` every ``interval`` seconds and once more at exit."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.write_file(path)
+        threading.Thread(target=run, daemon=True).start()
+        atexit.register(self.write_file, path)
+
+    def start_server(self, port: int, host: str = "0.0.0.0"):
+        """Serve the metrics on ``http://host:port/metrics`` from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Return the metrics of this process, starting the configured exporters on first use.
+
+    ``METRICS_FILE`` is rewritten every ``METRICS_INTERVAL`` seconds (default 15) and at
+    exit, ``METRICS_PORT`` serves ``/metrics`` over HTTP, and ``METRICS_TRACING=1``
+    creates OpenTelemetry spans through the globally configured tracer provider.
+    """
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                metrics = Metrics(tracing=os.getenv('METRICS_TRACING', '0') not in ('0', 'false', 'False', ''))
+                if os.getenv('METRICS_FILE'):
+                    metrics.start_file_writer(os.getenv('METRICS_FILE'), float(os.getenv('METRICS_INTERVAL', '15')))
+                if os.getenv('METRICS_PORT'):
+                    metrics.start_server(int(os.getenv('METRICS_PORT')))
+                _metrics = metrics
+    return _metrics
@@ -0,0 +1,70 @@
+"""Chat completion request bodies built from a pre-serialized constant prefix."""
+from typing import Dict, List, NamedTuple
+
+from .rate_limiter import estimate_completion_tokens, estimate_message_image_tokens, estimate_message_tokens
+from .response_cache import RequestFingerprint, canonical_json
+
+
+class RenderedPayload(NamedTuple):
+    """A request body ready to send, its estimated token cost and its fingerprint."""
+    body: bytes
+    token_cost: int
+    fingerprint: str
+    # estimated prompt tokens of the images, which the usage field does not report separately
+    image_tokens: int = 0
+
+
+class PayloadTemplate():
+    """Request parameters plus the constant message prefix, encoded to JSON bytes once.
+
+    The system message and few-shot messages (several MB of base64 for ``detail: high``
+    images) are identical for every request of a tool; only the query message changes.
+    ``render`` serializes just the query messages and joins them with the stored bytes.
+    """
+
+    def __init__(self, params: Dict, prefix_messages: List[Dict]):
+        """Initialize the template.
+
+        Args:
+            params: Request parameters (model, temperature, n, ...); any "messages" key is ignored
+            prefix_messages: Messages sent before the query message of every request
+        """
+        params = {key: value for key, value in params.items() if key != "messages"}
+        encoded_prefix = [canonical_json(message) for message in prefix_messages]
+        # {"model":...,"n":1,...,"messages":[<prefix>  +  ,<query>  +  ]}
+        self.head = b"".join([canonical_json(params)[:-1], b',"messages":[' if params else b'"messages":[',
+                              b",".join(encoded_prefix)])
+        self.tail = b"]}"
+        self.separator = b"," if prefix_messages else b""
+        self.fingerprint = RequestFingerprint(params)
+        for encoded_message in encoded_prefix:
+            self.fingerprint.add_message(encoded_message)
+        self.prefix_tokens = estimate_message_tokens(prefix_messages)
+        self.prefix_image_tokens = estimate_message_image_tokens(prefix_messages)
+        self.completion_tokens = estimate_completion_tokens(params)
+
+    def render(self, query_messages: List[Dict]) -> RenderedPayload:
+        """Build the request body with ``query_messages`` appended after the prefix."""
+        encoded_query = [canonical_json(message) for message in query_messages]
+        body = b"".join([self.head, self.separator, b",".join(encoded_query), self.tail])
+        fingerprint = self.fingerprint.copy()
+        for encoded_message in encoded_query:
+            fingerprint.add_message(encoded_message)
+        token_cost = self.prefix_tokens + estimate_message_tokens(query_messages) + self.completion_tokens
+        image_tokens = self.prefix_image_tokens + estimate_message_image_tokens(query_messages)
+        return RenderedPayload(body, token_cost, fingerprint.hexdigest(), image_tokens)
+
+
+def get_payload_template(tool) -> PayloadTemplate:
+    """Return the tool's template, building it on first use.
+
+    Built lazily because subclasses replace ``system_message`` after the parent
+    constructor has run; rebuilt if the payload, system or few-shot messages are replaced.
+    """
+    sources = (tool.payload, tool.system_message, tool.prompt_message)
+    template = getattr(tool, "payload_template", None)
+    if template is None or any(a is not b for a, b in zip(tool.payload_template_sources, sources)):
+        template = PayloadTemplate(tool.payload, [tool.system_message, *tool.prompt_message])
+        tool.payload_template = template
+        tool.payload_template_sources = sources
+    return template
@@ -0,0 +1,135 @@
+"""Process-wide cache of encoded few-shot prompt messages, persisted to disk."""
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
+
+
+def file_signature(path: str) -> Optional[List]:
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def prompt_image_names(prompt_file: str, image_dir: str) -> List[str]:
+    """Example image names a prompt file may refer to.
+
+    Prompt files are named ``<image>.txt`` or ``<image>_<part>.txt`` (``_info``, ``_ann``).
+    """
+    stem = os.path.splitext(prompt_file)[0]
+    candidates = [stem]
+    if "_" in stem:
+        candidates.append(stem.rsplit("_", 1)[0])
+    names = []
+    for candidate in candidates:
+        for ext in IMAGE_EXTENSIONS:
+            if os.path.exists(os.path.join(image_dir, candidate + ext)):
+                names.append(candidate + ext)
+    return names
+
+
+class PromptCache():
+    """Content-addressed cache of few-shot prompt messages shared by all tool classes.
+
+    The key covers the builder kind, the prompt directory and the mtime/size of every
+    prompt file and example image, so editing a prompt or replacing an image rebuilds
+    the entry. Entries are kept in memory for the life of the process and written to
+    ``cache_dir`` so the next start-up skips reading, resizing and base64 encoding.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """Initialize the cache.
+
+        Args:
+            cache_dir: Directory for persisted entries, or None to keep them in memory only
+        """
+        self.cache_dir = cache_dir
+        self.entries: Dict[str, List[Dict]] = {}
+        self.lock = threading.Lock()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, kind: str, prompt_dir: str, image_dir: str, extra=None) -> str:
+        prompt_dir = os.path.abspath(prompt_dir)
+        image_dir = os.path.abspath(image_dir)
+        files = []
+        for prompt_file in sorted(os.listdir(prompt_dir)):
+            files.append([prompt_file, file_signature(os.path.join(prompt_dir, prompt_file))])
+            for image_name in prompt_image_names(prompt_file, image_dir):
+                files.append([image_name, file_signature(os.path.join(image_dir, image_name))])
+        key = json.dumps([kind, prompt_dir, image_dir, files, extra], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, prompt_dir: str, image_dir: str, build: Callable[[], List[Dict]],
+            extra=None) -> List[Dict]:
+        """Return the prompt messages for ``prompt_dir``, calling ``build`` only on a miss.
+
+        Args:
+            kind: Name of the builder; tools that format prompts differently must use different kinds
+            prompt_dir: Directory with the few-shot prompt files
+            image_dir: Directory with the few-shot example images
+            build: Builds the messages when they are not cached
+            extra: Any other JSON-serializable input that changes the built messages
+        """
+        key = self.get_key(kind, prompt_dir, image_dir, extra)
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+            messages = self.load(key)
+            if messages is None:
+                messages = build()
+                self.save(key, messages)
+            self.entries[key] = messages
+            return messages
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, key: str) -> Optional[List[Dict]]:
+        if not self.cache_dir or not os.path.exists(self.get_path(key)):
+            return None
+        try:
+            with open(self.get_path(key), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key: str, messages: List[Dict]):
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self.get_path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(messages, f)
+            os.replace(tmp_path, self.get_path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prompt_cache() -> PromptCache:
+    """Return the prompt cache shared by every tool in this process.
+
+    Entries are persisted under ``$CACHE_DIR/prompt_messages`` (default ``./cache``);
+    set ``CACHE_DIR`` to an empty string to keep them in memory only.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache_dir = os.getenv('CACHE_DIR', './cache')
+                _cache = PromptCache(os.path.join(cache_dir, 'prompt_messages') if cache_dir else None)
+    return _cache
@@ -0,0 +1,249 @@
+"""Process-wide token-bucket rate limiter for the OpenAI RPM/TPM quotas."""
+import asyncio
+import base64
+import math
+import os
+import re
+import threading
+import time
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import Image
+from dotenv import load_dotenv
+load_dotenv()
+
+# Tokens charged per image by the vision models, see the OpenAI image input docs
+LOW_DETAIL_IMAGE_TOKENS = 85
+HIGH_DETAIL_TILE_TOKENS = 170
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+HIGH_DETAIL_TILE_SIZE = 512
+# Used when the size of an image cannot be read (a 1024x1024 high detail image)
+DEFAULT_IMAGE_TOKENS = 765
+# Completion tokens assumed per choice when the payload has no max_tokens
+DEFAULT_COMPLETION_TOKENS = 300
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Token cost of one image input at the given detail level."""
+    if detail == "low":
+        return LOW_DETAIL_IMAGE_TOKENS
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / HIGH_DETAIL_TILE_SIZE) * math.ceil(height / HIGH_DETAIL_TILE_SIZE)
+    return LOW_DETAIL_IMAGE_TOKENS + HIGH_DETAIL_TILE_TOKENS * tiles
+
+
+def image_url_tokens(url: str, detail: str) -> int:
+    """Token cost of a ``data:`` image URL.
+
+    Not cached: the URLs are whole base64 images, and a cache keyed by them would keep
+    the last query images alive. Only a prefix holding the header is usually decoded.
+    """
+    if detail == "low":
+        return LOW_DETAIL_IMAGE_TOKENS
+    if not url.startswith("data:"):
+        return DEFAULT_IMAGE_TOKENS
+    data = url.split(",", 1)[1]
+    # The JPEG/PNG header holding the size is near the start, so decode only a prefix first
+    for chunk in (data[:262144], data):
+        try:
+            chunk = chunk[:len(chunk) - len(chunk) % 4]
+            width, height = Image.open(BytesIO(base64.b64decode(chunk))).size
+            return estimate_image_tokens(width, height, detail)
+        except Exception:
+            continue
+    return DEFAULT_IMAGE_TOKENS
+
+
+def estimate_message_tokens(messages: List[Dict]) -> int:
+    """Estimate the prompt tokens of chat messages.
+
+    Text is counted at roughly four characters per token; images are counted with the
+    tile formula used by the vision models.
+    """
+    tokens = 0
+    for message in messages or []:
+        tokens += 4
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += len(part.get("text", "")) // 4
+            elif part.get("type") == "image_url":
+                image_url = part.get("image_url", {})
+                tokens += image_url_tokens(image_url.get("url", ""), image_url.get("detail", "high"))
+    return tokens
+
+
+def estimate_message_image_tokens(messages: List[Dict]) -> int:
+    """Estimate the prompt tokens of the images in chat messages."""
+    tokens = 0
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                image_url = part.get("image_url", {})
+                tokens += image_url_tokens(image_url.get("url", ""), image_url.get("detail", "high"))
+    return tokens
+
+
+def estimate_completion_tokens(payload: Dict) -> int:
+    """Completion tokens a request may use: ``max_tokens`` (or a default) per choice."""
+    n = payload.get("n") or 1
+    return n * (payload.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def estimate_request_tokens(payload: Dict) -> int:
+    """Estimate the tokens a chat completion request counts against the TPM quota.
+
+    The few-shot images sent with ``detail: high`` plus the query image dominate the
+    cost of every request in this repo.
+    """
+    return estimate_message_tokens(payload.get("messages")) + estimate_completion_tokens(payload)
+
+
+def parse_reset_duration(value: str) -> Optional[float]:
+    """Parse an ``x-ratelimit-reset-*`` value such as ``"1s"``, ``"6m0s"`` or ``"20ms"``."""
+    if not value:
+        return None
+    seconds = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds if matched else None
+
+
+class TokenBucket():
+    """A bucket that refills ``limit`` units per minute, up to ``limit`` units."""
+
+    def __init__(self, limit: Optional[float]):
+        self.limit = limit
+        self.level = limit
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.limit is None:
+            return
+        self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available (0 if available now)."""
+        if self.limit is None:
+            return 0.0
+        amount = min(amount, self.limit)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.limit
+
+    def set_limit(self, limit: float):
+        if self.limit is None:
+            self.level = limit
+        self.limit = limit
+        self.level = min(self.level, limit)
+
+
+class RateLimiter():
+    """Enforce requests-per-minute and tokens-per-minute budgets shared by all stages.
+
+    Each request reserves one request and its estimated token cost before it is sent.
+    Limits start from the configured values (or unlimited) and are corrected from the
+    ``x-ratelimit-*`` headers of every response, so the limiter tracks the real quota.
+    """
+
+    def __init__(self, rpm_limit: Optional[float] = None, tpm_limit: Optional[float] = None):
+        """Initialize the limiter.
+
+        Args:
+            rpm_limit: Requests per minute, or None to learn it from response headers
+            tpm_limit: Tokens per minute, or None to learn it from response headers
+        """
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self.lock = threading.Lock()
+
+    def try_acquire(self, token_cost: int) -> float:
+        """Reserve capacity if available; otherwise return the seconds to wait before retrying."""
+        with self.lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(token_cost))
+            if wait > 0:
+                return wait
+            if self.requests.limit is not None:
+                self.requests.level -= 1
+            if self.tokens.limit is not None:
+                self.tokens.level -= min(token_cost, self.tokens.limit)
+            return 0.0
+
+    def acquire(self, token_cost: int):
+        """Block the calling thread until the request fits in both budgets."""
+        while True:
+            wait = self.try_acquire(token_cost)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, token_cost: int):
+        """Wait in the event loop until the request fits in both budgets."""
+        while True:
+            wait = self.try_acquire(token_cost)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """Adjust limits and remaining budget from the ``x-ratelimit-*`` response headers."""
+        with self.lock:
+            now = time.monotonic()
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                try:
+                    if limit is not None:
+                        bucket.refill(now)
+                        bucket.set_limit(float(limit))
+                    if remaining is not None and bucket.limit is not None:
+                        bucket.refill(now)
+                        bucket.level = min(bucket.level, float(remaining))
+                except ValueError:
+                    continue
+                # A 429 with an exhausted budget: hold the bucket empty until the reset
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}", ""))
+                if remaining is not None and reset is not None and bucket.limit:
+                    try:
+                        if float(remaining) <= 0:
+                            bucket.level = -reset * bucket.limit / 60.0
+                    except ValueError:
+                        pass
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the limiter shared by every stage in this process.
+
+    ``OPENAI_RPM_LIMIT`` and ``OPENAI_TPM_LIMIT`` set the starting limits; when unset the
+    limits are learned from the first response's ``x-ratelimit-*`` headers.
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                rpm = os.getenv('OPENAI_RPM_LIMIT')
+                tpm = os.getenv('OPENAI_TPM_LIMIT')
+                _limiter = RateLimiter(rpm_limit=float(rpm) if rpm else None,
+                                       tpm_limit=float(tpm) if tpm else None)
+    return _limiter
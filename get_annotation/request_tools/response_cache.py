@@ -0,0 +1,147 @@
+"""Local cache of chat completion responses keyed by a fingerprint of the request."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def canonical_json(obj) -> bytes:
+    """Deterministic JSON encoding (sorted keys, compact separators) used for bodies and fingerprints."""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+class RequestFingerprint():
+    """Incremental SHA-256 fingerprint of a chat completion request.
+
+    The fingerprint covers the request parameters and the digest of each message in
+    order, so a constant prefix can be hashed once and ``copy``-ed for every request.
+    """
+
+    def __init__(self, params: Dict):
+        params = {key: value for key, value in params.items() if key != "messages"}
+        self.hasher = hashlib.sha256(canonical_json(params))
+
+    def add_message(self, encoded_message: bytes):
+        """Add one message, given as its canonical JSON encoding."""
+        self.hasher.update(hashlib.sha256(encoded_message).digest())
+
+    def copy(self) -> "RequestFingerprint":
+        fingerprint = RequestFingerprint.__new__(RequestFingerprint)
+        fingerprint.hasher = self.hasher.copy()
+        return fingerprint
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+def fingerprint_payload(payload: Dict) -> str:
+    """Fingerprint of a request body dict, e.g. the ``body`` of a batch request line."""
+    fingerprint = RequestFingerprint(payload)
+    for message in payload.get("messages") or []:
+        fingerprint.add_message(canonical_json(message))
+    return fingerprint.hexdigest()
+
+
+def salted_fingerprint(fingerprint: str, salt=None) -> str:
+    """Distinguish repeated samples of the same request (e.g. the captioner's n calls)."""
+    if salt is None:
+        return fingerprint
+    return hashlib.sha256(f"{fingerprint}:{salt}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache():
+    """SQLite store of successful responses, shared by the online tools and batch ingest.
+
+    Online requests are looked up by the fingerprint of their body. Batch scripts record
+    the fingerprint of every request line under (batch_id, custom_id) when the batch is
+    created, and batch ingest stores each returned body under that fingerprint, so a
+    later online run that sends the identical request body reuses the batch result.
+    """
+
+    def __init__(self, path: str):
+        """Initialize the cache.
+
+        Args:
+            path: SQLite database file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                          "fingerprint TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS batch_requests ("
+                          "batch_id TEXT NOT NULL, custom_id TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                          "PRIMARY KEY (batch_id, custom_id))")
+        self.conn.commit()
+
+    def get(self, fingerprint: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE fingerprint = ?",
+                                    (fingerprint,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, fingerprint: str, response: Dict):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                              (fingerprint, json.dumps(response, ensure_ascii=False), time.time()))
+            self.conn.commit()
+
+    def put_batch_requests(self, batch_id: str, requests: List[Dict]):
+        """Record the fingerprints of a batch's request lines (dicts with ``custom_id`` and ``body``)."""
+        self.put_batch_fingerprints(batch_id, [(request["custom_id"], fingerprint_payload(request["body"]))
+                                               for request in requests])
+
+    def put_batch_fingerprints(self, batch_id: str, fingerprints: List[Tuple[str, str]]):
+        """Record (custom_id, fingerprint) pairs already computed for a batch's request lines."""
+        rows = [(batch_id, custom_id, fingerprint) for custom_id, fingerprint in fingerprints]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO batch_requests VALUES (?, ?, ?)", rows)
+            self.conn.commit()
+
+    def get_batch_fingerprint(self, batch_id: str, custom_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT fingerprint FROM batch_requests WHERE batch_id = ? AND custom_id = ?",
+                                    (batch_id, custom_id)).fetchone()
+        return row[0] if row else None
+
+    def put_batch_response(self, batch_id: str, custom_id: str, response: Dict) -> bool:
+        """Store a batch output body under the fingerprint recorded for its request line."""
+        fingerprint = self.get_batch_fingerprint(batch_id, custom_id)
+        if fingerprint is None or not response.get("choices"):
+            return False
+        self.put(fingerprint, response)
+        return True
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the response cache shared by this process, or None when disabled.
+
+    Stored in ``$CACHE_DIR/responses.sqlite``; ``RESPONSE_CACHE=0`` or an empty
+    ``CACHE_DIR`` disables it.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache_dir = os.getenv('CACHE_DIR', './cache')
+                if not cache_dir or os.getenv('RESPONSE_CACHE', '1') in ('0', 'false', 'False'):
+                    return None
+                _cache = ResponseCache(os.path.join(cache_dir, 'responses.sqlite'))
+    return _cache
@@ -0,0 +1,155 @@
+"""Retry policy for chat completion requests: error classification and jittered backoff."""
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class APIError(Exception):
+    """A chat completion request that did not return a usable response."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class RetryableAPIError(APIError):
+    """A transient failure (rate limit, server error, timeout, dropped connection)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, body=None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message, status_code, body)
+        self.retry_after = retry_after
+
+
+class FatalAPIError(APIError):
+    """A failure that will not succeed on retry (bad request, content filter, auth)."""
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Seconds to wait from the ``retry-after-ms`` or ``Retry-After`` response headers."""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def check_response(response: httpx.Response) -> dict:
+    """Return the JSON body of a successful chat completion or raise a classified APIError."""
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    status_code = response.status_code
+    if status_code != 200:
+        message = f"HTTP {status_code}: {body if body is not None else response.text[:500]}"
+        if status_code in RETRYABLE_STATUS_CODES or status_code >= 500:
+            raise RetryableAPIError(message, status_code, body, parse_retry_after(response.headers))
+        raise FatalAPIError(message, status_code, body)
+    if not isinstance(body, dict) or not body.get("choices"):
+        # proxies sometimes answer 200 with an error body or a truncated response
+        raise RetryableAPIError(f"Malformed response: {str(body if body is not None else response.text)[:500]}",
+                                status_code, body)
+    for choice in body["choices"]:
+        if choice.get("finish_reason") == "content_filter":
+            raise FatalAPIError("Response blocked by the content filter", status_code, body)
+    return body
+
+
+def classify_exception(e: Exception) -> Exception:
+    """Map transport exceptions from httpx to RetryableAPIError; leave others unchanged."""
+    if isinstance(e, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return RetryableAPIError(f"{type(e).__name__}: {e}")
+    return e
+
+
+class RetryPolicy():
+    """Exponential backoff with full jitter, capped by attempts and total elapsed time."""
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 60.0,
+                 max_total_time: float = 600.0):
+        """Initialize the policy.
+
+        Args:
+            max_attempts: Maximum number of attempts per request, including the first
+            base_delay: Upper bound of the first backoff in seconds
+            max_delay: Upper bound of any single backoff in seconds
+            max_total_time: Give up once this many seconds have passed since the first attempt
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total_time = max_total_time
+
+    def get_delay(self, attempt: int, error: RetryableAPIError) -> float:
+        """Backoff before retry number ``attempt`` (1-based); ``Retry-After`` takes precedence."""
+        if error.retry_after is not None:
+            return min(error.retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def next_delay(self, attempt: int, error: Exception, start: float) -> float:
+        """Return the delay before the next attempt, or re-raise when the request must give up."""
+        if not isinstance(error, RetryableAPIError) or attempt >= self.max_attempts:
+            raise error
+        delay = self.get_delay(attempt, error)
+        if time.monotonic() - start + delay > self.max_total_time:
+            raise error
+        logging.warning(f"Retrying after {delay:.1f}s (attempt {attempt}/{self.max_attempts}): {error}")
+        return delay
+
+    def call(self, fn: Callable[[], dict]) -> dict:
+        """Call ``fn`` until it succeeds, a fatal error is raised or the budget is spent."""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return fn()
+            except Exception as e:
+                error = classify_exception(e)
+                time.sleep(self.next_delay(attempt, error, start))
+
+    async def acall(self, fn: Callable[[], Awaitable[dict]]) -> dict:
+        """Async version of :meth:`call`; backoff sleeps do not block the event loop."""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await fn()
+            except Exception as e:
+                error = classify_exception(e)
+                await asyncio.sleep(self.next_delay(attempt, error, start))
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Build the retry policy from ``RETRY_MAX_ATTEMPTS``, ``RETRY_BASE_DELAY``,
+    ``RETRY_MAX_DELAY`` and ``RETRY_MAX_TOTAL_TIME``."""
+    return RetryPolicy(
+        max_attempts=int(os.getenv('RETRY_MAX_ATTEMPTS', '6')),
+        base_delay=float(os.getenv('RETRY_BASE_DELAY', '1')),
+        max_delay=float(os.getenv('RETRY_MAX_DELAY', '60')),
+        max_total_time=float(os.getenv('RETRY_MAX_TOTAL_TIME', '600')),
+    )
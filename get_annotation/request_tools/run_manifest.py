@@ -0,0 +1,215 @@
+"""Run manifest of the per-image outputs of each stage, used for resume and skip decisions."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Stages whose output text is kept in the manifest, because later stages read it to
+# route an image (the checkcolor verdict decides between the color and noncolor branch)
+RESULT_STAGES = ("checkcolor",)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ManifestEntry(NamedTuple):
+    stage: str
+    image: Optional[str]
+    status: str
+    input_hash: Optional[str]
+    output_hash: Optional[str]
+    result: Optional[str]
+
+
+class RunManifest():
+    """SQLite manifest of the output file of every image in every save directory.
+
+    The whole manifest is loaded into memory when it is opened, so deciding whether an
+    image still has to be processed is a dict lookup instead of a metadata round trip
+    to the (network) filesystem per image. Other processes (a batch ingest next to an
+    online run) may write to the same file, so entries that are not done in memory are
+    read again with one indexed query before an image is run, and ``outputs`` reads
+    the rows of its directory again. The first time a save directory is used,
+    the outputs already in it are imported with a single listing; from then on the
+    manifest is authoritative and outputs deleted by hand still count as done. Delete
+    the manifest file to rebuild it from the save directories.
+
+    Entries are keyed by save directory and output file name. The input hash of an
+    entry covers the outputs its request was built from (e.g. the caption and
+    annotation a check read); an entry whose input hash no longer matches the current
+    inputs is not done.
+    """
+
+    def __init__(self, path: str):
+        """Initialize the manifest.
+
+        Args:
+            path: SQLite database file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS outputs ("
+                          "save_dir TEXT NOT NULL, name TEXT NOT NULL, stage TEXT NOT NULL, image TEXT, "
+                          "status TEXT NOT NULL, input_hash TEXT, output_hash TEXT, result TEXT, "
+                          "updated REAL NOT NULL, PRIMARY KEY (save_dir, name))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS save_dirs ("
+                          "save_dir TEXT PRIMARY KEY, stage TEXT NOT NULL, imported REAL NOT NULL)")
+        self.conn.commit()
+        self.imported: Set[str] = {row[0] for row in self.conn.execute("SELECT save_dir FROM save_dirs")}
+        self.entries: Dict[str, Dict[str, ManifestEntry]] = {}
+        for row in self.conn.execute("SELECT save_dir, name, stage, image, status, input_hash, output_hash, result "
+                                     "FROM outputs"):
+            self.entries.setdefault(row[0], {})[row[1]] = ManifestEntry(*row[2:])
+
+    def import_dir(self, stage: str, save_dir: str):
+        """Add the outputs already in ``save_dir`` the first time the directory is used."""
+        save_dir = os.path.abspath(save_dir)
+        if save_dir in self.imported:
+            return
+        with self.lock:
+            if save_dir in self.imported:
+                return
+            names = [name for name in os.listdir(save_dir) if name.endswith(".txt")] if os.path.isdir(save_dir) else []
+            entries = self.entries.setdefault(save_dir, {})
+            rows = []
+            for name in names:
+                if name in entries:
+                    continue
+                result = None
+                if stage in RESULT_STAGES:
+                    with open(os.path.join(save_dir, name), "r") as f:
+                        result = f.read()
+                entries[name] = ManifestEntry(stage, None, "done", None, None, result)
+                rows.append((save_dir, name, stage, None, "done", None, None, result, time.time()))
+            self.conn.executemany("INSERT OR IGNORE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT OR IGNORE INTO save_dirs VALUES (?, ?, ?)", (save_dir, stage, time.time()))
+            self.conn.commit()
+            self.imported.add(save_dir)
+        if rows:
+            print(f"run manifest: imported {len(rows)} existing {stage} outputs from {save_dir}")
+
+    def reload(self, save_dir: str, name: Optional[str] = None):
+        """Read the entries of ``save_dir`` (or only output file ``name``) again, to see rows of other processes."""
+        save_dir = os.path.abspath(save_dir)
+        query = "SELECT name, stage, image, status, input_hash, output_hash, result FROM outputs WHERE save_dir = ?"
+        params = [save_dir]
+        if name is not None:
+            query += " AND name = ?"
+            params.append(name)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+            entries = self.entries.setdefault(save_dir, {})
+            for row in rows:
+                entries[row[0]] = ManifestEntry(*row[1:])
+
+    def get(self, stage: str, save_dir: str, name: str) -> Optional[ManifestEntry]:
+        """Entry of output file ``name`` in ``save_dir``, or None."""
+        self.import_dir(stage, save_dir)
+        return self.entries.get(os.path.abspath(save_dir), {}).get(name)
+
+    def is_done(self, stage: str, save_dir: str, name: str, input_hash: Optional[str] = None) -> bool:
+        """Whether the output exists and was built from the given inputs.
+
+        Entries without an input hash (imported ones) match any inputs.
+        """
+        def matches(entry):
+            if entry is None or entry.status != "done":
+                return False
+            return entry.input_hash is None or input_hash is None or entry.input_hash == input_hash
+        if matches(self.get(stage, save_dir, name)):
+            return True
+        # another process may have written it since the manifest was loaded
+        self.reload(save_dir, name)
+        return matches(self.get(stage, save_dir, name))
+
+    def outputs(self, stage: str, save_dir: str) -> Dict[str, ManifestEntry]:
+        """Done entries of ``save_dir`` by output file name."""
+        self.import_dir(stage, save_dir)
+        self.reload(save_dir)
+        with self.lock:
+            entries = self.entries.get(os.path.abspath(save_dir), {})
+            return {name: entry for name, entry in entries.items() if entry.status == "done"}
+
+    def record(self, stage: str, save_dir: str, name: str, image: Optional[str] = None, status: str = "done",
+               text: Optional[str] = None, input_hash: Optional[str] = None):
+        """Record the outcome of one image.
+
+        Args:
+            stage: Stage that wrote the output
+            save_dir: Directory of the output file
+            name: Output file name
+            image: Image the output is for
+            status: "done" or "failed"
+            text: Text written to the output file, hashed (and kept for ``RESULT_STAGES``)
+            input_hash: Hash of the inputs the request was built from
+        """
+        self.record_many(stage, save_dir, [(name, image, status, text, input_hash)])
+
+    def record_many(self, stage: str, save_dir: str, items: Iterable[Tuple]):
+        """Record (name, image, status, text, input_hash) of several images of one directory."""
+        self.import_dir(stage, save_dir)
+        save_dir = os.path.abspath(save_dir)
+        now = time.time()
+        rows = []
+        with self.lock:
+            entries = self.entries.setdefault(save_dir, {})
+            for name, image, status, text, input_hash in items:
+                output_hash = text_hash(text) if text is not None else None
+                result = text if stage in RESULT_STAGES else None
+                entries[name] = ManifestEntry(stage, image, status, input_hash, output_hash, result)
+                rows.append((save_dir, name, stage, image, status, input_hash, output_hash, result, now))
+            self.conn.executemany("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def summary(self) -> List[tuple]:
+        """(stage, status, count) of every entry."""
+        with self.lock:
+            return self.conn.execute("SELECT stage, status, COUNT(*) FROM outputs GROUP BY stage, status "
+                                     "ORDER BY stage, status").fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_run_manifest() -> Optional[RunManifest]:
+    """Return the run manifest shared by this process, or None when disabled.
+
+    Stored in ``RUN_MANIFEST`` (default ``./run_manifest.sqlite``); an empty value
+    disables it and the output files are checked instead.
+    """
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                path = os.getenv('RUN_MANIFEST', './run_manifest.sqlite')
+                if not path:
+                    return None
+                _manifest = RunManifest(path)
+    return _manifest
+
+
+def completed_outputs(stage: str, *save_dirs: str) -> Set[str]:
+    """Names of the output files done in any of ``save_dirs``, listing each directory at most once."""
+    manifest = get_run_manifest()
+    names = set()
+    for save_dir in save_dirs:
+        if manifest is not None:
+            names.update(manifest.outputs(stage, save_dir))
+        elif os.path.isdir(save_dir):
+            names.update(name for name in os.listdir(save_dir) if name.endswith(".txt"))
+    return names
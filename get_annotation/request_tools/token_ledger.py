@@ -0,0 +1,129 @@
+"""Persistent ledger of the tokens used per image, stage and model."""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def usage_tokens(usage: Optional[Dict]) -> Dict[str, int]:
+    """Prompt, completion, cached prompt and reasoning tokens of a ``usage`` field.
+
+    Reasoning tokens are read from ``completion_tokens_details`` (OpenAI) or the
+    ``thinking_tokens`` added by proxy_gemini.py.
+    """
+    usage = usage or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    completion_details = usage.get("completion_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cached_tokens": prompt_details.get("cached_tokens") or 0,
+        "reasoning_tokens": completion_details.get("reasoning_tokens") or usage.get("thinking_tokens") or 0,
+    }
+
+
+class TokenLedger():
+    """SQLite ledger with one row per chat completion response that used tokens.
+
+    The online tools record every response returned by the API (responses served from
+    the response cache cost nothing and are not recorded), and batch ingest records
+    every successful batch result. Online rows get a generated key, since response ids
+    are not unique for every backend (proxy_gemini.py derives them from the text);
+    batch rows are keyed by batch id and custom id, so re-ingesting a batch does not
+    count it twice. Image tokens are the estimate of the request,
+    since the usage field reports them as part of the prompt tokens.
+    """
+
+    def __init__(self, path: str):
+        """Initialize the ledger.
+
+        Args:
+            path: SQLite database file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS usage ("
+                          "response_id TEXT PRIMARY KEY, created REAL NOT NULL, image TEXT, stage TEXT NOT NULL, "
+                          "model TEXT, source TEXT NOT NULL, prompt_tokens INTEGER NOT NULL, "
+                          "completion_tokens INTEGER NOT NULL, cached_tokens INTEGER NOT NULL, "
+                          "reasoning_tokens INTEGER NOT NULL, image_tokens INTEGER, latency REAL)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_row(res: Dict, stage: str, image: Optional[str], source: str, image_tokens: Optional[int] = None,
+                 latency: Optional[float] = None, key: Optional[str] = None) -> tuple:
+        """Ledger row of one response, keyed by ``key`` (default: a new unique key)."""
+        tokens = usage_tokens(res.get("usage"))
+        key = key or f"{source}-{uuid.uuid4().hex}"
+        return (key, time.time(), image, stage, res.get("model"), source, tokens["prompt_tokens"],
+                tokens["completion_tokens"], tokens["cached_tokens"], tokens["reasoning_tokens"], image_tokens, latency)
+
+    def record(self, res: Dict, stage: str, image: Optional[str] = None, source: str = "online",
+               image_tokens: Optional[int] = None, latency: Optional[float] = None):
+        """Record the usage of one response.
+
+        Args:
+            res: Chat completion response body
+            stage: Stage the request belongs to
+            image: Image the request was for
+            source: "online" or "batch"
+            image_tokens: Estimated prompt tokens of the request's images
+            latency: Seconds the request took, including retries
+        """
+        self.record_rows([self.make_row(res, stage, image, source, image_tokens, latency)])
+
+    def record_rows(self, rows: List[tuple]):
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def summary(self, source: Optional[str] = None) -> List[sqlite3.Row]:
+        """Totals per stage, model and source."""
+        query = ("SELECT stage, model, source, COUNT(*) AS requests, COUNT(DISTINCT image) AS images, "
+                 "SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens, "
+                 "SUM(cached_tokens) AS cached_tokens, SUM(reasoning_tokens) AS reasoning_tokens, "
+                 "SUM(image_tokens) AS image_tokens, AVG(latency) AS latency FROM usage")
+        params = []
+        if source is not None:
+            query += " WHERE source = ?"
+            params.append(source)
+        with self.lock:
+            return self.conn.execute(query + " GROUP BY stage, model, source ORDER BY MIN(created)", params).fetchall()
+
+    def count_images(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(DISTINCT image) FROM usage").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_token_ledger() -> Optional[TokenLedger]:
+    """Return the token ledger shared by this process, or None when disabled.
+
+    Stored in ``TOKEN_LEDGER`` (default ``./token_ledger.sqlite``); an empty value disables it.
+    """
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                path = os.getenv('TOKEN_LEDGER', './token_ledger.sqlite')
+                if not path:
+                    return None
+                _ledger = TokenLedger(path)
+    return _ledger
@@ -0,0 +1,154 @@
+"""Per-image dependency-aware scheduler for the AnnTool stages.
+
+Instead of running every stage over every image with a barrier in between, each
+image walks its own stage graph and starts the next stage as soon as the stages
+it depends on have finished for that image. Images flow through the pipeline
+concurrently, so API capacity stays busy instead of idling at every barrier.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+
+from .request_tools.http_client import get_http_client
+from .request_tools.metrics import get_metrics
+
+COLOR_STAGES = ['color_annotator', 'check_annotation_color', 'regenerate_annotation_color']
+NONCOLOR_STAGES = ['noncolor_annotator', 'check_annotation_noncolor', 'regenerate_annotation_noncolor']
+
+# Stage -> stages it depends on, per scheduling mode. Caption and checkcolor are
+# independent (CheckColor only reads the object info), so both start immediately.
+STAGE_DEPENDENCIES = {
+    'route': {
+        'caption': [],
+        'checkcolor': [],
+        'color_annotator': ['caption', 'checkcolor'],
+        'check_annotation_color': ['color_annotator'],
+        'regenerate_annotation_color': ['check_annotation_color'],
+        'noncolor_annotator': ['caption', 'checkcolor'],
+        'check_annotation_noncolor': ['noncolor_annotator'],
+        'regenerate_annotation_noncolor': ['check_annotation_noncolor'],
+    },
+    'color': {
+        'caption': [],
+        'checkcolor': [],
+        'color_annotator': ['caption', 'checkcolor'],
+        'check_annotation_color': ['color_annotator'],
+        'regenerate_annotation_color': ['check_annotation_color'],
+    },
+    'noncolor': {
+        'caption': [],
+        'noncolor_annotator': ['caption'],
+        'check_annotation_noncolor': ['noncolor_annotator'],
+        'regenerate_annotation_noncolor': ['check_annotation_noncolor'],
+    },
+}
+
+
+class PipelineScheduler():
+    """Run the AnnTool stage graph for many images with bounded concurrency."""
+
+    def __init__(self, anntool, mode: str = 'route', max_in_flight: Optional[int] = None,
+                 max_active_images: Optional[int] = None):
+        """Initialize the scheduler.
+
+        Args:
+            anntool: AnnTool instance whose tools and save directories are used
+            mode: 'route' sends each image to the color or noncolor branch based on its
+                checkcolor result; 'color' only runs the color branch for images checked as
+                color; 'noncolor' runs the noncolor branch without a color check
+            max_in_flight: Maximum number of concurrent API requests across all stages
+                (default: MAX_IN_FLIGHT environment variable, or 32)
+            max_active_images: Maximum number of images inside the pipeline at once
+                (default: 2 * max_in_flight)
+        """
+        if mode not in STAGE_DEPENDENCIES:
+            raise ValueError(f"Unknown scheduling mode: {mode}")
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv('MAX_IN_FLIGHT', '32'))
+        if max_active_images is None:
+            max_active_images = 2 * max_in_flight
+        self.anntool = anntool
+        self.mode = mode
+        self.dependencies = STAGE_DEPENDENCIES[mode]
+        self.max_in_flight = max_in_flight
+        self.max_active_images = max_active_images
+
+    def is_stage_enabled(self, stage: str, image_name: str) -> bool:
+        """Decide whether a branch stage applies to an image once its dependencies are done."""
+        if self.mode == 'noncolor' or stage not in COLOR_STAGES + NONCOLOR_STAGES:
+            return True
+        is_color = self.anntool.is_color_image(image_name)
+        return is_color if stage in COLOR_STAGES else not is_color
+
+    async def arun_image(self, image_name: str, request_semaphore: asyncio.Semaphore) -> Dict[str, Optional[bool]]:
+        """Run every stage of the graph for one image.
+
+        Returns a mapping of stage -> True (done), False (failed) or None (not applicable,
+        or skipped because a dependency failed).
+        """
+        tasks = {}
+
+        async def run_stage(stage):
+            dep_results = await asyncio.gather(*[tasks[dep] for dep in self.dependencies[stage]])
+            if not all(result is True for result in dep_results):
+                return None
+            if not self.is_stage_enabled(stage, image_name):
+                return None
+            async with request_semaphore:
+                try:
+                    await self.anntool.arun_stage_image(stage, image_name)
+                except Exception as e:
+                    logging.error(f"{stage} error in {image_name}: {e}")
+                    return False
+            return True
+
+        # dependencies are declared before their dependents, so tasks[dep] always exists; the
+        # tasks copy the current context, so their stage spans are children of the image span
+        with get_metrics().span("image", image=image_name):
+            for stage in self.dependencies:
+                tasks[stage] = asyncio.ensure_future(run_stage(stage))
+            results = await asyncio.gather(*tasks.values())
+        return dict(zip(tasks.keys(), results))
+
+    async def arun(self, image_names: List[str]) -> Dict[str, Dict[str, Optional[bool]]]:
+        """Run the pipeline for all images and return per-image stage results."""
+        request_semaphore = asyncio.Semaphore(self.max_in_flight)
+        image_semaphore = asyncio.Semaphore(self.max_active_images)
+        total = len(image_names)
+        done = 0
+
+        async def run_one(image_name):
+            nonlocal done
+            async with image_semaphore:
+                results = await self.arun_image(image_name, request_semaphore)
+            done += 1
+            failed = [stage for stage, result in results.items() if result is False]
+            status = f"✗ failed at {', '.join(failed)}" if failed else "✓"
+            print(f"[{done}/{total}] {image_name} {status}")
+            return results
+
+        all_results = await asyncio.gather(*[run_one(image_name) for image_name in image_names])
+        return dict(zip(image_names, all_results))
+
+    def run(self, image_names: List[str]) -> Dict[str, Dict[str, Optional[bool]]]:
+        """Blocking wrapper around :meth:`arun` for synchronous callers."""
+        async def main():
+            try:
+                return await self.arun(image_names)
+            finally:
+                await get_http_client().aclose()
+        return asyncio.run(main())
+
+    @staticmethod
+    def summarize(results: Dict[str, Dict[str, Optional[bool]]]) -> Dict[str, int]:
+        """Count images per branch and images with at least one failed stage."""
+        summary = {'total': len(results), 'color': 0, 'noncolor': 0, 'failed': 0}
+        for stage_results in results.values():
+            if any(result is False for result in stage_results.values()):
+                summary['failed'] += 1
+            if stage_results.get('color_annotator') is not None:
+                summary['color'] += 1
+            if stage_results.get('noncolor_annotator') is not None:
+                summary['noncolor'] += 1
+        return summary
@@ -0,0 +1,95 @@
+"""Report of the token ledger: usage per stage and model, and cost and throughput projections."""
+import os
+import sys
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from .request_tools.token_ledger import TokenLedger, get_token_ledger
+
+
+def get_prices() -> Dict[str, float]:
+    """USD per million tokens and the batch discount, read from the environment.
+
+    ``TOKEN_PRICE_PROMPT``, ``TOKEN_PRICE_CACHED`` and ``TOKEN_PRICE_COMPLETION`` default
+    to the gpt-4o prices; ``BATCH_PRICE_FACTOR`` (default 0.5) scales batch requests.
+    """
+    return {
+        "prompt": float(os.getenv('TOKEN_PRICE_PROMPT', '2.5')),
+        "cached": float(os.getenv('TOKEN_PRICE_CACHED', '1.25')),
+        "completion": float(os.getenv('TOKEN_PRICE_COMPLETION', '10')),
+        "batch_factor": float(os.getenv('BATCH_PRICE_FACTOR', '0.5')),
+    }
+
+
+def row_cost(row, prices: Dict[str, float]) -> float:
+    """Cost in USD of the tokens of a summary row."""
+    uncached = row["prompt_tokens"] - row["cached_tokens"]
+    cost = (uncached * prices["prompt"] + row["cached_tokens"] * prices["cached"]
+            + row["completion_tokens"] * prices["completion"]) / 1e6
+    return cost * prices["batch_factor"] if row["source"] == "batch" else cost
+
+
+def report(ledger: TokenLedger, planned_images: Optional[int] = None, prices: Optional[Dict[str, float]] = None,
+           rpm_limit: Optional[int] = None, tpm_limit: Optional[int] = None):
+    """Print the recorded usage per stage and project cost and throughput for ``planned_images`` images.
+
+    The projection scales the recorded requests, tokens and cost by the ratio of
+    planned to recorded images, which keeps the share of images that reached each stage
+    (e.g. only color images are color-annotated). It assumes the ledger holds one pass
+    over a sample resembling the planned dataset. Throughput is bounded by the RPM and
+    TPM limits.
+    """
+    prices = prices or get_prices()
+    rows = ledger.summary()
+    total_images = ledger.count_images()
+    if not rows:
+        print("The token ledger is empty.")
+        return
+    print(f"{'stage':32s} {'model':20s} {'source':7s} {'images':>7s} {'req/img':>8s} {'prompt/img':>11s} "
+          f"{'image/img':>10s} {'cached/img':>11s} {'compl/img':>10s} {'latency':>8s} {'cost':>10s}")
+    totals = {"requests": 0, "tokens": 0, "cost": 0.0}
+    for row in rows:
+        images = max(row["images"], 1)
+        cost = row_cost(row, prices)
+        totals["requests"] += row["requests"]
+        totals["tokens"] += row["prompt_tokens"] + row["completion_tokens"]
+        totals["cost"] += cost
+        latency = f"{row['latency']:.2f}s" if row["latency"] is not None else "-"
+        image_tokens = f"{(row['image_tokens'] or 0) / images:.0f}" if row["image_tokens"] is not None else "-"
+        print(f"{row['stage']:32s} {str(row['model']):20s} {row['source']:7s} {row['images']:7d} "
+              f"{row['requests'] / images:8.2f} {row['prompt_tokens'] / images:11.0f} {image_tokens:>10s} "
+              f"{row['cached_tokens'] / images:11.0f} {row['completion_tokens'] / images:10.0f} {latency:>8s} "
+              f"${cost:9.2f}")
+    print(f"\nRecorded: {total_images} images, {totals['requests']} requests, "
+          f"{totals['tokens'] / 1e6:.2f}M tokens, ${totals['cost']:.2f} "
+          f"(prices per 1M tokens: prompt ${prices['prompt']}, cached ${prices['cached']}, "
+          f"completion ${prices['completion']}; batch x{prices['batch_factor']})")
+    if not planned_images:
+        return
+    scale = planned_images / total_images
+    plan = {name: value * scale for name, value in totals.items()}
+    print(f"\nProjection for {planned_images} images: {plan['requests']:.0f} requests, "
+          f"{plan['tokens'] / 1e6:.1f}M tokens, ${plan['cost']:.2f}")
+    per_image_requests = plan["requests"] / planned_images
+    per_image_tokens = plan["tokens"] / planned_images
+    bounds = []
+    if rpm_limit:
+        bounds.append(("RPM", rpm_limit / per_image_requests * 60))
+    if tpm_limit:
+        bounds.append(("TPM", tpm_limit / per_image_tokens * 60))
+    for name, images_per_hour in bounds:
+        print(f"  {name} limit: at most {images_per_hour:.0f} images/hour, "
+              f"{planned_images / images_per_hour:.1f} hours for the planned dataset")
+
+
+if __name__ == "__main__":
+    # Usage: python -m get_annotation.token_report [planned number of images]
+    ledger = get_token_ledger()
+    if ledger is None:
+        raise SystemExit("The token ledger is disabled (TOKEN_LEDGER is empty)")
+    planned = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    rpm = os.getenv('OPENAI_RPM_LIMIT')
+    tpm = os.getenv('OPENAI_TPM_LIMIT')
+    report(ledger, planned, rpm_limit=int(rpm) if rpm else None, tpm_limit=int(tpm) if tpm else None)
@@ -0,0 +1,361 @@
+# mock_openai.py
+"""Local stand-in for the OpenAI chat completions, files and batches API.
+
+Answers with canned responses in the shapes the tools parse (Yes/No color checks,
+annotations with coordinates, check results, captions), with a configurable latency
+distribution, injected 429/5xx errors and per-minute request/token limits, so
+throughput, backoff and batch resume behavior can be measured offline.
+
+Point the tools at it with
+    OPENAI_API_URL=http://127.0.0.1:8010/v1/chat/completions
+    OPENAI_BASE_URL=http://127.0.0.1:8010/v1      (batch scripts, via the openai client)
+"""
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import Flask, jsonify, request, send_file
+from dotenv import load_dotenv
+load_dotenv()
+
+from get_annotation.request_tools.rate_limiter import estimate_message_tokens
+
+app = Flask(__name__)
+
+
+def env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+PORT = int(os.getenv('MOCK_PORT', '8010'))
+# Latency of a chat completion: lognormal with this median (ms) and sigma, plus per output token
+LATENCY_MS = env_float('MOCK_LATENCY_MS', 800)
+LATENCY_SIGMA = env_float('MOCK_LATENCY_SIGMA', 0.5)
+LATENCY_PER_TOKEN_MS = env_float('MOCK_LATENCY_PER_TOKEN_MS', 0)
+# Fraction of chat completions answered with 429 / a 500-504 error
+RATE_429 = env_float('MOCK_429_RATE', 0)
+RATE_5XX = env_float('MOCK_5XX_RATE', 0)
+RETRY_AFTER = os.getenv('MOCK_RETRY_AFTER', '1')
+# Requests / tokens per minute; 0 disables the limit
+RPM_LIMIT = int(env_float('MOCK_RPM', 0))
+TPM_LIMIT = int(env_float('MOCK_TPM', 0))
+# Fraction of "Yes" answers of the color check and annotation check
+YES_RATE = env_float('MOCK_YES_RATE', 0.7)
+# Batches: seconds before a batch completes, fraction of failed lines, fraction of batches that expire
+BATCH_DELAY = env_float('MOCK_BATCH_DELAY', 5)
+BATCH_FAIL_RATE = env_float('MOCK_BATCH_FAIL_RATE', 0)
+BATCH_EXPIRE_RATE = env_float('MOCK_BATCH_EXPIRE_RATE', 0)
+FILE_DIR = os.getenv('MOCK_FILE_DIR') or tempfile.mkdtemp(prefix='mock_openai_')
+os.makedirs(FILE_DIR, exist_ok=True)
+
+COORDINATE_PATTERN = re.compile(r"\[\s*(\d*\.\d+|\d+)\s*,\s*(\d*\.\d+|\d+)\s*\]")
+OBJECT_PATTERN = re.compile(r"^([^:\[\n]+?)(?:,\s*([^:\[\n]+))?:\s*(\[.*\])\s*$", re.MULTILINE)
+BLOCK_PATTERN = re.compile(r"^(.+)\nCoordinates:\s*(.+)$", re.MULTILINE)
+
+state_lock = threading.Lock()
+stats = {"requests": 0, "request_bytes": 0, "ok": 0, "429": 0, "5xx": 0, "rate_limited": 0, "prompt_tokens": 0, "completion_tokens": 0}
+files = {}
+batches = {}
+
+
+class MinuteWindow():
+    """Requests and tokens accepted in the last 60 seconds."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.events = deque()
+        self.total = 0
+
+    def expire(self, now):
+        while self.events and self.events[0][0] <= now - 60:
+            self.total -= self.events.popleft()[1]
+
+    def try_add(self, now, amount):
+        self.expire(now)
+        if self.limit and self.total + amount > self.limit:
+            return False
+        self.events.append((now, amount))
+        self.total += amount
+        return True
+
+    def headers(self, now, kind):
+        self.expire(now)
+        if not self.limit:
+            return {}
+        reset = 60 - (now - self.events[0][0]) if self.events else 0
+        return {f"x-ratelimit-limit-{kind}": str(self.limit),
+                f"x-ratelimit-remaining-{kind}": str(max(0, self.limit - self.total)),
+                f"x-ratelimit-reset-{kind}": f"{max(reset, 0):.3f}s"}
+
+
+request_window = MinuteWindow(RPM_LIMIT)
+token_window = MinuteWindow(TPM_LIMIT)
+
+
+def error_response(status, message, error_type, headers=None):
+    response = jsonify({"error": {"message": message, "type": error_type, "code": None}})
+    response.status_code = status
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    return response
+
+
+def message_text(message):
+    content = message.get("content")
+    if isinstance(content, str):
+        return content
+    return "\n".join(part.get("text", "") for part in content or [] if part.get("type") == "text")
+
+
+def annotation_blocks(info, rng):
+    """Descriptions with coordinates built from the "category, color: [x, y]" lines of the info."""
+    groups = {}
+    for category, color, coordinates in OBJECT_PATTERN.findall(info):
+        if category.strip().lower() in ("captions", "objects", "coordinates"):
+            continue
+        key = (category.strip(), color.strip())
+        groups.setdefault(key, []).append(coordinates)
+    if not groups:
+        groups = {("object", ""): [f"[{rng.random():.3f}, {rng.random():.3f}]"]}
+    blocks = []
+    for (category, color), coordinates in rng.sample(sorted(groups.items()), min(3, len(groups))):
+        name = f"{color} {category}" if color else category
+        chosen = coordinates[:rng.randint(1, len(coordinates))]
+        blocks.append(f"The {name} in the image.\nCoordinates: {', '.join(chosen)}")
+    return blocks
+
+
+def canned_content(messages, rng):
+    """Answer in the format of the stage the system message belongs to."""
+    system = message_text(messages[0]) if messages and messages[0].get("role") == "system" else ""
+    query = message_text(messages[-1]) if messages else ""
+    if "assess whether the given colors" in system:
+        return "Yes" if rng.random() < YES_RATE else "No."
+    if "confirm whether the description" in system:
+        results = []
+        for description, coordinates in BLOCK_PATTERN.findall(query):
+            verdict = "Yes" if rng.random() < YES_RATE else f"No, the coordinates provided {coordinates} are not {description.rstrip('.').lower()}."
+            results.append(f"{description}\nCoordinates: {coordinates}\n{verdict}")
+        return "\n\n".join(results) or "Yes"
+    if "Coordinates" in system or "coordinates" in system:
+        return "\n\n".join(annotation_blocks(query, rng))
+    return rng.choice(["The image shows an aerial view of a city street with cars parked along the road.",
+                       "An aerial view of an intersection with several vehicles and pedestrians.",
+                       "The image shows a parking area with rows of cars and a few trucks."])
+
+
+def completion(body, rng):
+    """A chat.completion object for a request body."""
+    messages = body.get("messages") or []
+    choices = []
+    completion_tokens = 0
+    for index in range(body.get("n") or 1):
+        content = canned_content(messages, rng)
+        completion_tokens += len(content) // 4
+        choices.append({"index": index, "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop", "logprobs": None})
+    prompt_tokens = estimate_message_tokens(messages)
+    return {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"), "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}}
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    body = request.get_json(force=True)
+    rng = random.Random()
+    now = time.time()
+    with state_lock:
+        stats["requests"] += 1
+        stats["request_bytes"] += len(request.get_data())
+        tokens = estimate_message_tokens(body.get("messages") or []) + (body.get("n") or 1) * (body.get("max_tokens") or 300)
+        if not request_window.try_add(now, 1):
+            stats["rate_limited"] += 1
+            return error_response(429, "Rate limit reached for requests", "requests",
+                                  {"retry-after": f"{60 - (now - request_window.events[0][0]):.3f}",
+                                   **request_window.headers(now, "requests")})
+        if not token_window.try_add(now, tokens):
+            stats["rate_limited"] += 1
+            return error_response(429, "Rate limit reached for tokens", "tokens",
+                                  {"retry-after": f"{60 - (now - token_window.events[0][0]):.3f}",
+                                   **token_window.headers(now, "tokens")})
+        rate_headers = {**request_window.headers(now, "requests"), **token_window.headers(now, "tokens")}
+
+    roll = rng.random()
+    if roll < RATE_429:
+        with state_lock:
+            stats["429"] += 1
+        return error_response(429, "The server is overloaded", "server_overloaded", {"retry-after": RETRY_AFTER})
+    if roll < RATE_429 + RATE_5XX:
+        with state_lock:
+            stats["5xx"] += 1
+        return error_response(rng.choice([500, 502, 503, 504]), "The server had an error", "server_error")
+
+    result = completion(body, rng)
+    latency = LATENCY_MS * math.exp(rng.gauss(0, LATENCY_SIGMA)) if LATENCY_MS > 0 else 0
+    time.sleep((latency + LATENCY_PER_TOKEN_MS * result["usage"]["completion_tokens"]) / 1000)
+    with state_lock:
+        stats["ok"] += 1
+        stats["prompt_tokens"] += result["usage"]["prompt_tokens"]
+        stats["completion_tokens"] += result["usage"]["completion_tokens"]
+    response = jsonify(result)
+    for name, value in rate_headers.items():
+        response.headers[name] = value
+    return response
+
+
+def file_object(file_id):
+    entry = files[file_id]
+    return {"id": file_id, "object": "file", "bytes": os.path.getsize(entry["path"]), "created_at": entry["created_at"],
+            "filename": entry["filename"], "purpose": entry["purpose"], "status": "processed"}
+
+
+def add_file(filename, purpose, write):
+    file_id = f"file-{uuid.uuid4().hex}"
+    path = os.path.join(FILE_DIR, file_id)
+    write(path)
+    with state_lock:
+        files[file_id] = {"path": path, "filename": filename, "purpose": purpose, "created_at": int(time.time())}
+    return file_id
+
+
+@app.route('/v1/files', methods=['POST'])
+def create_file():
+    upload = request.files.get("file")
+    if upload is None:
+        return error_response(400, "Missing file", "invalid_request_error")
+    file_id = add_file(upload.filename or "upload.jsonl", request.form.get("purpose", "batch"), upload.save)
+    return jsonify(file_object(file_id))
+
+
+@app.route('/v1/files/<file_id>', methods=['GET'])
+def retrieve_file(file_id):
+    if file_id not in files:
+        return error_response(404, f"No such File object: {file_id}", "invalid_request_error")
+    return jsonify(file_object(file_id))
+
+
+@app.route('/v1/files/<file_id>/content', methods=['GET'])
+def file_content(file_id):
+    if file_id not in files:
+        return error_response(404, f"No such File object: {file_id}", "invalid_request_error")
+    return send_file(files[file_id]["path"], mimetype="application/octet-stream")
+
+
+def batch_object(batch_id):
+    return dict(batches[batch_id])
+
+
+def run_batch(batch_id):
+    """Answer every line of a batch's input file after BATCH_DELAY seconds."""
+    rng = random.Random()
+    with state_lock:
+        batches[batch_id].update(status="in_progress", in_progress_at=int(time.time()))
+        input_path = files[batches[batch_id]["input_file_id"]]["path"]
+    time.sleep(BATCH_DELAY)
+    expire = rng.random() < BATCH_EXPIRE_RATE
+    with open(input_path, "r") as f:
+        lines = [line for line in f if line.strip()]
+    if expire:
+        lines = lines[:rng.randint(0, len(lines))]
+    outputs, errors = [], []
+    for line in lines:
+        item = json.loads(line)
+        record = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": item["custom_id"], "error": None}
+        if rng.random() < BATCH_FAIL_RATE:
+            record["response"] = {"status_code": 500, "request_id": uuid.uuid4().hex,
+                                  "body": {"error": {"message": "The server had an error", "type": "server_error"}}}
+            errors.append(record)
+        else:
+            record["response"] = {"status_code": 200, "request_id": uuid.uuid4().hex,
+                                  "body": completion(item["body"], rng)}
+            outputs.append(record)
+
+    def writer(records):
+        def write(path):
+            with open(path, "w") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+        return write
+
+    output_file_id = add_file(f"{batch_id}_output.jsonl", "batch_output", writer(outputs)) if outputs else None
+    error_file_id = add_file(f"{batch_id}_error.jsonl", "batch_output", writer(errors)) if errors else None
+    now = int(time.time())
+    with state_lock:
+        batches[batch_id].update(
+            status="expired" if expire else "completed",
+            output_file_id=output_file_id, error_file_id=error_file_id,
+            request_counts={"total": batches[batch_id]["request_counts"]["total"],
+                            "completed": len(outputs), "failed": len(errors)},
+            **({"expired_at": now} if expire else {"completed_at": now}))
+
+
+@app.route('/v1/batches', methods=['POST'])
+def create_batch():
+    body = request.get_json(force=True)
+    input_file_id = body.get("input_file_id")
+    if input_file_id not in files:
+        return error_response(400, f"No such File object: {input_file_id}", "invalid_request_error")
+    with open(files[input_file_id]["path"], "r") as f:
+        total = sum(1 for line in f if line.strip())
+    batch_id = f"batch_{uuid.uuid4().hex}"
+    now = int(time.time())
+    with state_lock:
+        batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "errors": None, "input_file_id": input_file_id,
+            "completion_window": body.get("completion_window", "24h"), "status": "validating",
+            "output_file_id": None, "error_file_id": None, "created_at": now,
+            "in_progress_at": None, "expires_at": now + 24 * 3600, "finalizing_at": None, "completed_at": None,
+            "failed_at": None, "expired_at": None, "cancelling_at": None, "cancelled_at": None,
+            "request_counts": {"total": total, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+        }
+    threading.Thread(target=run_batch, args=(batch_id,), daemon=True).start()
+    return jsonify(batch_object(batch_id))
+
+
+@app.route('/v1/batches/<batch_id>', methods=['GET'])
+def retrieve_batch(batch_id):
+    if batch_id not in batches:
+        return error_response(404, f"No such Batch object: {batch_id}", "invalid_request_error")
+    return jsonify(batch_object(batch_id))
+
+
+@app.route('/v1/batches', methods=['GET'])
+def list_batches():
+    limit = int(request.args.get("limit", 20))
+    data = sorted(batches.values(), key=lambda batch: batch["created_at"], reverse=True)[:limit]
+    return jsonify({"object": "list", "data": data, "first_id": data[0]["id"] if data else None,
+                    "last_id": data[-1]["id"] if data else None, "has_more": len(batches) > limit})
+
+
+@app.route('/mock/stats', methods=['GET'])
+def get_stats():
+    """Counters of the chat completions served so far."""
+    with state_lock:
+        return jsonify(dict(stats, files=len(files), batches=len(batches)))
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Mock OpenAI API server")
+    print("=" * 60)
+    print(f"Listening on: http://127.0.0.1:{PORT}/v1")
+    print(f"  OPENAI_API_URL=http://127.0.0.1:{PORT}/v1/chat/completions")
+    print(f"  OPENAI_BASE_URL=http://127.0.0.1:{PORT}/v1")
+    print(f"Latency: median {LATENCY_MS} ms, sigma {LATENCY_SIGMA}; 429 rate {RATE_429}, 5xx rate {RATE_5XX}; "
+          f"RPM {RPM_LIMIT or 'unlimited'}, TPM {TPM_LIMIT or 'unlimited'}")
+    print(f"Files stored in: {FILE_DIR}")
+    print("=" * 60)
+
+    app.run(host='127.0.0.1', port=PORT, debug=False, use_reloader=False, threaded=True)
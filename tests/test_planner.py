@@ -0,0 +1,62 @@
+from get_annotation.batch_tools.planner import API_MAX_BYTES, API_MAX_REQUESTS, BatchLimits, BatchPlanner, get_batch_limits
+
+
+def test_fits_up_to_the_request_limit():
+    planner = BatchPlanner(BatchLimits(max_requests=2, max_bytes=None, max_tokens=None))
+    assert planner.fits(10, 10)
+    planner.add(10, 10)
+    assert planner.fits(10, 10)
+    planner.add(10, 10)
+    assert not planner.fits(1, 1)
+
+
+def test_fits_up_to_the_byte_limit():
+    planner = BatchPlanner(BatchLimits(max_requests=None, max_bytes=100, max_tokens=None))
+    planner.add(60, 0)
+    assert planner.fits(40, 0)
+    assert not planner.fits(41, 0)
+
+
+def test_fits_up_to_the_token_limit():
+    planner = BatchPlanner(BatchLimits(max_requests=None, max_bytes=None, max_tokens=1000))
+    planner.add(1, 999)
+    assert planner.fits(1, 1)
+    assert not planner.fits(1, 2)
+
+
+def test_reset_starts_an_empty_shard():
+    planner = BatchPlanner(BatchLimits(max_requests=1, max_bytes=100, max_tokens=100))
+    planner.add(100, 100)
+    assert not planner.fits(1, 1)
+    planner.reset()
+    assert planner.is_empty()
+    assert planner.fits(100, 100)
+
+
+def test_oversized_at_the_byte_and_token_limits():
+    planner = BatchPlanner(BatchLimits(max_requests=1, max_bytes=100, max_tokens=50))
+    assert not planner.oversized(100, 50)
+    assert planner.oversized(101, 50)
+    assert planner.oversized(100, 51)
+
+
+def test_oversized_ignores_the_current_shard():
+    planner = BatchPlanner(BatchLimits(max_requests=1, max_bytes=100, max_tokens=None))
+    planner.add(100, 0)
+    assert not planner.fits(100, 0)
+    assert not planner.oversized(100, 10 ** 9)
+
+
+def test_get_batch_limits(monkeypatch):
+    monkeypatch.delenv('BATCH_MAX_REQUESTS', raising=False)
+    monkeypatch.delenv('BATCH_MAX_MB', raising=False)
+    monkeypatch.delenv('BATCH_MAX_TOKENS', raising=False)
+    limits = get_batch_limits()
+    assert limits.max_requests == API_MAX_REQUESTS
+    assert limits.max_bytes < API_MAX_BYTES
+    assert limits.max_tokens is None
+
+    monkeypatch.setenv('BATCH_MAX_REQUESTS', '10')
+    monkeypatch.setenv('BATCH_MAX_MB', '0.5')
+    monkeypatch.setenv('BATCH_MAX_TOKENS', '2000')
+    assert get_batch_limits() == BatchLimits(max_requests=10, max_bytes=512 * 1024, max_tokens=2000)
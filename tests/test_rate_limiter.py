@@ -0,0 +1,126 @@
+import base64
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from get_annotation.request_tools import rate_limiter
+from get_annotation.request_tools.rate_limiter import (DEFAULT_IMAGE_TOKENS, LOW_DETAIL_IMAGE_TOKENS, RateLimiter,
+                                                       TokenBucket, estimate_image_tokens, image_url_tokens,
+                                                       parse_reset_duration)
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def data_url(width, height):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, format="JPEG")
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_bucket_refills_at_the_limit_per_minute(clock):
+    bucket = TokenBucket(60)
+    bucket.level = 0
+    bucket.refill(clock.now + 10)
+    assert bucket.level == pytest.approx(10)
+    bucket.refill(clock.now + 1000)
+    assert bucket.level == 60
+
+
+def test_bucket_wait_time(clock):
+    bucket = TokenBucket(120)
+    assert bucket.wait_time(120) == 0
+    bucket.level = 20
+    assert bucket.wait_time(80) == pytest.approx(30)
+    # a request larger than the whole limit waits for a full bucket, not forever
+    bucket.level = 120
+    assert bucket.wait_time(10 ** 6) == 0
+
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = TokenBucket(None)
+    bucket.refill(clock.now + 1)
+    assert bucket.wait_time(10 ** 9) == 0
+
+
+def test_try_acquire_reserves_and_waits_for_refill(clock):
+    limiter = RateLimiter(rpm_limit=2, tpm_limit=1000)
+    assert limiter.try_acquire(400) == 0
+    assert limiter.try_acquire(400) == 0
+    # both requests of the minute are used: the next one waits for half a minute
+    assert limiter.try_acquire(100) == pytest.approx(30)
+    clock.now += 30
+    assert limiter.try_acquire(100) == 0
+
+
+def test_try_acquire_waits_for_tokens(clock):
+    limiter = RateLimiter(rpm_limit=None, tpm_limit=600)
+    assert limiter.try_acquire(500) == 0
+    assert limiter.try_acquire(200) == pytest.approx(10)
+    clock.now += 10
+    assert limiter.try_acquire(200) == 0
+
+
+def test_limits_are_learned_from_headers(clock):
+    limiter = RateLimiter()
+    assert limiter.try_acquire(10 ** 6) == 0
+    limiter.update_from_headers({"x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "499",
+                                 "x-ratelimit-limit-tokens": "30000", "x-ratelimit-remaining-tokens": "1000"})
+    assert limiter.requests.limit == 500 and limiter.requests.level == 499
+    assert limiter.tokens.limit == 30000 and limiter.tokens.level == 1000
+    assert limiter.try_acquire(3000) == pytest.approx(4)
+
+
+def test_remaining_header_only_lowers_the_level(clock):
+    limiter = RateLimiter(rpm_limit=100)
+    limiter.requests.level = 10
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "50"})
+    assert limiter.requests.level == 10
+
+
+def test_exhausted_budget_is_held_until_the_reset(clock):
+    limiter = RateLimiter(rpm_limit=60, tpm_limit=None)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "5s"})
+    assert limiter.try_acquire(1) == pytest.approx(6)
+    clock.now += 6
+    assert limiter.try_acquire(1) == 0
+
+
+def test_invalid_headers_are_ignored(clock):
+    limiter = RateLimiter(rpm_limit=60)
+    limiter.update_from_headers({"x-ratelimit-limit-requests": "n/a", "x-ratelimit-remaining-requests": "?"})
+    assert limiter.requests.limit == 60
+
+
+@pytest.mark.parametrize("value,seconds", [("1s", 1), ("6m0s", 360), ("20ms", 0.02), ("1h2m3.5s", 3723.5),
+                                           ("", None), ("soon", None)])
+def test_parse_reset_duration(value, seconds):
+    assert parse_reset_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_estimate_image_tokens():
+    assert estimate_image_tokens(4000, 3000, "low") == LOW_DETAIL_IMAGE_TOKENS
+    # fit in 2048x2048, then the short side scaled to 768: 768x1536 is 2x3 tiles
+    assert estimate_image_tokens(2048, 4096) == 85 + 170 * 6
+    assert estimate_image_tokens(1024, 1024) == 85 + 170 * 4
+    assert estimate_image_tokens(512, 512) == 85 + 170
+
+
+def test_image_url_tokens():
+    assert image_url_tokens(data_url(1024, 1024), "high") == estimate_image_tokens(1024, 1024)
+    assert image_url_tokens(data_url(1024, 1024), "low") == LOW_DETAIL_IMAGE_TOKENS
+    assert image_url_tokens("https://example.com/image.jpg", "high") == DEFAULT_IMAGE_TOKENS
+    assert image_url_tokens("data:image/jpeg;base64,bm90IGFuIGltYWdl", "high") == DEFAULT_IMAGE_TOKENS
@@ -0,0 +1,146 @@
+import asyncio
+
+import httpx
+import pytest
+
+from get_annotation.request_tools import retry
+from get_annotation.request_tools.retry import (FatalAPIError, RetryableAPIError, RetryPolicy, check_response,
+                                                classify_exception, parse_retry_after)
+
+OK_BODY = {"choices": [{"message": {"content": "ok"}, "finish_reason": "stop"}]}
+
+
+def response(status_code, body=None, headers=None):
+    return httpx.Response(status_code, json=body if body is not None else {"error": {"message": "x"}},
+                          headers=headers)
+
+
+@pytest.mark.parametrize("status_code", [408, 409, 429, 500, 502, 503, 504, 529])
+def test_retryable_status_codes(status_code):
+    with pytest.raises(RetryableAPIError) as info:
+        check_response(response(status_code))
+    assert info.value.status_code == status_code
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 403, 404, 422])
+def test_fatal_status_codes(status_code):
+    with pytest.raises(FatalAPIError):
+        check_response(response(status_code))
+
+
+def test_content_filter_is_fatal():
+    body = {"choices": [{"message": {"content": ""}, "finish_reason": "content_filter"}]}
+    with pytest.raises(FatalAPIError):
+        check_response(response(200, body))
+
+
+def test_malformed_200_is_retryable():
+    with pytest.raises(RetryableAPIError):
+        check_response(response(200, {"error": "upstream"}))
+    with pytest.raises(RetryableAPIError):
+        check_response(httpx.Response(200, text="<html>bad gateway</html>"))
+
+
+def test_successful_body_is_returned():
+    assert check_response(response(200, OK_BODY)) == OK_BODY
+
+
+def test_transport_errors_are_retryable():
+    request = httpx.Request("POST", "http://test")
+    for error in (httpx.ReadTimeout("timed out", request=request), httpx.ConnectError("refused", request=request),
+                  httpx.RemoteProtocolError("closed", request=request)):
+        assert isinstance(classify_exception(error), RetryableAPIError)
+    error = ValueError("bug")
+    assert classify_exception(error) is error
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(httpx.Headers({"retry-after-ms": "1500"})) == 1.5
+    assert parse_retry_after(httpx.Headers({"retry-after": "7"})) == 7.0
+    assert parse_retry_after(httpx.Headers({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert parse_retry_after(httpx.Headers({"retry-after": "soon"})) is None
+    assert parse_retry_after(httpx.Headers()) is None
+
+
+def test_retry_after_is_honoured():
+    with pytest.raises(RetryableAPIError) as info:
+        check_response(response(429, headers={"retry-after": "3"}))
+    policy = RetryPolicy(max_delay=60)
+    assert policy.get_delay(1, info.value) == 3.0
+    assert RetryPolicy(max_delay=2).get_delay(1, info.value) == 2.0
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(base_delay=1, max_delay=5)
+    error = RetryableAPIError("busy")
+    for attempt in range(1, 10):
+        assert 0 <= policy.get_delay(attempt, error) <= min(5, 2 ** (attempt - 1))
+
+
+def test_call_retries_until_success(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(retry.time, "sleep", sleeps.append)
+    results = [RetryableAPIError("busy", 429, retry_after=0.5), httpx.ReadTimeout("timed out"), OK_BODY]
+
+    def fn():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert RetryPolicy(max_attempts=3).call(fn) == OK_BODY
+    assert len(sleeps) == 2 and sleeps[0] == 0.5
+
+
+def test_call_does_not_retry_fatal_errors(monkeypatch):
+    monkeypatch.setattr(retry.time, "sleep", lambda seconds: pytest.fail("slept before a fatal error"))
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise FatalAPIError("bad request", 400)
+
+    with pytest.raises(FatalAPIError):
+        RetryPolicy().call(fn)
+    assert len(calls) == 1
+
+
+def test_call_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(retry.time, "sleep", lambda seconds: None)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise RetryableAPIError("busy", 503)
+
+    with pytest.raises(RetryableAPIError):
+        RetryPolicy(max_attempts=4).call(fn)
+    assert len(calls) == 4
+
+
+def test_call_gives_up_when_retry_after_exceeds_the_budget(monkeypatch):
+    monkeypatch.setattr(retry.time, "sleep", lambda seconds: pytest.fail("slept past the time budget"))
+
+    def fn():
+        raise RetryableAPIError("busy", 429, retry_after=30)
+
+    with pytest.raises(RetryableAPIError):
+        RetryPolicy(max_total_time=10).call(fn)
+
+
+def test_acall_retries(monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+    monkeypatch.setattr(retry.asyncio, "sleep", fake_sleep)
+    results = [RetryableAPIError("busy", 500, retry_after=0.25), OK_BODY]
+
+    async def fn():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert asyncio.run(RetryPolicy().acall(fn)) == OK_BODY
+    assert sleeps == [0.25]